@@ -0,0 +1,118 @@
+"""
+Approvals
+Indexed approval inbox: pending approvals ordered by age and priority, with per-approver queues
+"""
+
+import json
+import time
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import redis
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = "approvals:pending"
+APPROVER_KEY = "approvals:approver:{approver}"
+REQUEST_KEY = "approvals:request:{approval_id}"
+DECISION_KEY = "approval:{task_id}:{step_id}"
+
+def approval_id(task_id: str, step_id: str) -> str:
+    return f"{task_id}:{step_id}"
+
+class ApprovalInbox:
+    """Pending approvals live in one sorted set (and one per approver) scored by enqueue time
+    minus priority * priority_boost_seconds, so the oldest, most urgent requests sort first and a
+    priority level is worth that much waiting time. Decisions stay at approval:{task_id}:{step_id}.
+
+    The approver is looked up by task type in approvers, else default_approver, and the priority
+    is the caller's; neither is taken from the step, whose parameters come from the submitter."""
+
+    def __init__(self, redis_client: redis.Redis, default_approver: str = "operators",
+                 priority_boost_seconds: float = 3600.0, approvers: Optional[Dict[str, str]] = None):
+        self.redis = redis_client
+        self.default_approver = default_approver
+        self.priority_boost_seconds = priority_boost_seconds
+        self.approvers = approvers or {}
+
+    def enqueue(self, task_id: str, step: Dict[str, Any], user_id: Optional[str] = None,
+                task_type: Optional[str] = None, priority: int = 0) -> Dict[str, Any]:
+        """Index a step waiting for approval; re-enqueueing keeps its original place"""
+        step_id = str(step.get("step_id"))
+        parameters = step.get("parameters") or {}
+        approver = self.approvers.get(task_type or "", self.default_approver)
+        aid = approval_id(task_id, step_id)
+        score = time.time() - priority * self.priority_boost_seconds
+        request = {
+            "approval_id": aid,
+            "task_id": task_id,
+            "step_id": step_id,
+            "step_type": step.get("type", ""),
+            "user_id": user_id or "",
+            "approver": approver,
+            "priority": priority,
+            "amount": parameters.get("amount", ""),
+            "created_at": datetime.utcnow().isoformat()
+        }
+        if not self.redis.zadd(PENDING_KEY, {aid: score}, nx=True):
+            return request
+        with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(REQUEST_KEY.format(approval_id=aid), mapping={
+                key: str(value) for key, value in request.items()
+            })
+            pipe.zadd(APPROVER_KEY.format(approver=approver), {aid: score})
+            pipe.execute()
+        return request
+
+    def pending(self, approver: Optional[str] = None, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """Pending requests, most urgent first"""
+        key = APPROVER_KEY.format(approver=approver) if approver else PENDING_KEY
+        ids = self.redis.zrange(key, offset, offset + limit - 1)
+        if not ids:
+            return []
+        with self.redis.pipeline(transaction=False) as pipe:
+            for aid in ids:
+                pipe.hgetall(REQUEST_KEY.format(approval_id=aid))
+            requests = pipe.execute()
+        return [request for request in requests if request]
+
+    def count(self, approver: Optional[str] = None) -> int:
+        return self.redis.zcard(APPROVER_KEY.format(approver=approver) if approver else PENDING_KEY)
+
+    def resolve_many(self, decisions: List[Dict[str, Any]], user_id: str) -> List[Dict[str, Any]]:
+        """Record decisions ({task_id, step_id, approved, reason}) and drop them from the index,
+        in two pipelined round trips however many there are"""
+        timestamp = datetime.utcnow().isoformat()
+        with self.redis.pipeline(transaction=False) as pipe:
+            for decision in decisions:
+                pipe.hget(REQUEST_KEY.format(approval_id=approval_id(decision["task_id"], decision["step_id"])), "approver")
+            approvers = pipe.execute()
+
+        records = []
+        with self.redis.pipeline(transaction=True) as pipe:
+            for decision, approver in zip(decisions, approvers):
+                aid = approval_id(decision["task_id"], decision["step_id"])
+                record = {
+                    "task_id": decision["task_id"],
+                    "step_id": decision["step_id"],
+                    "approved": decision["approved"],
+                    "reason": decision.get("reason", ""),
+                    "user_id": user_id,
+                    "timestamp": timestamp
+                }
+                pipe.set(DECISION_KEY.format(task_id=decision["task_id"], step_id=decision["step_id"]), json.dumps({
+                    key: record[key] for key in ("approved", "reason", "user_id", "timestamp")
+                }))
+                pipe.zrem(PENDING_KEY, aid)
+                if approver:
+                    pipe.zrem(APPROVER_KEY.format(approver=approver), aid)
+                pipe.delete(REQUEST_KEY.format(approval_id=aid))
+                records.append(record)
+            pipe.execute()
+        return records
+
+    def resolve(self, task_id: str, step_id: str, approved: bool, reason: str, user_id: str) -> Dict[str, Any]:
+        return self.resolve_many(
+            [{"task_id": task_id, "step_id": step_id, "approved": approved, "reason": reason}],
+            user_id
+        )[0]
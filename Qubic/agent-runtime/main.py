@@ -4,16 +4,28 @@ Nostramos multi-agent orchestration runtime
 """
 
 import os
+import asyncio
 import logging
 import httpx
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 import redis
 import json
+import time
 import uuid
 from datetime import datetime
 from enum import Enum
+from velocity import build_limiter, velocity_subjects
+from approvals import ApprovalInbox
+from scheduler import PRIORITY_CLASSES, FairScheduler, parse_priorities, priority_class
+import serve
+import tracing
+import metrics
+import profiling
+import deadlines
+import resilience
+import wire
 
 # Configure logging
 logging.basicConfig(
@@ -28,10 +40,77 @@ app = FastAPI(title="Agent Runtime", version="1.0.0")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 WORKER_SERVICE_URL = os.getenv("WORKER_SERVICE_URL", "http://localhost:8003")
 AUDIT_SERVICE_URL = os.getenv("AUDIT_SERVICE_URL", "http://localhost:8002")
+AUTO_APPROVE_MAX_AMOUNT = float(os.getenv("AUTO_APPROVE_MAX_AMOUNT", "100"))
+VELOCITY_MODE = os.getenv("VELOCITY_MODE", "redis")
+VELOCITY_WINDOW_SECONDS = float(os.getenv("VELOCITY_WINDOW_SECONDS", "3600"))
+VELOCITY_RETENTION_SECONDS = float(os.getenv("VELOCITY_RETENTION_SECONDS", "86400"))  # keep at least Qubic's POLICY_VELOCITY_RETENTION_SECONDS
+VELOCITY_MAX_COUNT = int(os.getenv("VELOCITY_MAX_COUNT", "5"))
+VELOCITY_MAX_AMOUNT = float(os.getenv("VELOCITY_MAX_AMOUNT", "500"))
+APPROVAL_DEFAULT_APPROVER = os.getenv("APPROVAL_DEFAULT_APPROVER", "operators")
+# Approver queue per task type, e.g. "transfer_funds=treasury"; APPROVAL_DEFAULT_APPROVER for the rest
+APPROVAL_ROUTES = {
+    task_type.strip(): approver.strip()
+    for task_type, approver in (entry.split("=", 1) for entry in os.getenv("APPROVAL_ROUTES", "").split(",") if "=" in entry)
+}
+APPROVAL_PRIORITY_BOOST_SECONDS = float(os.getenv("APPROVAL_PRIORITY_BOOST_SECONDS", "3600"))
+MAX_BULK_APPROVALS = int(os.getenv("MAX_BULK_APPROVALS", "1000"))
+MAX_CONCURRENT_PLANS = int(os.getenv("MAX_CONCURRENT_PLANS", "8"))  # plans executing at once per worker; 0 for no limit
+PRIORITY_AGING_SECONDS = float(os.getenv("PRIORITY_AGING_SECONDS", "10"))  # waiting this long raises a plan one class
+TASK_PRIORITIES = parse_priorities(os.getenv("TASK_PRIORITIES", "transfer_funds=interactive,monitor_wallet=batch"))
+# Relative shares of execution slots per user, e.g. "ops_bot=0.5,desk_user=2"; 1 for anyone not listed
+FAIR_SHARE_WEIGHTS = {
+    user.strip(): float(weight)
+    for user, weight in (entry.split("=", 1) for entry in os.getenv("FAIR_SHARE_WEIGHTS", "").split(",") if "=" in entry)
+}
+
+# Tasks executing, scored by start time; read by the gateway's admission control
+EXECUTING_KEY = "runtime:executing"
 
 # Redis client
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+# Spend-rate counters per user and destination wallet for transfer auto-approval
+velocity_limiter = build_limiter(
+    VELOCITY_MODE,
+    redis_client,
+    window_seconds=VELOCITY_WINDOW_SECONDS,
+    max_count=VELOCITY_MAX_COUNT,
+    max_amount=VELOCITY_MAX_AMOUNT,
+    retention_seconds=VELOCITY_RETENTION_SECONDS
+)
+
+# Index of steps waiting for a human decision
+approval_inbox = ApprovalInbox(
+    redis_client,
+    default_approver=APPROVAL_DEFAULT_APPROVER,
+    priority_boost_seconds=APPROVAL_PRIORITY_BOOST_SECONDS,
+    approvers=APPROVAL_ROUTES
+)
+
+# Execution slots by priority class, shared fairly between users
+scheduler = FairScheduler(
+    max_concurrent=MAX_CONCURRENT_PLANS,
+    aging_seconds=PRIORITY_AGING_SECONDS,
+    weights=FAIR_SHARE_WEIGHTS
+)
+
+# Metrics
+AGENT_DISPATCH_SECONDS = metrics.Histogram(
+    "qubic_agent_dispatch_duration_seconds", "AgentRegistry.dispatch latency by agent type", ("agent_type",)
+)
+APPROVALS_PENDING = metrics.Gauge(
+    "qubic_approvals_pending", "Steps waiting for a human decision", function=approval_inbox.count, shared=True
+)
+QUEUE_WAIT_SECONDS = metrics.Histogram(
+    "qubic_runtime_queue_wait_seconds", "Time plans waited for an execution slot, by priority class", ("priority",)
+)
+PLANS_WAITING = metrics.Gauge(
+    "qubic_runtime_plans_waiting", "Plans waiting for an execution slot", function=scheduler.waiting
+)
+PLANS_RUNNING = metrics.Gauge(
+    "qubic_runtime_plans_running", "Plans holding an execution slot", function=lambda: scheduler.running
+)
+
 # Agent types
 class AgentType(str, Enum):
     PLANNER = "planner_agent"
@@ -53,6 +132,9 @@ class TaskStatus(str, Enum):
 class PlanExecuteRequest(BaseModel):
     task_id: str
     plan: Dict[str, Any]
+    user_id: Optional[str] = None
+    task_type: Optional[str] = None
+    priority: Optional[str] = None
 
 class StepExecution(BaseModel):
     step_id: str
@@ -73,6 +155,27 @@ class ApprovalRequest(BaseModel):
     reason: str
     user_id: str
 
+class ApprovalDecision(BaseModel):
+    task_id: str
+    step_id: Optional[str] = None
+    approved: bool
+    reason: str = ""
+
+class BulkApprovalRequest(BaseModel):
+    decisions: List[ApprovalDecision]
+    user_id: str
+
+class BulkApprovalResult(BaseModel):
+    task_id: str
+    step_id: Optional[str] = None
+    status: str
+    error: Optional[str] = None
+
+class BulkApprovalResponse(BaseModel):
+    processed: int
+    skipped: int
+    results: List[BulkApprovalResult]
+
 # Agent registry (simplified Nostramos-style)
 class AgentRegistry:
     def __init__(self):
@@ -89,7 +192,9 @@ class AgentRegistry:
             raise ValueError(f"Unknown agent type: {agent_type}")
         
         handler = self.agents[agent_type]
-        return await handler(task_id, step, context)
+        with tracing.span(f"agent.{agent_type}", step_id=str(step.get("step_id")), step_type=step.get("type", "")), \
+                AGENT_DISPATCH_SECONDS.labels(agent_type).time():
+            return await handler(task_id, step, context)
 
 # Global agent registry
 agent_registry = AgentRegistry()
@@ -111,14 +216,14 @@ async def execution_agent_handler(task_id: str, step: Dict, context: Dict) -> Di
         async with httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(
                 f"{WORKER_SERVICE_URL}/execute",
-                json={
+                **wire.body({
                     "task_id": task_id,
                     "step": step,
                     "context": context
-                }
+                })
             )
             response.raise_for_status()
-            return response.json()
+            return wire.decode(response)
     except httpx.HTTPError as e:
         logger.error(f"Execution agent failed: {e}")
         return {
@@ -134,16 +239,16 @@ async def audit_agent_handler(task_id: str, step: Dict, context: Dict) -> Dict:
         async with httpx.AsyncClient(timeout=10.0) as client:
             response = await client.post(
                 f"{AUDIT_SERVICE_URL}/audit/record",
-                json={
+                **wire.body({
                     "task_id": task_id,
                     "step_index": int(step.get("step_id", 0)),
                     "step_type": step.get("type"),
                     "input_data": context.get("input_data", {}),
                     "output_data": context.get("output_data", {})
-                }
+                })
             )
             response.raise_for_status()
-            return response.json()
+            return wire.decode(response)
     except httpx.HTTPError as e:
         logger.error(f"Audit agent failed: {e}")
         return {
@@ -151,6 +256,81 @@ async def audit_agent_handler(task_id: str, step: Dict, context: Dict) -> Dict:
             "error": str(e)
         }
 
+def transfer_velocity(step: Dict, context: Dict) -> Optional[Tuple[List[str], float]]:
+    """(velocity subjects, amount) of a transfer step, or None for any other step"""
+    if step.get("type") != "onchain_action":
+        return None
+    parameters = step.get("parameters") or {}
+    try:
+        amount = float(parameters.get("amount"))
+    except (TypeError, ValueError):
+        return None
+    subjects = velocity_subjects(context.get("user_id"), parameters.get("to_address"))
+    if amount <= 0 or not subjects:
+        return None
+    return subjects, amount
+
+def auto_approve(task_id: str, step: Dict, context: Dict) -> Optional[Dict]:
+    """Approve a low-value transfer within the user's and wallet's spend rate, recording the
+    approval like a human one; None if the step needs a human, as it always does when the
+    planner's policy evaluation asked for approval.
+
+    The transfer is counted toward the velocity windows at once, so concurrent transfers
+    cannot all slip under the limits; settle_velocity takes it back if the step fails. The
+    event is returned as velocity_event and not stored with the approval."""
+    transfer = transfer_velocity(step, context)
+    if transfer is None or AUTO_APPROVE_MAX_AMOUNT <= 0 or step.get("policy_decision") == "require_approval":
+        return None
+    subjects, amount = transfer
+    if amount > AUTO_APPROVE_MAX_AMOUNT:
+        return None
+    try:
+        decision = velocity_limiter.check_and_record(subjects, amount)
+    except redis.RedisError as e:
+        logger.warning(f"Velocity check unavailable, task {task_id} needs approval: {e}")
+        return None
+    if not decision.allowed:
+        logger.info(f"Velocity limit reached for {decision.subject} ({decision.count} transfers, {decision.total} total)")
+        return None
+    
+    approval_data = {
+        "approved": True,
+        "reason": f"Auto-approved: {amount} within velocity limits",
+        "user_id": "system:velocity",
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    redis_client.set(f"approval:{task_id}:{step.get('step_id')}", json.dumps(approval_data))
+    return {**approval_data, "velocity_event": decision.event}
+
+def settle_velocity(step: Dict, context: Dict, event: Optional[str], succeeded: bool):
+    """Count an executed transfer toward its velocity windows, which the Qubic policy engine
+    also reads; a transfer counted when it was auto-approved is taken back if it failed"""
+    transfer = transfer_velocity(step, context)
+    if transfer is None:
+        return
+    subjects, amount = transfer
+    try:
+        if event is not None and not succeeded:
+            velocity_limiter.release(subjects, event)
+        elif event is None and succeeded:
+            velocity_limiter.record(subjects, amount)
+    except redis.RedisError as e:
+        logger.warning(f"Velocity windows not updated for step {step.get('step_id')}: {e}")
+
+def approval_priority(task_type: Optional[str]) -> int:
+    """Inbox priority of a task type's steps: 0 for batch, one more per more urgent class. Taken
+    from TASK_PRIORITIES alone, as the priority a submitter asks for is theirs to choose"""
+    return len(PRIORITY_CLASSES) - 1 - PRIORITY_CLASSES.index(priority_class(task_type, None, TASK_PRIORITIES))
+
+async def persist_approvals(records: List[Dict]):
+    """Write approval decisions to the approvals table through audit-service"""
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await client.post(f"{AUDIT_SERVICE_URL}/approvals:batch", json={"approvals": records})
+            response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.error(f"Failed to persist {len(records)} approvals: {e}")
+
 async def compliance_agent_handler(task_id: str, step: Dict, context: Dict) -> Dict:
     """Compliance agent - checks compliance rules"""
     logger.info(f"Compliance agent processing step {step.get('step_id')} for task {task_id}")
@@ -164,6 +344,18 @@ async def compliance_agent_handler(task_id: str, step: Dict, context: Dict) -> D
         approval = redis_client.get(approval_key)
         
         if not approval:
+            auto_approval = auto_approve(task_id, step, context)
+            if auto_approval is not None:
+                velocity_event = auto_approval.pop("velocity_event")
+                await persist_approvals([{"task_id": task_id, "step_id": str(step.get("step_id")), **auto_approval}])
+                return {
+                    "status": "compliant",
+                    "approved": True,
+                    "auto_approved": True,
+                    "velocity_event": velocity_event
+                }
+            task_type = context.get("task_type")
+            approval_inbox.enqueue(task_id, step, context.get("user_id"), task_type, approval_priority(task_type))
             return {
                 "status": "waiting_approval",
                 "requires_approval": True
@@ -188,19 +380,25 @@ agent_registry.register(AgentType.AUDIT, audit_agent_handler)
 agent_registry.register(AgentType.COMPLIANCE, compliance_agent_handler)
 
 # Plan execution logic
-async def execute_plan(task_id: str, plan: Dict) -> Dict:
+async def execute_plan(task_id: str, plan: Dict, user_id: Optional[str] = None,
+                       task_type: Optional[str] = None) -> Dict:
     """Execute plan steps sequentially"""
     steps = plan.get("steps", [])
     total_steps = len(steps)
     
     # Initialize task state
+    context = {}
+    if user_id:
+        context["user_id"] = user_id
+    if task_type:
+        context["task_type"] = task_type
     task_state = {
         "task_id": task_id,
         "status": TaskStatus.EXECUTING.value,
         "current_step": 0,
         "total_steps": total_steps,
         "steps": [],
-        "context": {}
+        "context": context
     }
     
     redis_client.hset(f"task_runtime:{task_id}", mapping={
@@ -214,72 +412,86 @@ async def execute_plan(task_id: str, plan: Dict) -> Dict:
         step_id = step.get("step_id", str(idx + 1))
         logger.info(f"Executing step {step_id} for task {task_id}")
         
-        # Update current step
-        task_state["current_step"] = idx + 1
-        redis_client.hset(f"task_runtime:{task_id}", "current_step", str(idx + 1))
-        
-        # Compliance check
-        compliance_result = await agent_registry.dispatch(
-            AgentType.COMPLIANCE.value,
-            task_id,
-            step,
-            task_state["context"]
-        )
-        
-        if compliance_result.get("status") == "waiting_approval":
-            task_state["status"] = TaskStatus.WAITING_APPROVAL.value
-            redis_client.hset(f"task_runtime:{task_id}", "status", TaskStatus.WAITING_APPROVAL.value)
-            break
-        
-        if compliance_result.get("status") == "rejected":
-            task_state["status"] = TaskStatus.REJECTED.value
-            redis_client.hset(f"task_runtime:{task_id}", "status", TaskStatus.REJECTED.value)
-            break
-        
-        # Execute step
-        execution_result = await agent_registry.dispatch(
-            AgentType.EXECUTION.value,
-            task_id,
-            step,
-            task_state["context"]
-        )
-        
-        # Update context with result
-        task_state["context"][f"step_{step_id}"] = execution_result
-        
-        # Audit step
-        audit_result = await agent_registry.dispatch(
-            AgentType.AUDIT.value,
-            task_id,
-            step,
-            {
-                "input_data": step,
-                "output_data": execution_result
+        with tracing.span("plan.step", task_id=task_id, step_id=str(step_id), step_type=step.get("type", "")):
+            # Don't start a step the caller has stopped waiting for
+            deadlines.check(f"step {step_id}")
+            
+            # Update current step
+            task_state["current_step"] = idx + 1
+            redis_client.hset(f"task_runtime:{task_id}", "current_step", str(idx + 1))
+            
+            # Compliance check
+            compliance_result = await agent_registry.dispatch(
+                AgentType.COMPLIANCE.value,
+                task_id,
+                step,
+                task_state["context"]
+            )
+            
+            if compliance_result.get("status") == "waiting_approval":
+                task_state["status"] = TaskStatus.WAITING_APPROVAL.value
+                # Approvals are keyed by the plan's step_id, which need not be the step's position
+                redis_client.hset(f"task_runtime:{task_id}", mapping={
+                    "status": TaskStatus.WAITING_APPROVAL.value,
+                    "waiting_step_id": str(step_id)
+                })
+                break
+            
+            if compliance_result.get("status") == "rejected":
+                task_state["status"] = TaskStatus.REJECTED.value
+                redis_client.hset(f"task_runtime:{task_id}", "status", TaskStatus.REJECTED.value)
+                break
+            
+            # Execute step
+            velocity_event = compliance_result.get("velocity_event")
+            try:
+                execution_result = await agent_registry.dispatch(
+                    AgentType.EXECUTION.value,
+                    task_id,
+                    step,
+                    task_state["context"]
+                )
+            except BaseException:
+                settle_velocity(step, task_state["context"], velocity_event, succeeded=False)
+                raise
+            settle_velocity(step, task_state["context"], velocity_event, execution_result.get("status") != "failed")
+            
+            # Update context with result
+            task_state["context"][f"step_{step_id}"] = execution_result
+            
+            # Audit step
+            audit_result = await agent_registry.dispatch(
+                AgentType.AUDIT.value,
+                task_id,
+                step,
+                {
+                    "input_data": step,
+                    "output_data": execution_result
+                }
+            )
+            
+            # Record step execution
+            step_execution = {
+                "step_id": step_id,
+                "status": execution_result.get("status", "unknown"),
+                "result": execution_result.get("result"),
+                "error": execution_result.get("error")
             }
-        )
-        
-        # Record step execution
-        step_execution = {
-            "step_id": step_id,
-            "status": execution_result.get("status", "unknown"),
-            "result": execution_result.get("result"),
-            "error": execution_result.get("error")
-        }
-        
-        task_state["steps"].append(step_execution)
-        
-        # Update Redis
-        redis_client.hset(
-            f"task_runtime:{task_id}",
-            "steps",
-            json.dumps(task_state["steps"])
-        )
-        
-        # Check for failures
-        if execution_result.get("status") == "failed":
-            task_state["status"] = TaskStatus.FAILED.value
-            redis_client.hset(f"task_runtime:{task_id}", "status", TaskStatus.FAILED.value)
-            break
+            
+            task_state["steps"].append(step_execution)
+            
+            # Update Redis
+            redis_client.hset(
+                f"task_runtime:{task_id}",
+                "steps",
+                json.dumps(task_state["steps"])
+            )
+            
+            # Check for failures
+            if execution_result.get("status") == "failed":
+                task_state["status"] = TaskStatus.FAILED.value
+                redis_client.hset(f"task_runtime:{task_id}", "status", TaskStatus.FAILED.value)
+                break
     
     # Mark as completed if all steps succeeded
     if task_state["status"] == TaskStatus.EXECUTING.value:
@@ -298,17 +510,49 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         return {"status": "unhealthy", "error": str(e)}, 503
 
+@app.get("/velocity")
+async def velocity_stats():
+    """Transfer auto-approval velocity limiter statistics"""
+    return {"auto_approve_max_amount": AUTO_APPROVE_MAX_AMOUNT, **velocity_limiter.stats()}
+
+async def acquire_slot(task_id: str, user_id: Optional[str], priority: str, cost: float):
+    """Wait for an execution slot, no longer than the request's deadline allows"""
+    with tracing.span("plan.queue", task_id=task_id, priority=priority):
+        try:
+            waited = await scheduler.acquire(priority, user_id, cost=cost, timeout=deadlines.remaining())
+        except asyncio.TimeoutError:
+            raise deadlines.DeadlineExceeded(f"Deadline exceeded waiting for an execution slot ({priority} priority)")
+    QUEUE_WAIT_SECONDS.labels(priority).observe(waited)
+
 @app.post("/plan/execute")
 async def execute_plan_endpoint(request: PlanExecuteRequest):
     """Execute a plan"""
     logger.info(f"Executing plan for task: {request.task_id}")
+    priority = priority_class(request.task_type, request.priority, TASK_PRIORITIES)
     
-    # Execute plan asynchronously (in production, use background tasks)
-    task_state = await execute_plan(request.task_id, request.plan)
+    # Execute plan asynchronously (in production, use background tasks). The executing set,
+    # plans waiting for a slot included, is the queue depth the gateway sheds load on
+    redis_client.zadd(EXECUTING_KEY, {request.task_id: time.time()})
+    try:
+        await acquire_slot(request.task_id, request.user_id, priority, max(1, len(request.plan.get("steps", []))))
+        try:
+            task_state = await execute_plan(request.task_id, request.plan, request.user_id, request.task_type)
+        finally:
+            scheduler.release()
+    except deadlines.DeadlineExceeded as e:
+        logger.error(f"Task {request.task_id} ran out of budget: {e}")
+        redis_client.hset(f"task_runtime:{request.task_id}", mapping={
+            "status": TaskStatus.FAILED.value,
+            "error": str(e)
+        })
+        raise
+    finally:
+        redis_client.zrem(EXECUTING_KEY, request.task_id)
     
     return {
         "task_id": request.task_id,
         "status": task_state["status"],
+        "priority": priority,
         "message": "Plan execution started"
     }
 
@@ -348,16 +592,10 @@ async def approve_task(task_id: str, request: ApprovalRequest):
     if task_data.get("status") != TaskStatus.WAITING_APPROVAL.value:
         raise HTTPException(status_code=400, detail="Task is not waiting for approval")
     
-    # Store approval
-    current_step = task_data.get("current_step", "0")
-    approval_key = f"approval:{task_id}:{current_step}"
-    approval_data = {
-        "approved": request.approved,
-        "reason": request.reason,
-        "user_id": request.user_id,
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    redis_client.set(approval_key, json.dumps(approval_data))
+    # Store approval and drop it from the inbox
+    step_id = task_data.get("waiting_step_id") or task_data.get("current_step", "0")
+    record = approval_inbox.resolve(task_id, step_id, request.approved, request.reason, request.user_id)
+    await persist_approvals([record])
     
     if request.approved:
         # Resume execution
@@ -368,8 +606,71 @@ async def approve_task(task_id: str, request: ApprovalRequest):
         redis_client.hset(f"task_runtime:{task_id}", "status", TaskStatus.REJECTED.value)
         return {"message": "Approval rejected, task stopped"}
 
+@app.get("/scheduler")
+async def scheduler_stats():
+    """Execution slots and waiting plans by priority class"""
+    return {"aging_seconds": PRIORITY_AGING_SECONDS, "task_priorities": TASK_PRIORITIES, **scheduler.stats()}
+
+@app.get("/approvals/pending")
+async def list_pending_approvals(approver: Optional[str] = None, limit: int = 100, offset: int = 0):
+    """Pending approvals, most urgent first, optionally for one approver queue"""
+    limit = max(1, min(limit, MAX_BULK_APPROVALS))
+    return {
+        "approver": approver,
+        "total": approval_inbox.count(approver),
+        "approvals": approval_inbox.pending(approver, limit=limit, offset=offset)
+    }
+
+@app.post("/approvals/bulk", response_model=BulkApprovalResponse)
+async def bulk_approve(request: BulkApprovalRequest):
+    """Approve or reject many waiting tasks in one request"""
+    if len(request.decisions) > MAX_BULK_APPROVALS:
+        raise HTTPException(status_code=413, detail=f"Bulk request exceeds {MAX_BULK_APPROVALS} decisions")
+    
+    with redis_client.pipeline(transaction=False) as pipe:
+        for decision in request.decisions:
+            pipe.hmget(f"task_runtime:{decision.task_id}", "status", "waiting_step_id", "current_step")
+        states = pipe.execute()
+    
+    results = []
+    accepted = []
+    for decision, (status, waiting_step_id, current_step) in zip(request.decisions, states):
+        waiting_step_id = waiting_step_id or current_step
+        step_id = decision.step_id or waiting_step_id
+        if status is None:
+            results.append(BulkApprovalResult(task_id=decision.task_id, step_id=step_id, status="skipped", error="Task not found"))
+        elif status != TaskStatus.WAITING_APPROVAL.value or step_id != waiting_step_id:
+            results.append(BulkApprovalResult(task_id=decision.task_id, step_id=step_id, status="skipped", error="Step is not waiting for approval"))
+        else:
+            accepted.append({"task_id": decision.task_id, "step_id": step_id, "approved": decision.approved, "reason": decision.reason})
+            results.append(BulkApprovalResult(
+                task_id=decision.task_id,
+                step_id=step_id,
+                status="approved" if decision.approved else "rejected"
+            ))
+    
+    if accepted:
+        records = approval_inbox.resolve_many(accepted, request.user_id)
+        with redis_client.pipeline(transaction=False) as pipe:
+            for record in records:
+                status = TaskStatus.EXECUTING.value if record["approved"] else TaskStatus.REJECTED.value
+                pipe.hset(f"task_runtime:{record['task_id']}", "status", status)
+            pipe.execute()
+        await persist_approvals(records)
+    
+    logger.info(f"Bulk approval by {request.user_id}: {len(accepted)} processed, {len(results) - len(accepted)} skipped")
+    return BulkApprovalResponse(processed=len(accepted), skipped=len(results) - len(accepted), results=results)
+
+serve.install(app, "agent-runtime")
+tracing.install(app, "agent-runtime")
+metrics.install(app, "agent-runtime")
+profiling.install(app, "agent-runtime")
+deadlines.install(app, "agent-runtime")
+resilience.install(app)
+wire.install(app)
+
 if __name__ == "__main__":
-    import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # In-process velocity windows belong to a single process
+    serve.run(app, port=port, max_workers=1 if VELOCITY_MODE == "local" else None)
 
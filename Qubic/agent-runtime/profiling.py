@@ -0,0 +1,322 @@
+"""
+Profiling
+On-demand sampling profiles (speedscope or collapsed stacks) and capture of slow requests
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import Counter, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import serve
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# Nothing here runs unless enabled: PROFILING_ENABLED adds the profile endpoint, and
+# SLOW_REQUEST_MS above 0 adds the slow-request middleware and its background sampler
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+SLOW_REQUEST_ROUTES = os.getenv("SLOW_REQUEST_ROUTES", "")  # "POST /plan/execute=2000,POST /audit/record=500"
+SLOW_REQUEST_KEEP = int(os.getenv("SLOW_REQUEST_KEEP", "20"))
+SLOW_REQUEST_SAMPLE_MS = float(os.getenv("SLOW_REQUEST_SAMPLE_MS", "10"))
+SLOW_REQUEST_WINDOW_SECONDS = float(os.getenv("SLOW_REQUEST_WINDOW_SECONDS", "60"))
+
+# Leaf frames of threads waiting rather than running: the event loop (asyncio's selector, or
+# uvloop, which waits in C under asyncio.run), idle pool threads and serve's stats writer
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("runners.py", "run"),
+    ("serve.py", "loop"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker")
+}
+
+# Stack sampling
+
+Stack = Tuple[Any, ...]  # code objects, outermost first
+
+def frame_name(code) -> str:
+    path = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+def is_idle(code) -> bool:
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+
+class Sampler:
+    """Records the stacks of every other thread each interval from a background thread.
+
+    Samples are (perf_counter time, thread name, stack); idle threads are skipped unless
+    idle is set. maxlen bounds the buffer for continuous sampling."""
+
+    def __init__(self, interval: float, maxlen: Optional[int] = None, idle: bool = False):
+        self.interval = interval
+        self.idle = idle
+        self.samples: Deque[Tuple[float, str, Stack]] = deque(maxlen=maxlen)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        names_at = 0.0
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            if now - names_at > 1.0:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                names_at = now
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if not self.idle and is_idle(frame.f_code):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stack.reverse()
+                self.samples.append((now, names.get(ident, str(ident)), tuple(stack)))
+
+    def window(self, start: float, end: float) -> List[Tuple[float, str, Stack]]:
+        """Samples taken between two perf_counter times, oldest first"""
+        found = []
+        for sample in reversed(self.samples):
+            if sample[0] < start:
+                break
+            if sample[0] <= end:
+                found.append(sample)
+        found.reverse()
+        return found
+
+def collapsed(samples: List[Tuple[float, str, Stack]]) -> Counter:
+    """Brendan Gregg's folded format: "thread;outer;...;inner" -> sample count"""
+    counts: Counter = Counter()
+    for _, thread, stack in samples:
+        counts[";".join([thread] + [frame_name(code) for code in stack])] += 1
+    return counts
+
+def speedscope(samples: List[Tuple[float, str, Stack]], interval_ms: float, name: str) -> Dict[str, Any]:
+    """Sampled profile per thread in speedscope's file format"""
+    frames: List[Dict[str, Any]] = []
+    frame_index: Dict[Any, int] = {}
+    threads: Dict[str, Dict[str, list]] = {}
+    for _, thread, stack in samples:
+        indexes = []
+        for code in stack:
+            index = frame_index.get(code)
+            if index is None:
+                index = frame_index[code] = len(frames)
+                frames.append({
+                    "name": getattr(code, "co_qualname", code.co_name),
+                    "file": code.co_filename,
+                    "line": code.co_firstlineno
+                })
+            indexes.append(index)
+        profile = threads.setdefault(thread, {"samples": [], "weights": []})
+        profile["samples"].append(indexes)
+        profile["weights"].append(interval_ms)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "qubic profiling",
+        "shared": {"frames": frames},
+        "profiles": [
+            {
+                "type": "sampled",
+                "name": thread,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(profile["weights"]), 3),
+                "samples": profile["samples"],
+                "weights": profile["weights"]
+            }
+            for thread, profile in threads.items()
+        ]
+    }
+
+# Slow requests
+
+def parse_thresholds(spec: str) -> Dict[str, float]:
+    thresholds = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        route, _, ms = entry.rpartition("=")
+        thresholds[route.strip()] = float(ms)
+    return thresholds
+
+class SlowRequests:
+    """Most recent requests over their threshold, with their timing breakdown and the stacks
+    sampled while they ran"""
+
+    def __init__(self, threshold_ms: float, route_thresholds: Dict[str, float], keep: int):
+        self.threshold_ms = threshold_ms
+        self.route_thresholds = route_thresholds
+        self.records: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        # Room for SLOW_REQUEST_WINDOW_SECONDS of samples from a few busy threads
+        self.sampler = Sampler(SLOW_REQUEST_SAMPLE_MS / 1000,
+                               maxlen=int(SLOW_REQUEST_WINDOW_SECONDS * 1000 / SLOW_REQUEST_SAMPLE_MS) * 4)
+        self.captured = 0
+
+    def start(self):
+        self.sampler.start()
+
+    def threshold(self, route: str) -> float:
+        return self.route_thresholds.get(route, self.threshold_ms)
+
+    def record(self, route: str, path: str, status: int, started_at: float, start: float, end: float,
+               breakdown: Dict[str, list], headers: List[Tuple[bytes, bytes]]):
+        elapsed_ms = (end - start) * 1000
+        trace_id = next((value.decode("latin-1") for key, value in headers if key == b"x-trace-id"), None)
+        samples = self.sampler.window(start, end)
+        self.captured += 1
+        self.records.append({
+            "pid": os.getpid(),
+            "route": route,
+            "path": path,
+            "status": status,
+            "started_at": datetime.utcfromtimestamp(started_at).isoformat(),
+            "duration_ms": round(elapsed_ms, 3),
+            "trace_id": trace_id,
+            "breakdown": [
+                {"name": name, "count": count, "total_ms": round(seconds * 1000, 3)}
+                for name, (count, seconds) in sorted(breakdown.items(), key=lambda item: item[1][1], reverse=True)
+            ],
+            "samples": {
+                "count": len(samples),
+                "interval_ms": SLOW_REQUEST_SAMPLE_MS,
+                "stacks": [{"stack": stack, "count": count} for stack, count in collapsed(samples).most_common(20)]
+            }
+        })
+        logger.warning(f"Slow request {route} took {elapsed_ms:.0f}ms" + (f" (trace {trace_id})" if trace_id else ""))
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        return list(self.records)
+
+class SlowRequestMiddleware:
+    """Times each request and captures the ones over their route's threshold"""
+
+    def __init__(self, app, capture: SlowRequests, service_app=None):
+        self.app = app
+        self.capture = capture
+        self.service_app = service_app
+        self._paths: Optional[Dict[Any, str]] = None
+
+    def route(self, scope) -> str:
+        if self._paths is None:
+            self._paths = {
+                route.endpoint: route.path
+                for route in getattr(self.service_app, "routes", [])
+                if hasattr(route, "endpoint")
+            }
+        path = self._paths.get(scope.get("endpoint"))
+        return f"{scope['method']} {path}" if path else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        breakdown: Dict[str, list] = {}
+        token = metrics.breakdown.set(breakdown)
+        status = 500
+        headers: List[Tuple[bytes, bytes]] = []
+        started_at = time.time()
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = message.get("headers", [])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.breakdown.reset(token)
+            end = time.perf_counter()
+            route = self.route(scope)
+            if (end - start) * 1000 >= self.capture.threshold(route):
+                self.capture.record(route, scope["path"], status, started_at, start, end, breakdown, headers)
+
+# Endpoints
+
+_profile_lock = asyncio.Lock()
+
+def check_token(token: Optional[str]):
+    from fastapi import HTTPException
+    if PROFILING_TOKEN and token != PROFILING_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+def install(app, service: str):
+    """Add the profile endpoint and slow-request capture to an app when enabled"""
+    from fastapi import Header, HTTPException, Query
+    from fastapi.responses import Response
+
+    if SLOW_REQUEST_MS > 0:
+        capture = SlowRequests(SLOW_REQUEST_MS, parse_thresholds(SLOW_REQUEST_ROUTES), SLOW_REQUEST_KEEP)
+        app.add_middleware(SlowRequestMiddleware, capture=capture, service_app=app)
+        app.add_event_handler("startup", capture.start)
+        serve.stats.sections["slow_requests"] = capture.snapshot
+
+        async def slow_requests(limit: int = Query(20, ge=1, le=1000),
+                                x_profiling_token: Optional[str] = Header(None)):
+            """Most recent slow requests across this service's workers, newest first"""
+            check_token(x_profiling_token)
+            records = [record for worker in serve.stats.collect() for record in worker.get("slow_requests", [])]
+            records.sort(key=lambda record: record["started_at"], reverse=True)
+            return {"service": service, "threshold_ms": SLOW_REQUEST_MS, "requests": records[:limit]}
+
+        app.add_api_route("/debug/slow-requests", slow_requests, methods=["GET"])
+
+    if not PROFILING_ENABLED:
+        return
+
+    async def profile(seconds: float = Query(10.0, gt=0),
+                      interval_ms: float = Query(PROFILE_INTERVAL_MS, ge=1, le=1000),
+                      format: str = Query("speedscope", pattern="^(speedscope|collapsed)$"),
+                      idle: bool = False,
+                      x_profiling_token: Optional[str] = Header(None)):
+        """Sample this worker's threads for a while and return the profile"""
+        check_token(x_profiling_token)
+        if _profile_lock.locked():
+            raise HTTPException(status_code=409, detail="A profile is already running in this worker")
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+        async with _profile_lock:
+            sampler = Sampler(interval_ms / 1000, idle=idle)
+            sampler.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                await asyncio.to_thread(sampler.stop)
+        samples = list(sampler.samples)
+        name = f"{service}-{os.getpid()}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}"
+        logger.info(f"Profiled {service} worker {os.getpid()} for {seconds}s: {len(samples)} samples")
+        if format == "collapsed":
+            body = "".join(f"{stack} {count}\n" for stack, count in collapsed(samples).items())
+            filename, media_type = f"{name}.folded", "text/plain"
+        else:
+            body = await asyncio.to_thread(json.dumps, speedscope(samples, interval_ms, name))
+            filename, media_type = f"{name}.speedscope.json", "application/json"
+        return Response(body, media_type=media_type,
+                        headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+    app.add_api_route("/debug/profile", profile, methods=["GET"])
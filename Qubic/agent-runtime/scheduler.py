@@ -0,0 +1,147 @@
+"""
+Scheduler
+Execution slots for plans, shared out by priority class and fairly between users
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Most urgent first
+PRIORITY_CLASSES = ("interactive", "standard", "batch")
+DEFAULT_PRIORITY = "standard"
+
+def parse_priorities(setting: str) -> Dict[str, str]:
+    """"transfer_funds=interactive,monitor_wallet=batch" -> {task_type: priority class}"""
+    priorities = {}
+    for entry in setting.split(","):
+        task_type, _, priority = entry.partition("=")
+        task_type, priority = task_type.strip(), priority.strip()
+        if not task_type:
+            continue
+        if priority not in PRIORITY_CLASSES:
+            raise ValueError(f"Unknown priority class {priority!r} for {task_type}; choose from {', '.join(PRIORITY_CLASSES)}")
+        priorities[task_type] = priority
+    return priorities
+
+def priority_class(task_type: Optional[str], requested: Optional[str], priorities: Dict[str, str]) -> str:
+    """The class a caller asked for if it exists, else the task type's, else standard"""
+    if requested in PRIORITY_CLASSES:
+        return requested
+    return priorities.get(task_type or "", DEFAULT_PRIORITY)
+
+class _Waiter:
+    __slots__ = ("priority", "user", "start_tag", "enqueued_at", "future")
+
+    def __init__(self, priority: str, user: str, start_tag: float, future: asyncio.Future):
+        self.priority = priority
+        self.user = user
+        self.start_tag = start_tag
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+class FairScheduler:
+    """At most max_concurrent plans run at once in this process; the rest wait for a slot.
+
+    A freed slot goes to the most urgent priority class with a waiter. Within a class, users
+    share slots by start-time fair queuing: each plan is tagged with its user's share of the
+    work so far (plan steps / user weight), and the lowest tag runs next, so a user with a
+    sweep of many plans queued cannot hold back another user's single plan. A waiter is
+    treated as one class more urgent for every aging_seconds it has waited, so batch plans
+    still run under sustained interactive load. max_concurrent 0 runs everything at once."""
+
+    def __init__(self, max_concurrent: int = 8, aging_seconds: float = 10.0,
+                 weights: Optional[Dict[str, float]] = None):
+        self.max_concurrent = max_concurrent
+        self.aging_seconds = aging_seconds
+        self.weights = weights or {}
+        self.running = 0
+        self._queues: Dict[str, List[Tuple[float, int, _Waiter]]] = {name: [] for name in PRIORITY_CLASSES}
+        self._virtual_time = {name: 0.0 for name in PRIORITY_CLASSES}
+        self._finish_tags: Dict[Tuple[str, str], float] = {}  # (class, user) -> end of the user's last plan
+        self._sequence = itertools.count()
+        self.dispatched = {name: 0 for name in PRIORITY_CLASSES}
+        self.aged = 0
+
+    def waiting(self) -> int:
+        return sum(1 for queue in self._queues.values() for _, _, waiter in queue if not waiter.future.done())
+
+    async def acquire(self, priority: str, user: Optional[str], cost: float = 1.0,
+                      timeout: Optional[float] = None) -> float:
+        """Wait for a slot; returns the seconds waited. Raises asyncio.TimeoutError after
+        timeout seconds without one. Every successful acquire must be paired with release()."""
+        if self.max_concurrent <= 0 or (self.running < self.max_concurrent and not self.waiting()):
+            self.running += 1
+            self.dispatched[priority] += 1
+            return 0.0
+
+        user = user or ""
+        key = (priority, user)
+        start_tag = max(self._virtual_time[priority], self._finish_tags.get(key, 0.0))
+        self._finish_tags[key] = start_tag + cost / self.weights.get(user, 1.0)
+        if len(self._finish_tags) > 10000:
+            # Tags behind their class's virtual time carry no credit, so drop them
+            self._finish_tags = {k: tag for k, tag in self._finish_tags.items() if tag > self._virtual_time[k[0]]}
+        waiter = _Waiter(priority, user, start_tag, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._queues[priority], (start_tag, next(self._sequence), waiter))
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except BaseException:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted a slot just as the caller gave up
+                self.release()
+            raise
+        return time.monotonic() - waiter.enqueued_at
+
+    def release(self):
+        self.running -= 1
+        while self.max_concurrent <= 0 or self.running < self.max_concurrent:
+            waiter = self._next()
+            if waiter is None:
+                return
+            self.running += 1
+            waiter.future.set_result(None)
+
+    def _next(self) -> Optional[_Waiter]:
+        now = time.monotonic()
+        chosen = None
+        chosen_rank = None
+        first_waiting = None
+        for rank, name in enumerate(PRIORITY_CLASSES):
+            queue = self._queues[name]
+            while queue and queue[0][2].future.done():
+                heapq.heappop(queue)  # cancelled or timed out
+            if not queue:
+                continue
+            if first_waiting is None:
+                first_waiting = name
+            waited = now - queue[0][2].enqueued_at
+            effective = rank - int(waited / self.aging_seconds) if self.aging_seconds > 0 else rank
+            if chosen_rank is None or effective < chosen_rank:
+                chosen, chosen_rank = name, effective
+        if chosen is None:
+            return None
+        if chosen != first_waiting:
+            self.aged += 1
+        start_tag, _, waiter = heapq.heappop(self._queues[chosen])
+        self._virtual_time[chosen] = start_tag
+        self.dispatched[chosen] += 1
+        return waiter
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": self.running,
+            "waiting": {
+                name: sum(1 for _, _, waiter in queue if not waiter.future.done())
+                for name, queue in self._queues.items()
+            },
+            "dispatched": dict(self.dispatched),
+            "aged": self.aged
+        }
@@ -0,0 +1,466 @@
+"""
+Serve
+Pre-forking multi-worker launcher: shared listening socket, graceful drain, per-worker stats
+"""
+
+import os
+import gc
+import json
+import time
+import signal
+import socket
+import bisect
+import logging
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+WORKER_STATS_INTERVAL = float(os.getenv("WORKER_STATS_INTERVAL", "2"))
+SERVE_STATE_DIR = os.getenv("SERVE_STATE_DIR", "")
+
+# Latency histogram bucket upper bounds in ms: 0.1ms to ~50s, each 25% above the last
+LATENCY_BUCKETS = [round(0.1 * 1.25 ** i, 4) for i in range(60)]
+
+def _available(module: str) -> bool:
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+# Per-worker statistics
+
+def percentile(buckets: List[int], q: float) -> Optional[float]:
+    """Approximate q-quantile in ms (within one bucket, 25%) of a latency histogram"""
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS + [LATENCY_BUCKETS[-1]], buckets):
+        seen += count
+        if seen >= rank:
+            return bound
+    return LATENCY_BUCKETS[-1]
+
+def summarize(buckets: List[int], total_ms: float) -> Dict[str, Any]:
+    count = sum(buckets)
+    return {
+        "count": count,
+        "mean_ms": round(total_ms / count, 3) if count else None,
+        "p50_ms": percentile(buckets, 0.50),
+        "p95_ms": percentile(buckets, 0.95),
+        "p99_ms": percentile(buckets, 0.99)
+    }
+
+class RouteStats:
+    """Latency histogram of one route"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total_ms = 0.0
+
+    def observe(self, elapsed_ms: float):
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed_ms)] += 1
+        self.total_ms += elapsed_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"buckets": list(self.buckets), "total_ms": round(self.total_ms, 3)}
+
+class WorkerStats:
+    """Request counters for this process, written to the shared state directory so any
+    worker can report on all of them"""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = 0
+        self.routes: Dict[str, RouteStats] = {}
+        self.service = "service"
+        self.state_dir = ""
+        # Extra per-worker data written with the stats, and how to fold it into the totals
+        # of exited workers (see retire)
+        self.sections: Dict[str, Callable[[], Any]] = {}
+        self.mergers: Dict[str, Callable[[Any, Any], Any]] = {}
+        self._writer: Optional[threading.Thread] = None
+
+    def reset(self):
+        """Start counting afresh in a newly forked worker"""
+        self.pid = os.getpid()
+        self.started_at = time.time()
+        self.requests = 0
+        self.in_flight = 0
+        self.errors = 0
+        self.routes = {}
+        self._writer = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = {
+            "pid": self.pid,
+            "started_at": self.started_at,
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "errors": self.errors,
+            "routes": {route: route_stats.to_dict() for route, route_stats in list(self.routes.items())},
+            "updated_at": time.time()
+        }
+        for name, section in self.sections.items():
+            snapshot[name] = section()
+        return snapshot
+
+    def path(self, pid: Optional[int] = None) -> str:
+        return os.path.join(self.state_dir, f"{self.service}-{pid or self.pid}.json")
+
+    def retired_path(self) -> str:
+        return os.path.join(self.state_dir, f"{self.service}-retired.json")
+
+    def write(self):
+        tmp_path = self.path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, self.path())
+
+    def start_writer(self):
+        if self._writer is not None:
+            return
+        os.makedirs(self.state_dir, exist_ok=True)
+
+        def loop():
+            while True:
+                try:
+                    self.write()
+                except OSError as e:
+                    logger.warning(f"Worker stats write failed: {e}")
+                time.sleep(WORKER_STATS_INTERVAL)
+
+        self._writer = threading.Thread(target=loop, name="worker-stats", daemon=True)
+        self._writer.start()
+
+    def collect(self) -> List[Dict[str, Any]]:
+        """Latest stats of every live worker of this service"""
+        workers = []
+        prefix = f"{self.service}-"
+        for name in os.listdir(self.state_dir):
+            if not (name.startswith(prefix) and name.endswith(".json")) or name == f"{prefix}retired.json":
+                continue
+            try:
+                with open(os.path.join(self.state_dir, name)) as f:
+                    entry = json.load(f)
+                os.kill(entry["pid"], 0)
+            except (OSError, ValueError, KeyError):
+                continue
+            if entry["pid"] == self.pid:
+                entry = self.snapshot()
+            workers.append(entry)
+        return sorted(workers, key=lambda entry: entry["pid"])
+
+    def retired(self) -> Dict[str, Any]:
+        """Request counts and sections of workers that have exited since the supervisor started"""
+        try:
+            with open(self.retired_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def retire(self, pid: int):
+        """Fold an exited worker's last stats into the retired totals, so counters stay
+        monotonic across worker restarts. Only the supervisor calls this."""
+        try:
+            with open(self.path(pid)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return
+        totals = self.retired()
+        totals["requests"] = totals.get("requests", 0) + entry.get("requests", 0)
+        totals["errors"] = totals.get("errors", 0) + entry.get("errors", 0)
+        routes = totals.setdefault("routes", {})
+        for route, route_stats in entry.get("routes", {}).items():
+            merged = routes.setdefault(route, {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "total_ms": 0.0})
+            merged["buckets"] = [a + b for a, b in zip(merged["buckets"], route_stats["buckets"])]
+            merged["total_ms"] += route_stats["total_ms"]
+        for name, merge in self.mergers.items():
+            if name in entry:
+                totals[name] = merge(totals.get(name), entry[name])
+        tmp_path = self.retired_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(totals, f)
+        os.replace(tmp_path, self.retired_path())
+        os.remove(self.path(pid))
+
+stats = WorkerStats()
+
+class WorkerStatsMiddleware:
+    """Counts requests, in-flight requests and 5xx responses, and times each route, for this worker"""
+
+    def __init__(self, app, service_app=None):
+        self.app = app
+        self.service_app = service_app
+        self._paths: Optional[Dict[Any, str]] = None
+
+    def route_key(self, scope) -> str:
+        """"METHOD /path/{template}" of the matched route, so histograms stay per endpoint"""
+        if self._paths is None:
+            self._paths = {
+                route.endpoint: route.path
+                for route in getattr(self.service_app, "routes", [])
+                if hasattr(route, "endpoint")
+            }
+        path = self._paths.get(scope.get("endpoint"))
+        return f"{scope['method']} {path}" if path else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats.requests += 1
+        stats.in_flight += 1
+        status = 500
+        start = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            stats.in_flight -= 1
+            if status >= 500:
+                stats.errors += 1
+            key = self.route_key(scope)
+            route_stats = stats.routes.get(key)
+            if route_stats is None:
+                route_stats = stats.routes[key] = RouteStats()
+            route_stats.observe((time.perf_counter() - start) * 1000)
+
+def install(app, service: str):
+    """Add per-worker request stats and the GET /workers endpoint to an app"""
+    stats.service = service
+    stats.state_dir = SERVE_STATE_DIR or os.path.join(tempfile.gettempdir(), "qubic-serve")
+    app.add_middleware(WorkerStatsMiddleware, service_app=app)
+    app.add_event_handler("startup", stats.start_writer)
+
+    async def list_workers():
+        """Per-worker request statistics for this service"""
+        workers = stats.collect()
+        routes: Dict[str, Dict[str, Any]] = {}
+        for worker in workers:
+            for route, route_stats in worker.pop("routes", {}).items():
+                merged = routes.setdefault(route, {"buckets": [0] * (len(LATENCY_BUCKETS) + 1), "total_ms": 0.0})
+                merged["buckets"] = [a + b for a, b in zip(merged["buckets"], route_stats["buckets"])]
+                merged["total_ms"] += route_stats["total_ms"]
+        return {
+            "service": service,
+            "workers": workers,
+            "routes": {
+                route: {**summarize(merged["buckets"], merged["total_ms"]), **merged}
+                for route, merged in sorted(routes.items())
+            },
+            "totals": {
+                "workers": len(workers),
+                "requests": sum(worker["requests"] for worker in workers),
+                "in_flight": sum(worker["in_flight"] for worker in workers),
+                "errors": sum(worker["errors"] for worker in workers)
+            }
+        }
+
+    app.add_api_route("/workers", list_workers, methods=["GET"])
+
+# Launcher
+
+def _config(app, **overrides):
+    import uvicorn
+    return uvicorn.Config(
+        app,
+        loop="uvloop" if _available("uvloop") else "asyncio",
+        http="httptools" if _available("httptools") else "h11",
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        **overrides
+    )
+
+def run(app, host: str = "0.0.0.0", port: int = 8000, workers: Optional[int] = None,
+        max_workers: Optional[int] = None):
+    """Serve app with WEB_CONCURRENCY worker processes (one runs in-process).
+
+    max_workers caps the count for services whose in-process state cannot be shared."""
+    workers = workers or WEB_CONCURRENCY
+    if max_workers is not None and workers > max_workers:
+        logger.warning(f"{stats.service} supports at most {max_workers} worker(s) in this configuration, not {workers}")
+        workers = max_workers
+    # Totals of exited workers belong to the previous run
+    stats.state_dir = stats.state_dir or os.path.join(tempfile.gettempdir(), "qubic-serve")
+    try:
+        os.remove(stats.retired_path())
+    except OSError:
+        pass
+    if workers <= 1:
+        import uvicorn
+        uvicorn.Server(_config(app, host=host, port=port)).run()
+        return
+    Supervisor(app, host, port, workers).run()
+
+class Supervisor:
+    """Pre-fork master: warms the app once, binds the socket, forks workers that share it
+    and keeps them running.
+
+    SIGTERM/SIGINT drain every worker (uvicorn stops accepting, finishes in-flight requests
+    within GRACEFUL_TIMEOUT and runs shutdown hooks); SIGTTIN/SIGTTOU add or gracefully
+    retire a worker; SIGHUP replaces the workers one at a time, starting each replacement
+    before retiring the worker it replaces and moving on once that worker has exited."""
+
+    def __init__(self, app, host: str, port: int, workers: int):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.target = workers
+        self.workers: Dict[int, float] = {}  # pid -> started at
+        self.retiring: Set[int] = set()
+        self.stale: List[int] = []  # workers still to be replaced after SIGHUP, oldest first
+        self.draining = False
+        self._drain_deadline = 0.0
+        self._signals: List[int] = []
+        self._restarts: List[float] = []
+
+    def warm_up(self):
+        """Build everything workers would otherwise build on first use, then freeze the
+        heap so forked workers share those pages instead of copying them"""
+        self.app.openapi()
+        gc.collect()
+        gc.freeze()
+
+    def bind(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(2048)
+        sock.set_inheritable(True)
+        return sock
+
+    def spawn(self, sock: socket.socket):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.time()
+            return
+        # Worker process
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, signal.SIG_DFL)
+        # The heap stays frozen: collecting the warmed-up objects would copy their pages
+        stats.reset()
+        status = 0
+        try:
+            import uvicorn
+            uvicorn.Server(_config(self.app)).run(sockets=[sock])
+        except BaseException as e:
+            logger.error(f"Worker {os.getpid()} crashed: {e}")
+            status = 1
+        finally:
+            # Final counts for the supervisor to fold into the retired totals
+            try:
+                stats.write()
+            except OSError:
+                pass
+            os._exit(status)
+
+    def retire(self, pid: int):
+        """Ask a worker to drain and exit; uvicorn treats a second SIGTERM as force-exit,
+        so each worker is only signalled once"""
+        if pid in self.retiring:
+            return
+        self.retiring.add(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def active(self) -> int:
+        return len(self.workers) - len(self.retiring)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if self.workers.pop(pid, None) is None:
+                continue
+            try:
+                stats.retire(pid)
+            except OSError as e:
+                logger.warning(f"Folding stats of worker {pid} failed: {e}")
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+            elif not self.draining:
+                logger.warning(f"Worker {pid} exited with status {status}")
+                self._restarts.append(time.time())
+
+    def run(self):
+        stats.state_dir = stats.state_dir or os.path.join(tempfile.gettempdir(), "qubic-serve")
+        os.makedirs(stats.state_dir, exist_ok=True)
+        self.warm_up()
+        sock = self.bind()
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(signum, lambda signum, frame: self._signals.append(signum))
+        logger.info(f"Supervisor {os.getpid()} serving {stats.service} on {self.host}:{self.port} with {self.target} workers")
+
+        for _ in range(self.target):
+            self.spawn(sock)
+
+        while self.workers or not self.draining:
+            time.sleep(0.2)
+            self.reap()
+            while self._signals:
+                self.handle(self._signals.pop(0), sock)
+            if self.draining:
+                if time.time() > self._drain_deadline:
+                    for pid in list(self.workers):
+                        try:
+                            os.kill(pid, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                continue
+            # Back off when workers crash in a loop (e.g. a dependency is down at startup)
+            self._restarts = [t for t in self._restarts if t > time.time() - 60]
+            if len(self._restarts) > self.target * 5:
+                time.sleep(1)
+            while self.active() < self.target:
+                self.spawn(sock)
+            if self.active() > self.target:
+                newest = max((pid for pid in self.workers if pid not in self.retiring), key=self.workers.get)
+                self.retire(newest)
+            # Rolling replace: the next worker goes once the last one retired has exited
+            while self.stale and not self.retiring:
+                pid = self.stale.pop(0)
+                if pid in self.workers:
+                    self.spawn(sock)
+                    self.retire(pid)
+        sock.close()
+        logger.info("Supervisor stopped")
+
+    def handle(self, signum: int, sock: socket.socket):
+        if signum in (signal.SIGTERM, signal.SIGINT):
+            if not self.draining:
+                logger.info(f"Draining {len(self.workers)} workers")
+                self.draining = True
+                self._drain_deadline = time.time() + GRACEFUL_TIMEOUT + 5
+                for pid in list(self.workers):
+                    self.retire(pid)
+        elif signum == signal.SIGTTIN:
+            self.target += 1
+            logger.info(f"Scaling up to {self.target} workers")
+        elif signum == signal.SIGTTOU and self.target > 1:
+            self.target -= 1
+            logger.info(f"Scaling down to {self.target} workers")
+        elif signum == signal.SIGHUP:
+            self.stale = sorted((pid for pid in self.workers if pid not in self.retiring), key=self.workers.get)
+            logger.info(f"Replacing {len(self.stale)} workers one at a time")
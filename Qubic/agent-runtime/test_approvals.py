@@ -0,0 +1,80 @@
+"""
+Approval inbox tests
+Ordering by age and priority, routing, and resolving pending requests
+"""
+
+import json
+import fakeredis
+import pytest
+from approvals import DECISION_KEY, ApprovalInbox
+
+@pytest.fixture
+def inbox(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("approvals.time.time", lambda: clock[0])
+    inbox = ApprovalInbox(fakeredis.FakeRedis(decode_responses=True), priority_boost_seconds=3600,
+                          approvers={"transfer_funds": "treasury"})
+    inbox.clock = clock
+    return inbox
+
+def step(step_id="3", **parameters):
+    return {"step_id": step_id, "type": "onchain_action", "parameters": parameters}
+
+def test_oldest_first_within_a_priority(inbox):
+    for index in range(3):
+        inbox.enqueue(f"task-{index}", step())
+        inbox.clock[0] += 10
+    assert [request["task_id"] for request in inbox.pending()] == ["task-0", "task-1", "task-2"]
+
+def test_priority_is_worth_boost_seconds_of_waiting(inbox):
+    inbox.enqueue("old-batch", step(), priority=0)
+    inbox.clock[0] += 1800
+    inbox.enqueue("new-interactive", step(), priority=1)
+    inbox.clock[0] += 3600
+    inbox.enqueue("newest-interactive", step(), priority=1)
+    assert [request["task_id"] for request in inbox.pending()] == ["new-interactive", "old-batch", "newest-interactive"]
+
+def test_step_parameters_do_not_pick_approver_or_priority(inbox):
+    inbox.enqueue("task-0", step())
+    inbox.clock[0] += 10
+    request = inbox.enqueue("task-1", step(approver="my-friend", priority=1000, amount=5), task_type="other")
+    assert request["approver"] == "operators"
+    assert request["priority"] == 0
+    assert request["amount"] == 5
+    assert [request["task_id"] for request in inbox.pending()] == ["task-0", "task-1"]
+    assert inbox.count("my-friend") == 0
+
+def test_routes_by_task_type(inbox):
+    inbox.enqueue("task-0", step(), task_type="transfer_funds")
+    inbox.enqueue("task-1", step(), task_type="monitor_wallet")
+    assert [request["task_id"] for request in inbox.pending("treasury")] == ["task-0"]
+    assert [request["task_id"] for request in inbox.pending("operators")] == ["task-1"]
+    assert inbox.count() == 2
+
+def test_reenqueue_keeps_original_place(inbox):
+    inbox.enqueue("task-0", step())
+    inbox.clock[0] += 10
+    inbox.enqueue("task-1", step())
+    inbox.clock[0] += 10
+    inbox.enqueue("task-0", step(), priority=0)
+    assert [request["task_id"] for request in inbox.pending()] == ["task-0", "task-1"]
+    assert inbox.count() == 2
+
+def test_resolve_records_decision_and_clears_indexes(inbox):
+    inbox.enqueue("task-0", step(), task_type="transfer_funds")
+    inbox.enqueue("task-1", step("7"), task_type="transfer_funds")
+    records = inbox.resolve_many([
+        {"task_id": "task-0", "step_id": "3", "approved": True, "reason": "ok"},
+        {"task_id": "task-1", "step_id": "7", "approved": False}
+    ], "alice")
+
+    assert [(record["task_id"], record["approved"]) for record in records] == [("task-0", True), ("task-1", False)]
+    assert inbox.count() == 0 and inbox.count("treasury") == 0
+    decision = json.loads(inbox.redis.get(DECISION_KEY.format(task_id="task-1", step_id="7")))
+    assert decision["approved"] is False and decision["user_id"] == "alice"
+
+def test_pending_pages(inbox):
+    for index in range(5):
+        inbox.enqueue(f"task-{index}", step())
+        inbox.clock[0] += 1
+    assert [request["task_id"] for request in inbox.pending(limit=2, offset=2)] == ["task-2", "task-3"]
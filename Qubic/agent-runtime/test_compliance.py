@@ -0,0 +1,68 @@
+"""
+Compliance tests
+Transfers the planner allowed still pass the runtime's auto-approval and velocity limits
+"""
+
+import asyncio
+import fakeredis
+import pytest
+from approvals import ApprovalInbox
+from velocity import build_limiter
+
+@pytest.fixture
+def runtime(service, monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(service, "redis_client", client)
+    monkeypatch.setattr(service, "approval_inbox", ApprovalInbox(client))
+    monkeypatch.setattr(service, "velocity_limiter", build_limiter(
+        "local", window_seconds=3600, max_count=3, max_amount=500
+    ))
+    monkeypatch.setattr(service, "AUTO_APPROVE_MAX_AMOUNT", 100.0)
+
+    async def persist_approvals(records):
+        pass
+    monkeypatch.setattr(service, "persist_approvals", persist_approvals)
+    return service
+
+def transfer(amount, decision="allow"):
+    return {"step_id": "3", "type": "onchain_action", "requires_approval": True,
+            "policy_decision": decision, "parameters": {"amount": amount, "to_address": "0xabc"}}
+
+def check(runtime, task_id, step):
+    return asyncio.run(runtime.compliance_agent_handler(task_id, step, {"user_id": "alice"}))
+
+def test_sub_limit_transfers_are_auto_approved_until_velocity_runs_out(runtime):
+    for index in range(3):
+        result = check(runtime, f"task-{index}", transfer(50))
+        assert result["status"] == "compliant" and result["auto_approved"]
+        assert result["velocity_event"]
+
+    # The fourth transfer in the window waits for a human
+    assert check(runtime, "task-3", transfer(50))["status"] == "waiting_approval"
+    assert [request["task_id"] for request in runtime.approval_inbox.pending()] == ["task-3"]
+
+def test_transfer_over_auto_approve_amount_waits(runtime):
+    # Allowed by the policy's max_amount, but above what the runtime approves by itself
+    assert check(runtime, "task-1", transfer(999))["status"] == "waiting_approval"
+
+def test_policy_requiring_approval_is_never_auto_approved(runtime):
+    assert check(runtime, "task-1", transfer(10, "require_approval"))["status"] == "waiting_approval"
+
+def test_failed_transfer_gives_its_velocity_back(runtime):
+    step = transfer(50)
+    events = [check(runtime, f"task-{index}", step)["velocity_event"] for index in range(3)]
+    runtime.settle_velocity(step, {"user_id": "alice"}, events[0], succeeded=False)
+    assert check(runtime, "task-3", step)["status"] == "compliant"
+
+def test_waiting_transfer_is_routed_by_task_type(runtime, monkeypatch):
+    monkeypatch.setattr(runtime.approval_inbox, "approvers", {"transfer_funds": "treasury"})
+    step = transfer(5000)
+    step["parameters"].update({"approver": "my-friend", "priority": 1000})
+    result = asyncio.run(runtime.compliance_agent_handler(
+        "task-1", step, {"user_id": "alice", "task_type": "transfer_funds"}
+    ))
+    assert result["status"] == "waiting_approval"
+    request, = runtime.approval_inbox.pending("treasury")
+    # transfer_funds is interactive by default
+    assert request["priority"] == "2"
+    assert runtime.approval_inbox.count("my-friend") == 0
@@ -0,0 +1,153 @@
+"""
+Resilience tests
+Circuit breaker states, the retry budget, retried and hedged requests
+"""
+
+import asyncio
+import time
+import httpx
+import pytest
+import resilience
+from resilience import CircuitBreaker, CircuitOpen, RetryBudget
+
+@pytest.fixture
+def clock(monkeypatch):
+    """time.monotonic under the test's control"""
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+def test_breaker_opens_probes_once_and_closes(clock):
+    breaker = CircuitBreaker("target", failures=3, reset_seconds=5)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False)
+    # A success resets the consecutive count; neutral outcomes leave it alone
+    breaker.record(True)
+    breaker.record(None)
+    for _ in range(3):
+        breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 5
+
+    clock[0] += 5
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Only one probe at a time
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+def test_failed_probe_opens_the_breaker_again(clock):
+    breaker = CircuitBreaker("target", failures=1, reset_seconds=5)
+    breaker.record(False)
+    clock[0] += 5
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+def test_retry_budget_is_a_share_of_traffic(clock):
+    budget = RetryBudget(ratio=0.5, per_second=0.1, maximum=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    # Idle time refills it too, up to the maximum
+    clock[0] += 100
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+
+def serve(handler, host):
+    return httpx.AsyncClient(base_url=f"http://{host}", transport=httpx.MockTransport(handler))
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BACKOFF_MS", 1)
+
+def test_unavailable_responses_are_retried():
+    statuses = [503, 502, 200]
+
+    def handler(request):
+        return httpx.Response(statuses.pop(0))
+
+    async def run():
+        async with serve(handler, "retried") as client:
+            return await resilience.request(client, "GET", "/work")
+
+    assert asyncio.run(run()).status_code == 200
+    assert statuses == []
+
+def test_client_errors_and_spent_budgets_are_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        return httpx.Response(404 if request.url.path == "/missing" else 503)
+
+    async def run():
+        async with serve(handler, "budgeted") as client:
+            assert (await resilience.request(client, "GET", "/missing")).status_code == 404
+            resilience.target(client.build_request("GET", "/").url).budget.tokens = 0
+            return await resilience.request(client, "GET", "/down")
+
+    assert asyncio.run(run()).status_code == 503
+    # One call each: the 404 is final, and the empty budget allows no retry of the 503
+    assert calls == ["/missing", "/down"]
+
+def test_transport_errors_are_raised_after_the_retries():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        raise httpx.ConnectError("refused", request=request)
+
+    async def run():
+        async with serve(handler, "refusing") as client:
+            await resilience.request(client, "GET", "/work", retries=1)
+
+    with pytest.raises(httpx.TransportError):
+        asyncio.run(run())
+    assert len(calls) == 2
+
+def test_slow_read_is_hedged(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_DELAY_MS", 20)
+    calls = []
+
+    async def handler(request):
+        calls.append(request)
+        # The first copy stalls; the hedge answers at once
+        if len(calls) == 1:
+            await asyncio.sleep(1)
+        return httpx.Response(200, json={"copy": len(calls)})
+
+    async def run():
+        async with serve(handler, "hedged") as client:
+            started = time.perf_counter()
+            response = await resilience.request(client, "GET", "/policy", hedge=True)
+            return response, time.perf_counter() - started
+
+    response, elapsed = asyncio.run(run())
+    assert response.json() == {"copy": 2}
+    assert elapsed < 0.5
+
+def test_open_breaker_fails_requests_fast():
+    resilience.instrument_httpx()
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(500)
+
+    async def run():
+        async with serve(handler, "broken") as client:
+            for _ in range(resilience.BREAKER_FAILURES):
+                await client.get("/work")
+            with pytest.raises(CircuitOpen):
+                await resilience.request(client, "GET", "/work")
+
+    asyncio.run(run())
+    assert len(calls) == resilience.BREAKER_FAILURES
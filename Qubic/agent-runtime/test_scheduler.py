@@ -0,0 +1,86 @@
+"""
+Scheduler tests
+Slot order under one heavy user, across priority classes, and with aging
+"""
+
+import asyncio
+import pytest
+from scheduler import FairScheduler, parse_priorities, priority_class
+
+def run_order(scheduler: FairScheduler, submissions, before_release=None):
+    """Queue (priority, user, name) submissions behind one held slot, then free it;
+    returns the names in the order they got a slot"""
+    order = []
+
+    async def plan(priority, user, name):
+        await scheduler.acquire(priority, user)
+        order.append(name)
+        await asyncio.sleep(0)
+        scheduler.release()
+
+    async def main():
+        await scheduler.acquire("standard", "holder")
+        tasks = []
+        for priority, user, name in submissions:
+            tasks.append(asyncio.create_task(plan(priority, user, name)))
+            await asyncio.sleep(0)
+        if before_release:
+            before_release()
+        scheduler.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    return order
+
+def test_heavy_user_does_not_hold_back_a_light_one():
+    scheduler = FairScheduler(max_concurrent=1)
+    submissions = [("standard", "sweeper", f"sweep-{i}") for i in range(10)]
+    submissions += [("standard", "alice", "alice-0"), ("standard", "bob", "bob-0")]
+    order = run_order(scheduler, submissions)
+
+    assert sorted(order) == sorted(name for _, _, name in submissions)
+    # One plan each from the light users goes right after the sweep's first
+    assert order.index("alice-0") <= 2
+    assert order.index("bob-0") <= 2
+    assert [name for name in order if name.startswith("sweep")] == [f"sweep-{i}" for i in range(10)]
+
+def test_light_users_interleave_with_heavy_one():
+    scheduler = FairScheduler(max_concurrent=1)
+    submissions = [("standard", "sweeper", f"sweep-{i}") for i in range(6)]
+    submissions += [("standard", "alice", f"alice-{i}") for i in range(3)]
+    order = run_order(scheduler, submissions)
+    assert order[:6] == ["sweep-0", "alice-0", "sweep-1", "alice-1", "sweep-2", "alice-2"]
+
+def test_weights_give_a_user_a_larger_share():
+    scheduler = FairScheduler(max_concurrent=1, weights={"vip": 2.0})
+    submissions = [("standard", "vip", f"vip-{i}") for i in range(4)]
+    submissions += [("standard", "other", f"other-{i}") for i in range(4)]
+    assert run_order(scheduler, submissions) == [
+        "vip-0", "other-0", "vip-1", "vip-2", "other-1", "vip-3", "other-2", "other-3"
+    ]
+
+def test_more_urgent_class_goes_first():
+    scheduler = FairScheduler(max_concurrent=1, aging_seconds=0)
+    submissions = [("batch", "sweeper", "batch-0"), ("standard", "alice", "standard-0"),
+                   ("interactive", "bob", "interactive-0")]
+    assert run_order(scheduler, submissions) == ["interactive-0", "standard-0", "batch-0"]
+
+def test_waiting_batch_plan_ages_into_a_slot():
+    scheduler = FairScheduler(max_concurrent=1, aging_seconds=10)
+    submissions = [("interactive", "alice", "interactive-0"), ("batch", "sweeper", "batch-0")]
+
+    def age_batch():
+        # The batch plan has waited long enough to rank above interactive
+        for _, _, waiter in scheduler._queues["batch"]:
+            waiter.enqueued_at -= 35
+
+    assert run_order(scheduler, submissions, age_batch) == ["batch-0", "interactive-0"]
+    assert scheduler.aged == 1
+
+def test_priority_settings():
+    priorities = parse_priorities("transfer_funds=interactive, monitor_wallet=batch")
+    assert priority_class("transfer_funds", None, priorities) == "interactive"
+    assert priority_class("monitor_wallet", "standard", priorities) == "standard"
+    assert priority_class("other", "urgent", priorities) == "standard"
+    with pytest.raises(ValueError):
+        parse_priorities("transfer_funds=urgent")
@@ -0,0 +1,67 @@
+"""
+Velocity tests
+Sliding-window limits in Redis and in process, and retention beyond the window for policy rules
+"""
+
+import time
+import fakeredis
+import pytest
+from velocity import KEY_PREFIX, build_limiter, velocity_subjects
+
+LIMITS = {"window_seconds": 60, "max_count": 3, "max_amount": 100, "retention_seconds": 3600}
+
+@pytest.fixture(params=["redis", "local"])
+def limiter(request):
+    return build_limiter(request.param, fakeredis.FakeRedis(), **LIMITS)
+
+SUBJECTS = velocity_subjects("alice", "0xABC")
+
+def test_subjects_are_the_user_and_the_lowercased_wallet():
+    assert SUBJECTS == ["user:alice", "wallet:0xabc"]
+    assert velocity_subjects(None, None) == []
+
+def test_count_limit(limiter):
+    for _ in range(3):
+        assert limiter.check_and_record(SUBJECTS, 10).allowed
+    decision = limiter.check_and_record(SUBJECTS, 10)
+    assert not decision.allowed
+    assert (decision.subject, decision.count, decision.total) == ("user:alice", 3, 30.0)
+    assert (limiter.allowed, limiter.blocked) == (3, 1)
+
+def test_amount_limit_blocks_every_subject_or_none(limiter):
+    assert limiter.check_and_record(velocity_subjects("alice", "0xabc"), 80).allowed
+    # Bob has room, but the wallet does not: nothing is recorded for bob either
+    decision = limiter.check_and_record(velocity_subjects("bob", "0xabc"), 30)
+    assert (decision.allowed, decision.subject) == (False, "wallet:0xabc")
+    assert limiter.usage("user:bob") == (0, 0.0)
+
+def test_released_event_frees_its_room(limiter):
+    decision = limiter.check_and_record(SUBJECTS, 90)
+    assert not limiter.check_and_record(SUBJECTS, 20).allowed
+    limiter.release(SUBJECTS, decision.event)
+    assert limiter.check_and_record(SUBJECTS, 20).allowed
+
+def test_events_outside_the_window_do_not_count_but_are_retained(limiter):
+    now = time.time()
+    # Two hours ago is past the retention; ten minutes ago is past the 60 s window only
+    limiter.record(SUBJECTS, 5, now - 7200)
+    limiter.record(SUBJECTS, 90, now - 600)
+    assert limiter.check_and_record(SUBJECTS, 90).allowed
+    assert limiter.usage("user:alice", 60) == (1, 90.0)
+    assert limiter.usage("user:alice", 3600) == (2, 180.0)
+    # Windows longer than the retention are cut to it
+    assert limiter.usage("user:alice", 86400) == (2, 180.0)
+
+def test_redis_keys_expire_with_the_retention():
+    client = fakeredis.FakeRedis()
+    limiter = build_limiter("redis", client, **LIMITS)
+    limiter.check_and_record(SUBJECTS, 10)
+    limiter.record(["user:bob"], 10)
+    for key in (f"{KEY_PREFIX}:user:alice", f"{KEY_PREFIX}:wallet:0xabc", f"{KEY_PREFIX}:user:bob"):
+        assert 3500 < client.ttl(key) <= 3600
+
+def test_retention_is_at_least_the_window():
+    assert build_limiter("local", window_seconds=600, retention_seconds=60).retention_seconds == 600
+    assert build_limiter("local", window_seconds=600).retention_seconds == 600
+    with pytest.raises(ValueError):
+        build_limiter("memcached")
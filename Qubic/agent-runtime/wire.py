@@ -0,0 +1,106 @@
+"""
+Wire
+Request and response bodies as msgpack between services and orjson for everyone else
+"""
+
+import os
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+import msgpack
+import orjson
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+import metrics
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+
+# Configuration
+WIRE_FORMAT = os.getenv("WIRE_FORMAT", "json")  # body format for calls to other services: json or msgpack
+
+if WIRE_FORMAT not in ("json", "msgpack"):
+    raise ValueError(f"Unknown wire format: {WIRE_FORMAT}")
+
+# Format the caller of the current request accepts for the response
+_accept: ContextVar[str] = ContextVar("wire_accept", default=JSON)
+
+WIRE_REQUESTS = metrics.Counter(
+    "qubic_wire_requests_total", "Request bodies decoded, by format", ("format",)
+)
+
+def _default(value: Any) -> Any:
+    """Types msgpack has no encoding for; datetimes as ISO 8601, like JSON"""
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+def dumps(payload: Any, format: str = "json") -> bytes:
+    if format == "msgpack":
+        return msgpack.packb(payload, default=_default, use_bin_type=True)
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+def loads(body: bytes, content_type: Optional[str] = None) -> Any:
+    if content_type and content_type.startswith(MSGPACK):
+        return msgpack.unpackb(body, raw=False, strict_map_key=False)
+    return orjson.loads(body)
+
+# Client side
+
+def body(payload: Any, format: Optional[str] = None) -> Dict[str, Any]:
+    """httpx request arguments sending payload in WIRE_FORMAT and asking for the same back"""
+    format = format or WIRE_FORMAT
+    media_type = MSGPACK if format == "msgpack" else JSON
+    return {"content": dumps(payload, format), "headers": {"content-type": media_type, "accept": media_type}}
+
+def decode(response) -> Any:
+    """An httpx response's body, in whichever format the service answered"""
+    return loads(response.content, response.headers.get("content-type"))
+
+# Server side
+
+class WireResponse(JSONResponse):
+    """msgpack for callers that accept it, otherwise JSON encoded with orjson"""
+
+    def render(self, content: Any) -> bytes:
+        if _accept.get() == MSGPACK:
+            self.media_type = MSGPACK
+            return dumps(content, "msgpack")
+        return dumps(content)
+
+class WireRequest(Request):
+    """Decodes msgpack bodies, and JSON with orjson, for FastAPI to validate as usual"""
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            format = self.scope.get("wire.format", "json")
+            self._json = loads(await self.body(), MSGPACK if format == "msgpack" else JSON)
+            WIRE_REQUESTS.labels(format).inc()
+        return self._json
+
+def _wire_handler(handler):
+    async def wire_handler(request: Request):
+        scope = request.scope
+        if request.headers.get("content-type", "").startswith(MSGPACK):
+            # FastAPI only parses bodies it takes for JSON
+            scope = dict(scope, **{"wire.format": "msgpack"})
+            scope["headers"] = [(key, JSON.encode() if key == b"content-type" else value)
+                                for key, value in scope["headers"]]
+        token = _accept.set(MSGPACK if MSGPACK in request.headers.get("accept", "") else JSON)
+        try:
+            return await handler(WireRequest(scope, request.receive, request._send))
+        finally:
+            _accept.reset(token)
+    return wire_handler
+
+def install(app):
+    """Accept msgpack bodies, and answer in msgpack when asked, on every route defined so far"""
+    from fastapi.datastructures import DefaultPlaceholder
+    from fastapi.routing import APIRoute
+    from starlette.routing import request_response
+
+    for route in app.routes:
+        if not isinstance(route, APIRoute):
+            continue
+        if isinstance(route.response_class, DefaultPlaceholder):
+            route.response_class = WireResponse
+        route.app = request_response(_wire_handler(route.get_route_handler()))
@@ -0,0 +1,75 @@
+"""
+Admission
+Sheds new tasks while the agent runtime's queue or this worker's in-flight submissions are full
+"""
+
+import time
+import logging
+from typing import Any, Dict, Optional
+import redis
+
+logger = logging.getLogger(__name__)
+
+# Sorted set of task ids executing in the agent runtime, scored by start time; the runtime adds
+# a task when POST /plan/execute starts and removes it when the request ends
+EXECUTING_KEY = "runtime:executing"
+
+class AdmissionController:
+    """Admits a task while fewer than max_depth tasks are executing in the runtime and fewer
+    than max_in_flight submissions are in flight in this worker.
+
+    The runtime's depth is read from Redis at most every refresh_seconds, so it covers every
+    runtime replica and every gateway; the in-flight count reacts at once to a burst on this
+    worker. Entries older than stale_seconds are left by runtime processes that died mid-task
+    and are trimmed. If Redis cannot be read, tasks are admitted on the in-flight limit alone."""
+
+    def __init__(self, client: redis.Redis, max_depth: int = 64, max_in_flight: int = 32,
+                 refresh_seconds: float = 0.1, stale_seconds: float = 120.0, retry_after: float = 2.0):
+        self.client = client
+        self.max_depth = max_depth
+        self.max_in_flight = max_in_flight
+        self.refresh_seconds = refresh_seconds
+        self.stale_seconds = stale_seconds
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._depth = 0
+        self._refreshed_at = 0.0
+        self.admitted = 0
+        self.shed = 0
+
+    def depth(self) -> int:
+        """Tasks executing in the runtime, cached for refresh_seconds"""
+        now = time.monotonic()
+        if now - self._refreshed_at >= self.refresh_seconds:
+            self._refreshed_at = now
+            try:
+                with self.client.pipeline(transaction=False) as pipe:
+                    pipe.zremrangebyscore(EXECUTING_KEY, "-inf", time.time() - self.stale_seconds)
+                    pipe.zcard(EXECUTING_KEY)
+                    self._depth = pipe.execute()[1]
+            except redis.RedisError as e:
+                logger.warning(f"Runtime queue depth unavailable, admitting on in-flight limit only: {e}")
+                self._depth = 0
+        return self._depth
+
+    def check(self) -> Optional[str]:
+        """Why a new task must wait, or None to admit it"""
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            reason = f"{self.in_flight} submissions in flight"
+        elif self.max_depth and self.depth() >= self.max_depth:
+            reason = f"{self._depth} tasks executing in the agent runtime"
+        else:
+            self.admitted += 1
+            return None
+        self.shed += 1
+        return reason
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_depth": self.max_depth,
+            "max_in_flight": self.max_in_flight,
+            "depth": self._depth,
+            "in_flight": self.in_flight,
+            "admitted": self.admitted,
+            "shed": self.shed
+        }
@@ -0,0 +1,207 @@
+"""
+Authentication
+Local JWT verification against a cached, background-refreshed JWKS
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+import httpx
+import jwt
+import resilience
+
+logger = logging.getLogger(__name__)
+
+class AuthError(Exception):
+    """The bearer token is missing, malformed, expired or not signed by a known key; answered with 401"""
+
+class KeySet:
+    """Signing keys from a JWKS, by kid, loaded from url or a local path.
+
+    Keys are refreshed every refresh_seconds in the background, and on demand when a token
+    names a kid that is not known yet (a key rotation), at most once per min_refresh_seconds
+    so tokens with made-up kids cannot hammer the identity provider. A failed refresh keeps
+    the keys already loaded."""
+
+    def __init__(self, url: Optional[str] = None, path: Optional[str] = None, refresh_seconds: float = 300.0,
+                 min_refresh_seconds: float = 30.0, timeout: float = 5.0):
+        if not url and not path:
+            raise ValueError("A JWKS url or path is required")
+        self.url = url
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.timeout = timeout
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._refreshed_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+        self.refresh_failures = 0
+        if path:
+            self._load(self._read_file())
+
+    def _read_file(self) -> Dict[str, Any]:
+        with open(self.path) as f:
+            return json.load(f)
+
+    async def _fetch(self) -> Dict[str, Any]:
+        if self.path:
+            return self._read_file()
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        response = await resilience.request(self._client, "GET", self.url)
+        response.raise_for_status()
+        return response.json()
+
+    def _load(self, jwks: Dict[str, Any]):
+        keys = {}
+        for entry in jwks.get("keys", []):
+            if entry.get("use", "sig") != "sig" or "kid" not in entry:
+                continue
+            try:
+                keys[entry["kid"]] = jwt.PyJWK(entry)
+            except jwt.PyJWTError as e:
+                logger.warning(f"Skipping JWKS key {entry.get('kid')}: {e}")
+        if not keys:
+            raise ValueError("JWKS has no usable signing keys")
+        self._keys = keys
+        self._refreshed_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Reload the keys unless they were loaded less than min_refresh_seconds ago (or at all
+        by a concurrent caller); returns whether they were reloaded"""
+        async with self._refresh_lock:
+            if not force and time.monotonic() - self._refreshed_at < self.min_refresh_seconds:
+                return False
+            try:
+                self._load(await self._fetch())
+            except (httpx.HTTPError, OSError, ValueError) as e:
+                self.refresh_failures += 1
+                # Hold off on-demand refreshes too, rather than retrying on every request
+                self._refreshed_at = time.monotonic()
+                logger.warning(f"JWKS refresh failed, keeping {len(self._keys)} keys: {e}")
+                return False
+            self.refreshes += 1
+            return True
+
+    async def get(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        """The key for kid, refreshing once for a kid not seen before"""
+        key = self._keys.get(kid)
+        if key is None and await self.refresh():
+            key = self._keys.get(kid)
+        return key
+
+    async def _run(self):
+        while True:
+            await self.refresh(force=True)
+            await asyncio.sleep(resilience.jitter(self.refresh_seconds))
+
+    def start(self):
+        """Start refreshing the keys in the background"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "keys": sorted(self._keys),
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures
+        }
+
+class TokenVerifier:
+    """Verifies bearer JWTs locally: the signature against the KeySet, then exp, nbf, iss and aud.
+
+    Verified claims are kept in an LRU of up to cache_size tokens, keyed by the token's SHA-256
+    and dropped once the token expires, so a client reusing its token costs one hash and a dict
+    lookup per request rather than a signature check."""
+
+    def __init__(self, keys: KeySet, algorithms: List[str], issuer: Optional[str] = None,
+                 audience: Optional[str] = None, leeway: float = 30.0, cache_size: int = 10000):
+        self.keys = keys
+        self.algorithms = algorithms
+        self.issuer = issuer
+        self.audience = audience
+        self.leeway = leeway
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()  # hash -> (exp, claims)
+        self.hits = 0
+        self.verified = 0
+        self.rejected = 0
+
+    def cached(self, token: str) -> Optional[Dict[str, Any]]:
+        """Claims of a token verified earlier that has not expired yet"""
+        digest = hashlib.sha256(token.encode()).digest()
+        entry = self._cache.get(digest)
+        if entry is None:
+            return None
+        if entry[0] + self.leeway <= time.time():
+            del self._cache[digest]
+            return None
+        self._cache.move_to_end(digest)
+        self.hits += 1
+        return entry[1]
+
+    async def claims(self, token: str) -> Dict[str, Any]:
+        """The token's claims, from the cache or verified; raises AuthError if it cannot be trusted"""
+        claims = self.cached(token)
+        if claims is None:
+            claims = await self.verify(token)
+        return claims
+
+    async def verify(self, token: str) -> Dict[str, Any]:
+        """Check the token's signature and claims, bypassing the cache, and cache them"""
+        try:
+            header = jwt.get_unverified_header(token)
+            key = await self.keys.get(header.get("kid"))
+            if key is None:
+                raise AuthError(f"Unknown signing key {header.get('kid')!r}")
+            claims = jwt.decode(
+                token,
+                key.key,
+                algorithms=self.algorithms,
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.leeway,
+                options={"require": ["exp", "sub"], "verify_aud": self.audience is not None}
+            )
+        except jwt.PyJWTError as e:
+            self.rejected += 1
+            raise AuthError(str(e))
+        except AuthError:
+            self.rejected += 1
+            raise
+        self.verified += 1
+        self._cache[hashlib.sha256(token.encode()).digest()] = (float(claims["exp"]), claims)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return claims
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "cached": len(self._cache),
+            "hits": self.hits,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "jwks": self.keys.stats()
+        }
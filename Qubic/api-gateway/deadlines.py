@@ -0,0 +1,203 @@
+"""
+Deadlines
+End-to-end request budgets: carried between services, shrinking downstream timeouts and failing fast
+"""
+
+import os
+import json
+import math
+import time
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Remaining budget in ms, relative so it does not depend on clocks agreeing between hosts
+BUDGET_HEADER = "x-request-budget-ms"
+# Set on a 504 caused by a spent budget; names the service that gave up
+EXCEEDED_HEADER = "x-deadline-exceeded"
+
+# Configuration
+REQUEST_BUDGET_MS = float(os.getenv("REQUEST_BUDGET_MS", "0"))  # budget for requests without one; 0 for none
+DEADLINE_MAX_MS = float(os.getenv("DEADLINE_MAX_MS", "120000"))  # cap on budgets sent by callers
+DEADLINE_MARGIN_MS = float(os.getenv("DEADLINE_MARGIN_MS", "20"))  # kept back per hop for the response
+DEADLINE_SKIP_MS = float(os.getenv("DEADLINE_SKIP_MS", "500"))  # below this, non-essential work is skipped
+
+# time.monotonic() by which the current request must be answered
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+# Named in 504s so callers can tell which hop ran out of budget; set by install
+_service = "service"
+
+class DeadlineExceeded(Exception):
+    """The request's budget ran out; answered with 504"""
+
+    def __init__(self, message: str, service: Optional[str] = None):
+        super().__init__(message)
+        self.service = service
+
+def remaining() -> Optional[float]:
+    """Seconds left in the current request's budget, or None without a deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def set_budget(ms: float):
+    """Give the current context a budget of ms from now; returns a token for reset"""
+    return _deadline.set(time.monotonic() + ms / 1000)
+
+def tighten(ms: float):
+    """Shorten the current budget to at most ms from now"""
+    deadline = time.monotonic() + ms / 1000
+    current = _deadline.get()
+    if current is None or deadline < current:
+        _deadline.set(deadline)
+
+def clear():
+    """Drop the deadline in this context, for work shared between requests"""
+    _deadline.set(None)
+
+def check(what: str):
+    """Raise DeadlineExceeded if the budget is spent before starting what"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {what} ({-left * 1000:.0f}ms over)", _service)
+
+def timeout(default: float, reserve: float = 0.0) -> float:
+    """default seconds, cut to what is left of the budget after keeping reserve seconds back"""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded ({-left * 1000:.0f}ms over)", _service)
+    return max(0.0, min(default, left - reserve))
+
+def nearly_exhausted() -> bool:
+    """True when less than DEADLINE_SKIP_MS is left, so optional work should be skipped"""
+    left = remaining()
+    return left is not None and left * 1000 < DEADLINE_SKIP_MS
+
+def allows(seconds: float) -> bool:
+    """Whether the budget leaves room to wait seconds and still do useful work after"""
+    left = remaining()
+    return left is None or left * 1000 - seconds * 1000 >= DEADLINE_SKIP_MS
+
+# Instrumentation
+
+_BUDGET_KEY = BUDGET_HEADER.encode()
+
+class DeadlineMiddleware:
+    """Starts each request's budget from the caller's header, never longer than the default
+    budget when there is one, and refuses requests whose budget is already spent"""
+
+    def __init__(self, app, default_budget_ms: float = 0.0):
+        self.app = app
+        self.default_budget_ms = default_budget_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget_ms = self.default_budget_ms or None
+        for key, value in scope["headers"]:
+            if key == _BUDGET_KEY:
+                try:
+                    sent_ms = float(value)
+                except ValueError:
+                    break
+                # nan and inf would pass for a budget and break the timeouts derived from it
+                if math.isfinite(sent_ms):
+                    budget_ms = min(sent_ms, DEADLINE_MAX_MS, budget_ms or DEADLINE_MAX_MS)
+                break
+        if budget_ms is None:
+            await self.app(scope, receive, send)
+            return
+        if budget_ms <= 0:
+            await self.reject(send, f"Request arrived with no budget left ({budget_ms:.0f}ms)")
+            return
+        token = set_budget(budget_ms)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _deadline.reset(token)
+
+    async def reject(self, send, detail: str):
+        await send({
+            "type": "http.response.start",
+            "status": 504,
+            "headers": [(b"content-type", b"application/json"), (EXCEEDED_HEADER.encode(), _service.encode())]
+        })
+        await send({"type": "http.response.body", "body": json.dumps({"detail": detail}).encode()})
+
+def _clamp(request):
+    """Fit a request's timeouts into the budget and pass the rest of the budget on"""
+    left = remaining()
+    if left is None:
+        return
+    left -= DEADLINE_MARGIN_MS / 1000
+    if left <= 0:
+        raise DeadlineExceeded(f"Deadline exceeded before {request.method} {request.url.host}", _service)
+    timeouts: Dict[str, Optional[float]] = dict(request.extensions.get("timeout", {}))
+    for name in ("connect", "read", "write", "pool"):
+        value = timeouts.get(name)
+        timeouts[name] = left if value is None else min(value, left)
+    request.extensions["timeout"] = timeouts
+    request.headers[BUDGET_HEADER] = str(int(left * 1000))
+
+def _raise_if_exceeded(request, response):
+    """A downstream 504 for a spent budget fails this request the same way"""
+    if response.status_code == 504 and EXCEEDED_HEADER in response.headers:
+        raise DeadlineExceeded(
+            f"Deadline exceeded in {response.headers[EXCEEDED_HEADER]} ({request.method} {request.url.path})",
+            response.headers[EXCEEDED_HEADER]
+        )
+
+def instrument_httpx():
+    """Budget-limited timeouts and budget propagation for every httpx request"""
+    import httpx
+    if getattr(httpx.AsyncClient.send, "_deadline", False):
+        return
+    async_send = httpx.AsyncClient.send
+    sync_send = httpx.Client.send
+
+    async def deadline_async_send(self, request, **kwargs):
+        _clamp(request)
+        try:
+            response = await async_send(self, request, **kwargs)
+        except httpx.TimeoutException as e:
+            left = remaining()
+            if left is not None and left <= DEADLINE_MARGIN_MS / 1000:
+                raise DeadlineExceeded(f"Deadline exceeded waiting for {request.url.host}", _service) from e
+            raise
+        _raise_if_exceeded(request, response)
+        return response
+
+    def deadline_sync_send(self, request, **kwargs):
+        _clamp(request)
+        try:
+            response = sync_send(self, request, **kwargs)
+        except httpx.TimeoutException as e:
+            left = remaining()
+            if left is not None and left <= DEADLINE_MARGIN_MS / 1000:
+                raise DeadlineExceeded(f"Deadline exceeded waiting for {request.url.host}", _service) from e
+            raise
+        _raise_if_exceeded(request, response)
+        return response
+
+    deadline_async_send._deadline = True
+    httpx.AsyncClient.send = deadline_async_send
+    httpx.Client.send = deadline_sync_send
+
+def install(app, service: str, default_budget_ms: float = REQUEST_BUDGET_MS):
+    """Honour request budgets in an app and pass them on to the services it calls"""
+    from fastapi.responses import JSONResponse
+    global _service
+    _service = service
+
+    async def deadline_exceeded(request, exc: DeadlineExceeded):
+        logger.warning(f"{request.method} {request.url.path}: {exc}")
+        return JSONResponse(status_code=504, content={"detail": str(exc)},
+                            headers={EXCEEDED_HEADER: exc.service or service})
+
+    app.add_middleware(DeadlineMiddleware, default_budget_ms=default_budget_ms)
+    app.add_exception_handler(DeadlineExceeded, deadline_exceeded)
+    instrument_httpx()
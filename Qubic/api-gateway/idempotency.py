@@ -0,0 +1,95 @@
+"""
+Idempotency
+Returns the original task for repeated task submissions instead of running the pipeline again
+"""
+
+import json
+import hashlib
+import logging
+from typing import Any, Dict, Optional
+import redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "idempotency"
+IN_FLIGHT_PREFIX = "submission"
+
+# Longest Idempotency-Key accepted
+MAX_KEY_LENGTH = 255
+
+def fingerprint(user_id: str, body: Dict[str, Any]) -> str:
+    """Hash of who submitted what; identical submissions share it"""
+    canonical = json.dumps({"user_id": user_id, "body": body}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+class IdempotencyStore:
+    """Claims for task submissions, each a Redis string set with SET NX so the first request wins.
+
+    An Idempotency-Key claim records the task it started and the request's fingerprint, and is
+    kept for ttl_seconds whatever the outcome, except that a submission which failed releases
+    it so the client's retry starts afresh. An in-flight claim, keyed by the fingerprint alone,
+    lasts only while the first request is being served (in_flight_ttl_seconds at most, should
+    the gateway die) and collapses identical submissions that overlap with it."""
+
+    def __init__(self, client: redis.Redis, ttl_seconds: int = 86400, in_flight_ttl_seconds: int = 60):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.in_flight_ttl_seconds = in_flight_ttl_seconds
+        self.claimed = 0
+        self.replayed = 0
+        self.conflicts = 0
+
+    @staticmethod
+    def key(user_id: str, idempotency_key: str) -> str:
+        """Keys are scoped per user so clients cannot collide with, or probe, each other's"""
+        return f"{KEY_PREFIX}:{user_id}:{hashlib.sha256(idempotency_key.encode()).hexdigest()[:32]}"
+
+    @staticmethod
+    def in_flight_key(request_fingerprint: str) -> str:
+        return f"{IN_FLIGHT_PREFIX}:{request_fingerprint}"
+
+    def claim(self, key: str, task_id: str, request_fingerprint: str, ttl_seconds: Optional[int] = None) -> Optional[Dict[str, str]]:
+        """Claim key for task_id; returns None once claimed, or the existing claim's record"""
+        record = json.dumps({"task_id": task_id, "fingerprint": request_fingerprint})
+        ttl = ttl_seconds or self.ttl_seconds
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(key, record, nx=True, ex=ttl)
+            pipe.get(key)
+            claimed, existing = pipe.execute()
+        if claimed:
+            self.claimed += 1
+            return None
+        if existing is None:
+            # Released between the two commands; the earlier submission failed, so take over
+            return self.claim(key, task_id, request_fingerprint, ttl)
+        existing = json.loads(existing)
+        if existing["fingerprint"] == request_fingerprint:
+            self.replayed += 1
+        else:
+            self.conflicts += 1
+        return existing
+
+    def release(self, key: str, task_id: str):
+        """Drop task_id's claim on key so the next submission runs again. The claim is deleted
+        only if it still names task_id, so a retry that claimed the key since keeps its own."""
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.watch(key)
+                record = pipe.get(key)
+                if record is None or json.loads(record)["task_id"] != task_id:
+                    return
+                pipe.multi()
+                pipe.delete(key)
+                pipe.execute()
+        except redis.WatchError:
+            pass  # replaced while releasing, so no longer ours
+        except redis.RedisError as e:
+            logger.warning(f"Could not release {key}; it expires on its own: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "claimed": self.claimed,
+            "replayed": self.replayed,
+            "conflicts": self.conflicts
+        }
@@ -7,13 +7,24 @@ import os
 import logging
 import httpx
 import json
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional, Tuple
 import redis
 from datetime import datetime
 import uuid
+from ratelimit import build_limiter
+from admission import AdmissionController
+from idempotency import IdempotencyStore, MAX_KEY_LENGTH, fingerprint
+from auth import AuthError, KeySet, TokenVerifier
+import serve
+import tracing
+import metrics
+import profiling
+import deadlines
+import resilience
+import wire
 
 # Configure logging
 logging.basicConfig(
@@ -38,16 +49,98 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 PLANNER_SERVICE_URL = os.getenv("PLANNER_SERVICE_URL", "http://localhost:8004")
 AGENT_RUNTIME_URL = os.getenv("AGENT_RUNTIME_URL", "http://localhost:8005")
 AUDIT_SERVICE_URL = os.getenv("AUDIT_SERVICE_URL", "http://localhost:8002")
+REQUEST_BUDGET_MS = float(os.getenv("REQUEST_BUDGET_MS", "30000"))  # end-to-end budget per request
+# Tighter budgets per task type, e.g. "monitor_wallet=10000,transfer_funds=20000"
+TASK_BUDGETS_MS = {
+    name.strip(): float(ms)
+    for name, ms in (entry.split("=", 1) for entry in os.getenv("TASK_BUDGETS_MS", "").split(",") if "=" in entry)
+}
+RATE_LIMIT_MODE = os.getenv("RATE_LIMIT_MODE", "redis")
+RATE_LIMIT_PER_SECOND = float(os.getenv("RATE_LIMIT_PER_SECOND", "5"))  # task submissions per verified user or client address; 0 for none
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "20"))
+ADMISSION_MAX_DEPTH = int(os.getenv("ADMISSION_MAX_DEPTH", "64"))  # tasks executing in the runtime; 0 for no limit
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "32"))  # submissions per gateway worker; 0 for no limit
+ADMISSION_RETRY_AFTER = float(os.getenv("ADMISSION_RETRY_AFTER", "2"))  # Retry-After when shedding, in seconds
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))  # how long an Idempotency-Key is remembered
+DEDUPLICATE_IN_FLIGHT = os.getenv("DEDUPLICATE_IN_FLIGHT", "false").lower() == "true"  # collapse identical concurrent submissions
+AUTH_MODE = os.getenv("AUTH_MODE", "stub")  # "jwt" verifies bearer tokens; "stub" accepts anything
+JWKS_URL = os.getenv("JWKS_URL")
+JWKS_FILE = os.getenv("JWKS_FILE")  # read instead of JWKS_URL, for tests and air-gapped setups
+JWKS_REFRESH_SECONDS = float(os.getenv("JWKS_REFRESH_SECONDS", "300"))
+JWT_ALGORITHMS = [name.strip() for name in os.getenv("JWT_ALGORITHMS", "RS256,ES256").split(",") if name.strip()]
+JWT_ISSUER = os.getenv("JWT_ISSUER")
+JWT_AUDIENCE = os.getenv("JWT_AUDIENCE")
+JWT_LEEWAY_SECONDS = float(os.getenv("JWT_LEEWAY_SECONDS", "30"))  # clock skew allowed on exp and nbf
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))  # verified tokens kept per worker
 
 # Redis client
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+# Task submissions per verified user or client address
+rate_limiter = build_limiter(
+    RATE_LIMIT_MODE,
+    redis_client,
+    rate=RATE_LIMIT_PER_SECOND,
+    burst=RATE_LIMIT_BURST
+) if RATE_LIMIT_PER_SECOND > 0 else None
+
+# Load shedding on the runtime's queue depth and this worker's in-flight submissions
+admission = AdmissionController(
+    redis_client,
+    max_depth=ADMISSION_MAX_DEPTH,
+    max_in_flight=ADMISSION_MAX_IN_FLIGHT,
+    retry_after=ADMISSION_RETRY_AFTER
+)
+
+# Bearer token verification, without a call to the identity provider per request
+if AUTH_MODE == "jwt":
+    token_verifier = TokenVerifier(
+        KeySet(url=JWKS_URL, path=JWKS_FILE, refresh_seconds=JWKS_REFRESH_SECONDS),
+        algorithms=JWT_ALGORITHMS,
+        issuer=JWT_ISSUER,
+        audience=JWT_AUDIENCE,
+        leeway=JWT_LEEWAY_SECONDS,
+        cache_size=TOKEN_CACHE_SIZE
+    )
+elif AUTH_MODE == "stub":
+    token_verifier = None
+else:
+    raise ValueError(f"Unknown auth mode: {AUTH_MODE}")
+
+# Claims on Idempotency-Keys and on submissions in flight
+idempotency = IdempotencyStore(
+    redis_client,
+    ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+    in_flight_ttl_seconds=int(REQUEST_BUDGET_MS / 1000) or 60
+)
+
+# Metrics
+TASKS_REJECTED = metrics.Counter(
+    "qubic_gateway_tasks_rejected_total", "Task submissions answered with 429, by reason", ("reason",)
+)
+SUBMISSIONS_IN_FLIGHT = metrics.Gauge(
+    "qubic_gateway_submissions_in_flight", "POST /task/start requests being served", function=lambda: admission.in_flight
+)
+RUNTIME_QUEUE_DEPTH = metrics.Gauge(
+    "qubic_runtime_queue_depth", "Tasks executing in the agent runtime", function=admission.depth, shared=True
+)
+TOKEN_CHECKS = metrics.Counter(
+    "qubic_gateway_token_checks_total", "Bearer tokens checked, by result (cached, verified or rejected)", ("result",)
+)
+DUPLICATE_SUBMISSIONS = metrics.Counter(
+    "qubic_gateway_duplicate_submissions_total", "Task submissions answered with an earlier task, by match", ("match",)
+)
+
+# Set on a response that returns an earlier submission's task
+REPLAYED_HEADER = "Idempotent-Replayed"
+
 # Request/Response models
 class TaskStartRequest(BaseModel):
     task_type: str
     wallet_address: Optional[str] = None
     description: str
     parameters: Optional[dict] = None
+    priority: Optional[str] = None  # interactive, standard or batch; defaults by task type
 
 class TaskStartResponse(BaseModel):
     task_id: str
@@ -62,6 +155,7 @@ class TaskStatusResponse(BaseModel):
     plan_id: Optional[str] = None
     current_step: Optional[int] = None
     requires_approval: bool = False
+    error: Optional[str] = None
 
 class ApprovalRequest(BaseModel):
     approved: bool
@@ -72,14 +166,44 @@ class ApprovalResponse(BaseModel):
     approved: bool
     message: str
 
+class BulkApprovalItem(BaseModel):
+    task_id: str
+    step_id: Optional[str] = None
+    approved: bool
+    reason: str = ""
+
+class BulkApprovalRequest(BaseModel):
+    decisions: List[BulkApprovalItem]
+
 class AuditLogResponse(BaseModel):
     task_id: str
     logs: list
     qubic_txid: Optional[str] = None
 
-# OAuth stub - simple token validation
 async def verify_token(authorization: Optional[str] = Header(None)):
-    """Stub OAuth token verification"""
+    """The caller's identity from its bearer token; 401 unless the token verifies in jwt mode"""
+    if token_verifier is not None:
+        scheme, _, token = (authorization or "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            TOKEN_CHECKS.labels("rejected").inc()
+            raise HTTPException(status_code=401, detail="Bearer token required", headers={"WWW-Authenticate": "Bearer"})
+        claims = token_verifier.cached(token)
+        if claims is not None:
+            TOKEN_CHECKS.labels("cached").inc()
+        else:
+            try:
+                claims = await token_verifier.verify(token)
+            except AuthError as e:
+                TOKEN_CHECKS.labels("rejected").inc()
+                raise HTTPException(
+                    status_code=401,
+                    detail=f"Invalid token: {e}",
+                    headers={"WWW-Authenticate": 'Bearer error="invalid_token"'}
+                )
+            TOKEN_CHECKS.labels("verified").inc()
+        return {"user_id": claims["sub"], "email": claims.get("email")}
+    
+    # OAuth stub - simple token validation
     if authorization is None:
         # For prototype, allow requests without auth
         return {"user_id": "demo_user", "email": "demo@example.com"}
@@ -89,6 +213,59 @@ async def verify_token(authorization: Optional[str] = Header(None)):
     # Stub: accept any token
     return {"user_id": "demo_user", "email": "demo@example.com"}
 
+async def rate_limit(request: Request, user: dict = Depends(verify_token)):
+    """Charge a request to the verified user; 429 once the bucket is empty.
+
+    Only a verified identity gets a bucket of its own, since anything else the caller sends is
+    free to change between requests. In stub auth mode nobody is verified, so requests are
+    charged to the client's address."""
+    if rate_limiter is None:
+        return user
+    if token_verifier is not None:
+        subject = f"user:{user['user_id']}"
+    else:
+        subject = f"ip:{request.client.host if request.client else 'unknown'}"
+    try:
+        decision = rate_limiter.acquire(subject)
+    except redis.RedisError as e:
+        logger.warning(f"Rate limiter unavailable, admitting {subject}: {e}")
+        return user
+    if not decision.allowed:
+        TASKS_REJECTED.labels("rate_limited").inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit of {RATE_LIMIT_PER_SECOND:g} tasks per second exceeded",
+            headers={"Retry-After": decision.retry_after_header()}
+        )
+    return user
+
+async def admit_task():
+    """Hold a submission slot for the request, or shed it with 429 while the pipeline is saturated"""
+    reason = admission.check()
+    if reason is not None:
+        TASKS_REJECTED.labels("saturated").inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Task pipeline saturated ({reason}), retry later",
+            headers={"Retry-After": str(max(1, round(admission.retry_after)))}
+        )
+    admission.in_flight += 1
+    try:
+        yield
+    finally:
+        admission.in_flight -= 1
+
+@app.on_event("startup")
+async def startup_event():
+    """Keep the JWKS fresh in the background"""
+    if token_verifier is not None:
+        token_verifier.keys.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if token_verifier is not None:
+        await token_verifier.keys.close()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -99,13 +276,74 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         return {"status": "unhealthy", "error": str(e)}, 503
 
-@app.post("/task/start", response_model=TaskStartResponse)
+def claim_submission(task_id: str, request: TaskStartRequest, user_id: str,
+                     idempotency_key: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[dict]]:
+    """Claim the request's Idempotency-Key, and its content while in flight if deduplicating.
+    Returns (key claimed, in-flight key claimed, earlier submission's record if a duplicate)"""
+    if not idempotency_key and not DEDUPLICATE_IN_FLIGHT:
+        return None, None, None
+    request_fingerprint = fingerprint(user_id, request.model_dump())
+    key = in_flight_key = None
+    try:
+        if idempotency_key:
+            key = idempotency.key(user_id, idempotency_key)
+            existing = idempotency.claim(key, task_id, request_fingerprint)
+            if existing is not None:
+                if existing["fingerprint"] != request_fingerprint:
+                    raise HTTPException(
+                        status_code=422,
+                        detail="Idempotency-Key was already used for a different request"
+                    )
+                DUPLICATE_SUBMISSIONS.labels("idempotency_key").inc()
+                return None, None, existing
+        if DEDUPLICATE_IN_FLIGHT:
+            in_flight_key = idempotency.in_flight_key(request_fingerprint)
+            existing = idempotency.claim(in_flight_key, task_id, request_fingerprint, idempotency.in_flight_ttl_seconds)
+            if existing is not None:
+                if key:
+                    idempotency.release(key, task_id)
+                DUPLICATE_SUBMISSIONS.labels("in_flight").inc()
+                return None, None, existing
+    except redis.RedisError as e:
+        logger.warning(f"Idempotency store unavailable, starting task {task_id} without deduplication: {e}")
+    return key, in_flight_key, None
+
+@app.post("/task/start", response_model=TaskStartResponse, dependencies=[Depends(admit_task)])
 async def start_task(
     request: TaskStartRequest,
-    user: dict = Depends(verify_token)
+    response: Response,
+    user: dict = Depends(rate_limit),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """Start a new task"""
+    """Start a new task, or return the task an earlier submission with the same Idempotency-Key
+    (or, with DEDUPLICATE_IN_FLIGHT, an identical submission still in flight) started"""
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
+    
     task_id = str(uuid.uuid4())
+    key, in_flight_key, duplicate = claim_submission(task_id, request, user["user_id"], idempotency_key)
+    if duplicate is not None:
+        logger.info(f"Duplicate submission of task {duplicate['task_id']}")
+        response.headers[REPLAYED_HEADER] = "true"
+        return TaskStartResponse(
+            task_id=duplicate["task_id"],
+            status=redis_client.hget(f"task:{duplicate['task_id']}", "status") or "pending",
+            message="Duplicate submission, returning the original task"
+        )
+    
+    try:
+        return await launch_task(task_id, request, user)
+    except BaseException:
+        # Nothing ran to completion, so a retry with the same key should start the task again
+        if key:
+            idempotency.release(key, task_id)
+        raise
+    finally:
+        if in_flight_key:
+            idempotency.release(in_flight_key, task_id)
+
+async def launch_task(task_id: str, request: TaskStartRequest, user: dict) -> TaskStartResponse:
+    """Record a task, have it planned and hand the plan to the agent runtime"""
     logger.info(f"Starting task {task_id}: {request.task_type}")
     
     # Store task metadata in Redis
@@ -122,20 +360,24 @@ async def start_task(
     
     redis_client.hset(f"task:{task_id}", mapping=task_data)
     
+    if request.task_type in TASK_BUDGETS_MS:
+        deadlines.tighten(TASK_BUDGETS_MS[request.task_type])
+    
     # Send to planner service
     try:
         async with httpx.AsyncClient(timeout=30.0) as client:
             planner_response = await client.post(
                 f"{PLANNER_SERVICE_URL}/plan/create",
-                json={
+                **wire.body({
                     "task_id": task_id,
                     "task_type": request.task_type,
                     "description": request.description,
-                    "parameters": request.parameters or {}
-                }
+                    "parameters": request.parameters or {},
+                    "user_id": user["user_id"]
+                })
             )
             planner_response.raise_for_status()
-            plan_data = planner_response.json()
+            plan_data = wire.decode(planner_response)
             
             # Update task with plan_id
             redis_client.hset(f"task:{task_id}", "plan_id", plan_data.get("plan_id", ""))
@@ -144,18 +386,33 @@ async def start_task(
             # Send plan to agent runtime
             runtime_response = await client.post(
                 f"{AGENT_RUNTIME_URL}/plan/execute",
-                json={
+                **wire.body({
                     "task_id": task_id,
-                    "plan": plan_data
-                }
+                    "plan": plan_data,
+                    "user_id": user["user_id"],
+                    "task_type": request.task_type,
+                    "priority": request.priority
+                })
             )
             runtime_response.raise_for_status()
             
             redis_client.hset(f"task:{task_id}", "status", "executing")
             
+    except (deadlines.DeadlineExceeded, resilience.CircuitOpen) as e:
+        # Answered with 504 or 503 by the handlers deadlines and resilience install
+        logger.error(f"Task {task_id} failed fast: {e}")
+        redis_client.hset(f"task:{task_id}", mapping={"status": "failed", "error": str(e)})
+        raise
     except httpx.HTTPError as e:
         logger.error(f"Error starting task: {e}")
         redis_client.hset(f"task:{task_id}", "status", "failed")
+        if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 403:
+            # Refused by the policy rules, which is the caller's answer rather than a failure
+            try:
+                detail = wire.decode(e.response).get("detail")
+            except ValueError:
+                detail = e.response.text
+            raise HTTPException(status_code=403, detail=detail)
         raise HTTPException(status_code=500, detail=f"Failed to start task: {str(e)}")
     
     return TaskStartResponse(
@@ -180,8 +437,8 @@ async def get_task_status(
     current_step = None
     try:
         async with httpx.AsyncClient(timeout=10.0) as client:
-            runtime_response = await client.get(
-                f"{AGENT_RUNTIME_URL}/task/{task_id}/status"
+            runtime_response = await resilience.request(
+                client, "GET", f"{AGENT_RUNTIME_URL}/task/{task_id}/status", hedge=True
             )
             if runtime_response.status_code == 200:
                 runtime_data = runtime_response.json()
@@ -205,7 +462,8 @@ async def get_task_status(
         updated_at=task_data.get("updated_at", ""),
         plan_id=task_data.get("plan_id"),
         current_step=current_step if current_step is not None else (int(task_data.get("current_step", 0)) if task_data.get("current_step") else None),
-        requires_approval=requires_approval
+        requires_approval=requires_approval,
+        error=task_data.get("error")
     )
 
 @app.post("/task/{task_id}/approve", response_model=ApprovalResponse)
@@ -247,6 +505,63 @@ async def approve_task(
         message="Approval processed successfully"
     )
 
+@app.get("/approvals/pending")
+async def list_pending_approvals(
+    approver: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+    user: dict = Depends(verify_token)
+):
+    """Approval inbox: pending approvals, most urgent first"""
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            response = await resilience.request(
+                client, "GET", f"{AGENT_RUNTIME_URL}/approvals/pending", hedge=True,
+                params={k: v for k, v in {"approver": approver, "limit": limit, "offset": offset}.items() if v is not None}
+            )
+            response.raise_for_status()
+            return response.json()
+    except httpx.HTTPError as e:
+        logger.error(f"Error listing approvals: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to list approvals: {str(e)}")
+
+@app.post("/approvals/bulk")
+async def bulk_approve(
+    request: BulkApprovalRequest,
+    user: dict = Depends(verify_token)
+):
+    """Approve or reject many tasks in one request"""
+    try:
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            response = await client.post(
+                f"{AGENT_RUNTIME_URL}/approvals/bulk",
+                json={
+                    "decisions": [decision.model_dump() for decision in request.decisions],
+                    "user_id": user["user_id"]
+                }
+            )
+            response.raise_for_status()
+            result = response.json()
+    except httpx.HTTPStatusError as e:
+        try:
+            detail = e.response.json().get("detail", str(e))
+        except ValueError:
+            detail = e.response.text
+        raise HTTPException(status_code=e.response.status_code, detail=detail)
+    except httpx.HTTPError as e:
+        logger.error(f"Error processing bulk approval: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to process approvals: {str(e)}")
+    
+    # Update task status for every processed decision in one round trip
+    updated_at = datetime.utcnow().isoformat()
+    with redis_client.pipeline(transaction=False) as pipe:
+        for item in result.get("results", []):
+            if item["status"] in ("approved", "rejected"):
+                pipe.hset(f"task:{item['task_id']}", mapping={"status": item["status"], "updated_at": updated_at})
+        pipe.execute()
+    
+    return result
+
 @app.get("/audit/{task_id}", response_model=AuditLogResponse)
 async def get_audit_log(
     task_id: str,
@@ -255,8 +570,8 @@ async def get_audit_log(
     """Get audit log for a task"""
     try:
         async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{AUDIT_SERVICE_URL}/audit/{task_id}"
+            response = await resilience.request(
+                client, "GET", f"{AUDIT_SERVICE_URL}/audit/{task_id}", hedge=True
             )
             response.raise_for_status()
             audit_data = response.json()
@@ -270,8 +585,26 @@ async def get_audit_log(
         logger.error(f"Error fetching audit log: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch audit log: {str(e)}")
 
+@app.get("/admission")
+async def admission_stats():
+    """Task admission, rate limiter, deduplication and token verification statistics"""
+    return {
+        "admission": admission.stats(),
+        "rate_limit": rate_limiter.stats() if rate_limiter is not None else None,
+        "idempotency": idempotency.stats(),
+        "auth": token_verifier.stats() if token_verifier is not None else {"mode": AUTH_MODE}
+    }
+
+serve.install(app, "api-gateway")
+tracing.install(app, "api-gateway")
+metrics.install(app, "api-gateway")
+profiling.install(app, "api-gateway")
+deadlines.install(app, "api-gateway", default_budget_ms=REQUEST_BUDGET_MS)
+resilience.install(app)
+wire.install(app)
+
 if __name__ == "__main__":
-    import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # In-process rate limit buckets belong to a single process
+    serve.run(app, port=port, max_workers=1 if RATE_LIMIT_MODE == "local" else None)
 
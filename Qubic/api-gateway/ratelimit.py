@@ -0,0 +1,140 @@
+"""
+Rate Limiting
+Token buckets per user or API key, in Redis or in process
+"""
+
+import abc
+import math
+import time
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+import redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "ratelimit"
+
+# Refill the bucket for the time since its last use, then take cost tokens if it holds them.
+# The bucket is a hash of its token count and last update time in ms; it expires once it
+# would be full again anyway.
+#
+# KEYS: the subject's bucket
+# ARGV: now_ms, rate per second, burst, cost
+# Returns {allowed, ms until cost tokens are available (0 if allowed), tokens left}
+TOKEN_BUCKET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate / 1000)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, wait, tostring(tokens)}
+"""
+
+class RateDecision:
+    def __init__(self, allowed: bool, retry_after: float = 0.0, remaining: float = 0.0):
+        self.allowed = allowed
+        self.retry_after = retry_after
+        self.remaining = remaining
+
+    def retry_after_header(self) -> str:
+        """Whole seconds for the Retry-After header, at least 1"""
+        return str(max(1, math.ceil(self.retry_after)))
+
+class RateLimiter(abc.ABC):
+    """rate requests per second per subject, with bursts of up to burst"""
+
+    mode = "base"
+
+    def __init__(self, rate: float = 5.0, burst: float = 20.0):
+        self.rate = rate
+        self.burst = burst
+        self.allowed = 0
+        self.limited = 0
+
+    @abc.abstractmethod
+    def acquire(self, subject: str, cost: float = 1.0) -> RateDecision:
+        """Take cost tokens from the subject's bucket if it holds them"""
+
+    def _count(self, decision: RateDecision) -> RateDecision:
+        if decision.allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+        return decision
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "allowed": self.allowed,
+            "limited": self.limited
+        }
+
+class RedisRateLimiter(RateLimiter):
+    """Buckets shared by every gateway worker and replica, updated in one Lua call"""
+
+    mode = "redis"
+
+    def __init__(self, client: redis.Redis, **limits):
+        super().__init__(**limits)
+        self.client = client
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def acquire(self, subject: str, cost: float = 1.0) -> RateDecision:
+        allowed, wait_ms, tokens = self._script(keys=[f"{KEY_PREFIX}:{subject}"], args=[
+            int(time.time() * 1000),
+            self.rate,
+            self.burst,
+            cost
+        ])
+        return self._count(RateDecision(bool(allowed), int(wait_ms) / 1000, float(tokens)))
+
+class LocalRateLimiter(RateLimiter):
+    """In-process buckets for a single gateway worker, tests and local development"""
+
+    mode = "local"
+
+    def __init__(self, **limits):
+        super().__init__(**limits)
+        self._buckets: Dict[str, Tuple[float, float]] = {}  # subject -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def acquire(self, subject: str, cost: float = 1.0) -> RateDecision:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(subject, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[subject] = (tokens, now)
+            # A full bucket is the same as none, so drop those rather than grow without bound
+            if len(self._buckets) > 10000:
+                self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                                 if bucket[0] + (now - bucket[1]) * self.rate < self.burst}
+        if allowed:
+            return self._count(RateDecision(True, 0.0, tokens))
+        return self._count(RateDecision(False, (cost - tokens) / self.rate, tokens))
+
+def build_limiter(mode: str, client: Optional[redis.Redis] = None, **limits) -> RateLimiter:
+    """Limiter factory for the RATE_LIMIT_MODE setting"""
+    if mode == "redis":
+        return RedisRateLimiter(client, **limits)
+    if mode == "local":
+        return LocalRateLimiter(**limits)
+    raise ValueError(f"Unknown rate limit mode: {mode}")
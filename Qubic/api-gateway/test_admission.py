@@ -0,0 +1,67 @@
+"""
+Admission tests
+Shedding on in-flight submissions and on the runtime's queue depth, read from Redis
+"""
+
+import time
+import fakeredis
+import redis
+import pytest
+from admission import EXECUTING_KEY, AdmissionController
+
+@pytest.fixture
+def client():
+    return fakeredis.FakeRedis()
+
+def executing(client, count, started=None):
+    started = time.time() if started is None else started
+    client.zadd(EXECUTING_KEY, {f"task-{started}-{i}": started for i in range(count)})
+
+def test_in_flight_limit_sheds_before_reading_redis(client):
+    admission = AdmissionController(client, max_depth=5, max_in_flight=2)
+    assert admission.check() is None
+    admission.in_flight = 2
+    assert admission.check() == "2 submissions in flight"
+    admission.in_flight = 1
+    assert admission.check() is None
+    assert (admission.admitted, admission.shed) == (2, 1)
+
+def test_runtime_depth_sheds_and_stale_entries_are_trimmed(client):
+    executing(client, 3)
+    executing(client, 4, started=time.time() - 600)
+    admission = AdmissionController(client, max_depth=3, refresh_seconds=0)
+    assert admission.check() == "3 tasks executing in the agent runtime"
+    assert client.zcard(EXECUTING_KEY) == 3
+
+    client.zremrangebyrank(EXECUTING_KEY, 0, 0)
+    assert admission.check() is None
+    assert admission.stats() == {"max_depth": 3, "max_in_flight": 32, "depth": 2,
+                                 "in_flight": 0, "admitted": 1, "shed": 1}
+
+def test_depth_is_cached_for_the_refresh_interval(client, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    admission = AdmissionController(client, max_depth=2, refresh_seconds=1)
+    assert admission.depth() == 0
+    executing(client, 2)
+    assert admission.check() is None
+    now[0] += 1
+    assert admission.check() is not None
+
+def test_redis_outage_admits_on_the_in_flight_limit_alone(client, monkeypatch):
+    executing(client, 10)
+
+    def down(*args, **kwargs):
+        raise redis.ConnectionError("redis is down")
+
+    monkeypatch.setattr(client, "pipeline", down)
+    admission = AdmissionController(client, max_depth=1, max_in_flight=1, refresh_seconds=0)
+    assert admission.check() is None
+    admission.in_flight = 1
+    assert admission.check() is not None
+
+def test_zero_limits_disable_shedding(client):
+    executing(client, 100)
+    admission = AdmissionController(client, max_depth=0, max_in_flight=0)
+    admission.in_flight = 100
+    assert admission.check() is None
@@ -0,0 +1,111 @@
+"""
+Auth tests
+JWT verification against a JWKS file: signature, kid, alg, exp and sub, the claims cache and key rotation
+"""
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import time
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from auth import AuthError, KeySet, TokenVerifier
+
+def signing_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def jwks(**keys):
+    entries = []
+    for kid, private in keys.items():
+        entry = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private.public_key()))
+        entries.append({**entry, "kid": kid, "use": "sig", "alg": "RS256"})
+    return {"keys": entries}
+
+@pytest.fixture(scope="module")
+def private():
+    return signing_key()
+
+@pytest.fixture
+def jwks_path(tmp_path, private):
+    path = tmp_path / "jwks.json"
+    path.write_text(json.dumps(jwks(k1=private)))
+    return path
+
+@pytest.fixture
+def verifier(jwks_path):
+    return TokenVerifier(KeySet(path=str(jwks_path), min_refresh_seconds=0), ["RS256"],
+                         issuer="https://id.qubic", audience="qubic", leeway=0)
+
+def token(private, kid="k1", algorithm="RS256", **claims):
+    payload = {"sub": "alice", "iss": "https://id.qubic", "aud": "qubic", "exp": int(time.time()) + 60, **claims}
+    return jwt.encode({key: value for key, value in payload.items() if value is not None},
+                      private, algorithm=algorithm, headers={"kid": kid})
+
+def rejected(verifier, bad_token):
+    with pytest.raises(AuthError) as error:
+        asyncio.run(verifier.claims(bad_token))
+    return str(error.value)
+
+def test_valid_token_is_verified_once_then_cached(verifier, private):
+    good = token(private)
+    assert asyncio.run(verifier.claims(good))["sub"] == "alice"
+    assert asyncio.run(verifier.claims(good))["sub"] == "alice"
+    assert (verifier.verified, verifier.hits) == (1, 1)
+    assert verifier.stats()["jwks"]["keys"] == ["k1"]
+
+def test_expired_and_subjectless_tokens_are_rejected(verifier, private):
+    assert "expired" in rejected(verifier, token(private, exp=int(time.time()) - 10))
+    assert "exp" in rejected(verifier, token(private, exp=None))
+    assert "sub" in rejected(verifier, token(private, sub=None))
+    assert rejected(verifier, token(private, aud="elsewhere"))
+    assert rejected(verifier, token(private, iss="https://evil"))
+    assert verifier.rejected == 5
+
+def test_cached_claims_expire_with_the_token(verifier, private, monkeypatch):
+    short = token(private, exp=int(time.time()) + 1)
+    asyncio.run(verifier.claims(short))
+    assert verifier.cached(short) is not None
+    later = time.time() + 5
+    monkeypatch.setattr(time, "time", lambda: later)
+    assert verifier.cached(short) is None
+    assert verifier.stats()["cached"] == 0
+
+def test_unknown_kid_and_foreign_signatures_are_rejected(verifier, private):
+    assert "Unknown signing key 'k9'" in rejected(verifier, token(private, kid="k9"))
+    # Signed by another key under a known kid
+    assert rejected(verifier, token(signing_key()))
+
+def hs256(secret, payload, kid="k1"):
+    """An HS256 token signed by hand, since PyJWT refuses a PEM public key as an HMAC secret"""
+    def encode(part):
+        return base64.urlsafe_b64encode(part).rstrip(b"=")
+    signing_input = encode(json.dumps({"alg": "HS256", "typ": "JWT", "kid": kid}).encode()) + b"." + \
+        encode(json.dumps(payload).encode())
+    return (signing_input + b"." + encode(hmac.new(secret, signing_input, hashlib.sha256).digest())).decode()
+
+def test_only_the_configured_algorithms_are_accepted(verifier, private):
+    assert "not allowed" in rejected(verifier, token(private, algorithm="RS512"))
+    # The public key used as an HMAC secret must not pass for the RSA key
+    public_pem = private.public_key().public_bytes(Encoding.PEM, PublicFormat.SubjectPublicKeyInfo)
+    forged = hs256(public_pem, {"sub": "mallory", "iss": "https://id.qubic", "aud": "qubic",
+                                "exp": int(time.time()) + 60})
+    assert rejected(verifier, forged)
+    assert rejected(verifier, "not.a.token")
+
+def test_rotated_kid_is_fetched_on_demand(verifier, jwks_path, private):
+    rotated = signing_key()
+    jwks_path.write_text(json.dumps(jwks(k1=private, k2=rotated)))
+    assert asyncio.run(verifier.claims(token(rotated, kid="k2")))["sub"] == "alice"
+    assert verifier.keys.refreshes == 1
+
+def test_failed_refresh_keeps_the_loaded_keys(jwks_path):
+    keys = KeySet(path=str(jwks_path), min_refresh_seconds=0)
+    jwks_path.write_text("not json")
+    assert not asyncio.run(keys.refresh())
+    assert len(keys) == 1 and keys.refresh_failures == 1
+    with pytest.raises(ValueError):
+        KeySet()
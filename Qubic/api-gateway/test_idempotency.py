@@ -0,0 +1,55 @@
+"""
+Idempotency tests
+Replays of a submission versus reuse of its Idempotency-Key for a different body
+"""
+
+import fakeredis
+import pytest
+from idempotency import IdempotencyStore, fingerprint
+
+BODY = {"task_type": "transfer_funds", "description": "Send 25 ETH", "parameters": {"amount": 25.0}}
+
+@pytest.fixture
+def store():
+    return IdempotencyStore(fakeredis.FakeRedis(decode_responses=True), ttl_seconds=60)
+
+def test_fingerprint_ignores_key_order_but_not_values():
+    reordered = {"parameters": {"amount": 25.0}, "description": "Send 25 ETH", "task_type": "transfer_funds"}
+    assert fingerprint("alice", BODY) == fingerprint("alice", reordered)
+    assert fingerprint("alice", BODY) != fingerprint("bob", BODY)
+    assert fingerprint("alice", BODY) != fingerprint("alice", {**BODY, "parameters": {"amount": 26.0}})
+
+def test_replay_returns_the_original_task(store):
+    key = store.key("alice", "retry-1")
+    assert store.claim(key, "task-1", fingerprint("alice", BODY)) is None
+
+    existing = store.claim(key, "task-2", fingerprint("alice", BODY))
+    assert existing == {"task_id": "task-1", "fingerprint": fingerprint("alice", BODY)}
+    assert (store.claimed, store.replayed, store.conflicts) == (1, 1, 0)
+
+def test_conflicting_body_keeps_the_original_claim(store):
+    key = store.key("alice", "retry-1")
+    store.claim(key, "task-1", fingerprint("alice", BODY))
+
+    other = {**BODY, "parameters": {"amount": 2500.0}}
+    existing = store.claim(key, "task-2", fingerprint("alice", other))
+    assert existing["task_id"] == "task-1"
+    assert existing["fingerprint"] != fingerprint("alice", other)
+    assert (store.replayed, store.conflicts) == (0, 1)
+    # The original body still replays afterwards
+    assert store.claim(key, "task-3", fingerprint("alice", BODY))["task_id"] == "task-1"
+
+def test_keys_are_scoped_per_user(store):
+    assert store.key("alice", "retry-1") != store.key("bob", "retry-1")
+    assert store.claim(store.key("alice", "retry-1"), "task-1", fingerprint("alice", BODY)) is None
+    assert store.claim(store.key("bob", "retry-1"), "task-2", fingerprint("bob", BODY)) is None
+
+def test_failed_submission_releases_only_its_own_claim(store):
+    key = store.key("alice", "retry-1")
+    store.claim(key, "task-1", fingerprint("alice", BODY))
+    # A stale release from another task leaves the claim alone
+    store.release(key, "task-0")
+    assert store.claim(key, "task-2", fingerprint("alice", BODY))["task_id"] == "task-1"
+
+    store.release(key, "task-1")
+    assert store.claim(key, "task-2", fingerprint("alice", BODY)) is None
@@ -0,0 +1,76 @@
+"""
+Rate limit tests
+Token buckets in Redis and in process, and submissions charged to the verified user
+"""
+
+import asyncio
+import time
+import fakeredis
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from ratelimit import build_limiter
+
+@pytest.fixture(params=["redis", "local"])
+def limiter(request):
+    return build_limiter(request.param, fakeredis.FakeRedis(), rate=10, burst=3)
+
+def test_burst_then_refill_at_the_rate(limiter, monkeypatch):
+    assert [limiter.acquire("alice").allowed for _ in range(4)] == [True, True, True, False]
+    decision = limiter.acquire("alice")
+    assert 0 < decision.retry_after <= 0.1 and decision.retry_after_header() == "1"
+    assert limiter.acquire("bob").allowed
+    assert (limiter.allowed, limiter.limited) == (4, 2)
+
+    # A tenth of a second later, one token is back
+    later = time.time() + 0.15, time.monotonic() + 0.15
+    monkeypatch.setattr(time, "time", lambda: later[0])
+    monkeypatch.setattr(time, "monotonic", lambda: later[1])
+    assert limiter.acquire("alice").allowed
+    assert not limiter.acquire("alice").allowed
+
+def test_cost_above_the_burst_is_never_allowed(limiter):
+    decision = limiter.acquire("alice", cost=5)
+    assert not decision.allowed
+    assert decision.remaining == 3
+
+def test_redis_bucket_expires_once_full_again():
+    client = fakeredis.FakeRedis()
+    build_limiter("redis", client, rate=10, burst=3).acquire("alice")
+    # Refilled from empty in 300ms, plus a second of slack
+    assert 1000 < client.pttl("ratelimit:alice") <= 1300
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        build_limiter("memcached", None)
+
+def request(host="10.0.0.1", api_key=None):
+    headers = [(b"x-api-key", api_key.encode())] if api_key else []
+    return Request({"type": "http", "method": "POST", "path": "/task/start", "headers": headers, "client": (host, 40000)})
+
+@pytest.fixture
+def gateway(service, monkeypatch):
+    monkeypatch.setattr(service, "rate_limiter", build_limiter("local", rate=0.001, burst=2))
+    return service
+
+def charge(gateway, user_id, **options):
+    return asyncio.run(gateway.rate_limit(request(**options), {"user_id": user_id}))
+
+def test_verified_user_cannot_escape_with_fresh_api_keys(gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "token_verifier", object())
+    charge(gateway, "alice", api_key="key-1")
+    charge(gateway, "alice", api_key="key-2")
+    with pytest.raises(HTTPException) as error:
+        charge(gateway, "alice", api_key="key-3")
+    assert error.value.status_code == 429
+    assert int(error.value.headers["Retry-After"]) >= 1
+    # Other users keep their own bucket
+    charge(gateway, "bob", api_key="key-3")
+
+def test_unverified_callers_are_charged_by_address(gateway, monkeypatch):
+    monkeypatch.setattr(gateway, "token_verifier", None)
+    charge(gateway, "demo_user", host="10.0.0.1", api_key="key-1")
+    charge(gateway, "demo_user", host="10.0.0.1", api_key="key-2")
+    with pytest.raises(HTTPException):
+        charge(gateway, "demo_user", host="10.0.0.1", api_key="key-3")
+    charge(gateway, "demo_user", host="10.0.0.2")
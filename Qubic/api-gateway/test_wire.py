@@ -0,0 +1,80 @@
+"""
+Wire tests
+msgpack or JSON bodies by content type, responses by the caller's accept header
+"""
+
+from datetime import datetime, timezone
+import httpx
+import msgpack
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+import wire
+
+class Order(BaseModel):
+    wallet_address: str
+    amount: float
+
+@pytest.fixture(scope="module")
+def client():
+    app = FastAPI()
+
+    @app.post("/order")
+    async def order(request: Order):
+        return {"wallet_address": request.wallet_address, "amount": request.amount,
+                "at": datetime(2026, 1, 1, tzinfo=timezone.utc)}
+
+    @app.get("/text", response_class=PlainTextResponse)
+    async def text():
+        return "plain"
+
+    wire.install(app)
+    return TestClient(app)
+
+ORDER = {"wallet_address": "0xa", "amount": 5.0}
+ANSWER = {**ORDER, "at": "2026-01-01T00:00:00+00:00"}
+
+@pytest.mark.parametrize("format", ["json", "msgpack"])
+def test_each_format_is_decoded_and_answered_in_kind(client, format):
+    response = client.post("/order", **wire.body(ORDER, format))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(wire.MSGPACK if format == "msgpack" else wire.JSON)
+    assert wire.decode(response) == ANSWER
+
+def test_formats_can_be_mixed(client):
+    # A msgpack body from a caller that only reads JSON, and the other way round
+    response = client.post("/order", content=wire.dumps(ORDER, "msgpack"),
+                           headers={"content-type": wire.MSGPACK, "accept": "*/*"})
+    assert response.headers["content-type"].startswith(wire.JSON)
+    assert response.json() == ANSWER
+
+    response = client.post("/order", json=ORDER, headers={"accept": wire.MSGPACK})
+    assert msgpack.unpackb(response.content) == ANSWER
+
+def test_invalid_msgpack_body_is_validated_as_usual(client):
+    response = client.post("/order", content=wire.dumps({"amount": "lots"}, "msgpack"),
+                           headers={"content-type": wire.MSGPACK})
+    assert response.status_code == 422
+
+def test_explicit_response_classes_are_kept(client):
+    response = client.get("/text", headers={"accept": wire.MSGPACK})
+    assert response.text == "plain"
+
+class TaskId:
+    def __str__(self):
+        return "task-1"
+
+def test_datetimes_and_unknown_types_are_encoded_alike():
+    payload = {1: "one", "when": datetime(2026, 1, 1), "id": TaskId()}
+    # JSON turns the int key into a string; msgpack keeps it
+    assert wire.loads(wire.dumps(payload)) == {"1": "one", "when": "2026-01-01T00:00:00", "id": "task-1"}
+    assert wire.loads(wire.dumps(payload, "msgpack"), wire.MSGPACK) == {1: "one", "when": "2026-01-01T00:00:00", "id": "task-1"}
+
+def test_client_body_defaults_to_the_configured_format(monkeypatch):
+    monkeypatch.setattr(wire, "WIRE_FORMAT", "msgpack")
+    arguments = wire.body(ORDER)
+    assert arguments["headers"] == {"content-type": wire.MSGPACK, "accept": wire.MSGPACK}
+    response = httpx.Response(200, content=arguments["content"], headers={"content-type": wire.MSGPACK})
+    assert wire.decode(response) == ORDER
@@ -0,0 +1,29 @@
+"""Add partial index on unanchored audit logs
+
+Revision ID: 003
+Revises: 002
+Create Date: 2024-01-01 00:00:02.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        'ix_audit_logs_unanchored',
+        'audit_logs',
+        ['id'],
+        unique=False,
+        postgresql_where=sa.text('qubic_txid IS NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_audit_logs_unanchored', table_name='audit_logs')
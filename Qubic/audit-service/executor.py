@@ -0,0 +1,105 @@
+"""
+Executor
+Offloads CPU-bound hashing and JSON canonicalization from the event loop
+"""
+
+import os
+import json
+import asyncio
+import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+# Configuration
+# inline  - everything runs on the event loop thread
+# thread  - canonicalize and hash in a thread pool; json.dumps holds the GIL, so the loop
+#           still stalls while a large payload is encoded
+# process - canonicalize and hash in a process pool
+# Payloads under HASH_OFFLOAD_THRESHOLD are always hashed inline
+HASH_EXECUTOR_MODE = os.getenv("HASH_EXECUTOR_MODE", "process")
+HASH_OFFLOAD_THRESHOLD = int(os.getenv("HASH_OFFLOAD_THRESHOLD", str(64 * 1024)))
+HASH_THREAD_WORKERS = int(os.getenv("HASH_THREAD_WORKERS", "4"))
+HASH_PROCESS_WORKERS = int(os.getenv("HASH_PROCESS_WORKERS", "2"))
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=HASH_THREAD_WORKERS, thread_name_prefix="hash")
+    return _thread_pool
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=HASH_PROCESS_WORKERS)
+    return _process_pool
+
+def canonical_json(data: Any) -> str:
+    """Canonical JSON encoding used for hashing"""
+    return json.dumps(data, sort_keys=True)
+
+def sha256_hex(payload: bytes) -> str:
+    """SHA-256 hex digest of raw bytes"""
+    return hashlib.sha256(payload).hexdigest()
+
+def hash_data(data: Dict) -> str:
+    """Generate SHA-256 hash of data"""
+    return sha256_hex(canonical_json(data).encode())
+
+def estimate_size(data: Any, limit: int) -> int:
+    """Approximate serialized size of data, stopping once limit is exceeded"""
+    size = 0
+    stack = [data]
+    while stack and size < limit:
+        item = stack.pop()
+        if isinstance(item, dict):
+            size += 2
+            for key, value in item.items():
+                size += len(str(key)) + 4
+                stack.append(value)
+        elif isinstance(item, (list, tuple)):
+            size += 2
+            stack.extend(item)
+        elif isinstance(item, (str, bytes)):
+            size += len(item) + 2
+        else:
+            size += 8
+    return size
+
+async def sha256_hex_async(payload: bytes) -> str:
+    """SHA-256 of payload, hashed in the thread pool when above the threshold"""
+    if HASH_EXECUTOR_MODE == "inline" or len(payload) < HASH_OFFLOAD_THRESHOLD:
+        return sha256_hex(payload)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_thread_pool(), sha256_hex, payload)
+
+async def hash_data_async(data: Dict) -> str:
+    """Generate SHA-256 hash of data without blocking the event loop on large payloads"""
+    if HASH_EXECUTOR_MODE == "inline" or estimate_size(data, HASH_OFFLOAD_THRESHOLD) < HASH_OFFLOAD_THRESHOLD:
+        return hash_data(data)
+    pool = _get_process_pool() if HASH_EXECUTOR_MODE == "process" else _get_thread_pool()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, hash_data, data)
+
+async def dumps_async(data: Any, sort_keys: bool = False) -> str:
+    """json.dumps, moved to the process pool for large payloads in process mode"""
+    if HASH_EXECUTOR_MODE != "process" or estimate_size(data, HASH_OFFLOAD_THRESHOLD) < HASH_OFFLOAD_THRESHOLD:
+        return json.dumps(data, sort_keys=sort_keys)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_process_pool(),
+        functools.partial(json.dumps, data, sort_keys=sort_keys)
+    )
+
+def shutdown():
+    """Shut down executor pools"""
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
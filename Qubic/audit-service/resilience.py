@@ -0,0 +1,338 @@
+"""
+Resilience
+Per-target circuit breakers, retry budgets, jittered backoff and hedged reads for calls between services
+"""
+
+import os
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional
+
+import httpx
+
+import metrics
+import deadlines
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", "5"))  # consecutive failures that open a breaker
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "5"))  # open time before one probe is let through
+RETRY_MAX = int(os.getenv("RETRY_MAX", "2"))  # retries per call after the first attempt
+RETRY_BUDGET_RATIO = float(os.getenv("RETRY_BUDGET_RATIO", "0.2"))  # retries earned per call
+RETRY_BUDGET_PER_SECOND = float(os.getenv("RETRY_BUDGET_PER_SECOND", "1"))  # retries earned per second without traffic
+RETRY_BUDGET_MAX = float(os.getenv("RETRY_BUDGET_MAX", "10"))  # retries that can be saved up per target
+RETRY_BACKOFF_MS = float(os.getenv("RETRY_BACKOFF_MS", "100"))  # first retry's delay, doubled per retry
+RETRY_BACKOFF_MAX_MS = float(os.getenv("RETRY_BACKOFF_MAX_MS", "2000"))
+HEDGE_DELAY_MS = float(os.getenv("HEDGE_DELAY_MS", "0"))  # fixed hedge delay; 0 for the target's recent p95
+HEDGE_MIN_MS = float(os.getenv("HEDGE_MIN_MS", "5"))  # floor under the p95 hedge delay
+HEDGE_MIN_SAMPLES = 20  # reads timed before hedging starts
+
+# The target, or a proxy in front of it, could not serve the request; worth another attempt
+RETRYABLE_STATUSES = frozenset({502, 503, 504})
+
+BREAKER_STATE = metrics.Gauge(
+    "qubic_circuit_breaker_state", "Workers with each target's breaker in each state", ("target", "state")
+)
+BREAKER_REJECTED = metrics.Counter(
+    "qubic_circuit_breaker_rejected_total", "Requests failed fast by an open breaker", ("target",)
+)
+RETRIES = metrics.Counter(
+    "qubic_http_client_retries_total", "Extra requests sent: retries and hedges", ("target", "kind")
+)
+RETRIES_DENIED = metrics.Counter(
+    "qubic_http_client_retries_denied_total", "Retries and hedges not sent, by what ran out", ("target", "reason")
+)
+
+class CircuitOpen(httpx.TransportError):
+    """Raised instead of sending a request to a target whose breaker is open"""
+
+    def __init__(self, target: str, retry_after: float, request: Optional[httpx.Request] = None):
+        super().__init__(f"Circuit open for {target}, next probe in {retry_after:.1f}s", request=request)
+        self.target = target
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Opens after BREAKER_FAILURES consecutive failures (transport errors and 5xx responses),
+    failing requests fast; after BREAKER_RESET_SECONDS one probe is let through, and its
+    outcome closes the breaker or opens it again"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, target: str, failures: int = BREAKER_FAILURES, reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.target = target
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._gauges = {state: BREAKER_STATE.labels(target, state) for state in (self.CLOSED, self.OPEN, self.HALF_OPEN)}
+        self._gauges[self.CLOSED].set(1)
+
+    def _move(self, state: str):
+        self._gauges[self.state].set(0)
+        self._gauges[state].set(1)
+        self.state = state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.reset_seconds:
+                    return False
+                self._move(self.HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def retry_after(self) -> float:
+        """Seconds until the next probe may be sent"""
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def record(self, ok: Optional[bool]):
+        """Outcome of an allowed request: True for success, False for failure, None for neither
+        (cancelled, or failed for the caller's own reasons such as a spent deadline)"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._probing = False
+                if ok is True:
+                    self.failures = 0
+                    self._move(self.CLOSED)
+                    logger.info(f"Circuit closed for {self.target}")
+                elif ok is False:
+                    self._open()
+                return
+            if ok is True:
+                self.failures = 0
+            elif ok is False:
+                self.failures += 1
+                if self.state == self.CLOSED and self.failures >= self.failure_threshold:
+                    self._open()
+
+    def _open(self):
+        self.opened_at = time.monotonic()
+        self._move(self.OPEN)
+        logger.warning(f"Circuit opened for {self.target} after {self.failures} consecutive failures")
+
+class RetryBudget:
+    """Token bucket limiting retries to a share of traffic: every call earns RETRY_BUDGET_RATIO
+    of a retry and every second RETRY_BUDGET_PER_SECOND, so an outage cannot multiply the load
+    on a struggling target"""
+
+    def __init__(self, ratio: float = RETRY_BUDGET_RATIO, per_second: float = RETRY_BUDGET_PER_SECOND,
+                 maximum: float = RETRY_BUDGET_MAX):
+        self.ratio = ratio
+        self.per_second = per_second
+        self.maximum = maximum
+        self.tokens = maximum
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.maximum, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.maximum, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+class Target:
+    """Breaker, retry budget and recent read latencies of one host:port"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.budget = RetryBudget()
+        self.latencies: Deque[float] = deque(maxlen=200)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging a read, or None until enough reads have been timed"""
+        if HEDGE_DELAY_MS > 0:
+            return HEDGE_DELAY_MS / 1000
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.latencies)
+        return max(HEDGE_MIN_MS / 1000, ordered[int(0.95 * (len(ordered) - 1))])
+
+_targets: Dict[str, Target] = {}
+
+def target(url: httpx.URL) -> Target:
+    name = url.netloc.decode("ascii")
+    found = _targets.get(name)
+    if found is None:
+        found = _targets.setdefault(name, Target(name))
+    return found
+
+def backoff(retry: int) -> float:
+    """Seconds before the retry-th retry: full jitter up to RETRY_BACKOFF_MS doubled per retry"""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX_MS, RETRY_BACKOFF_MS * 2 ** (retry - 1))) / 1000
+
+def jitter(seconds: float) -> float:
+    """seconds, spread over its upper half so reconnecting clients do not move in lockstep"""
+    return random.uniform(seconds / 2, seconds)
+
+# Requests
+
+def _definitive(task: asyncio.Future) -> bool:
+    """A finished attempt whose outcome another copy would not improve on"""
+    return task.exception() is None and task.result().status_code not in RETRYABLE_STATUSES
+
+async def _hedged(send: Callable[[], Awaitable[httpx.Response]], found: Target) -> httpx.Response:
+    """Send; if no answer within the target's hedge delay, send a second copy and take
+    whichever answers first"""
+    start = time.perf_counter()
+    first = asyncio.ensure_future(send())
+    tasks = [first]
+    try:
+        delay = found.hedge_delay()
+        if delay is not None:
+            await asyncio.wait(tasks, timeout=delay)
+            if not first.done():
+                if not deadlines.allows(0):
+                    RETRIES_DENIED.labels(found.name, "deadline").inc()
+                elif not found.budget.withdraw():
+                    RETRIES_DENIED.labels(found.name, "budget").inc()
+                else:
+                    RETRIES.labels(found.name, "hedge").inc()
+                    tasks.append(asyncio.ensure_future(send()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if _definitive(task):
+                    found.latencies.append(time.perf_counter() - start)
+                    return task.result()
+        # Every copy failed: prefer a response, which the caller can inspect, to an exception
+        for task in tasks:
+            if task.exception() is None:
+                return task.result()
+        raise first.exception()
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+async def request(client: httpx.AsyncClient, method: str, url: str, *, retries: int = RETRY_MAX,
+                  hedge: bool = False, **kwargs) -> httpx.Response:
+    """Send a request through client, retrying transport errors and 502/503/504 responses with
+    jittered backoff while the target's retry budget and the request deadline allow.
+
+    hedge=True also sends a second copy when the first is slower than the target's recent p95;
+    use it only for idempotent reads. Returns the last response (check it with
+    raise_for_status as usual) or raises the last transport error; an open breaker is raised
+    at once."""
+    async def send() -> httpx.Response:
+        return await client.send(client.build_request(method, url, **kwargs))
+
+    found = target(client.build_request(method, url, **kwargs).url)
+    found.budget.deposit()
+    attempt = 0
+    while True:
+        response = None
+        error: Optional[Exception] = None
+        try:
+            response = await (_hedged(send, found) if hedge else send())
+        except CircuitOpen:
+            raise
+        except httpx.TransportError as e:
+            error = e
+        if response is not None and response.status_code not in RETRYABLE_STATUSES:
+            return response
+
+        if attempt >= retries:
+            break
+        attempt += 1
+        delay = backoff(attempt)
+        if not deadlines.allows(delay):
+            RETRIES_DENIED.labels(found.name, "deadline").inc()
+            break
+        if not found.budget.withdraw():
+            RETRIES_DENIED.labels(found.name, "budget").inc()
+            break
+        RETRIES.labels(found.name, "retry").inc()
+        reason = error if error is not None else f"status {response.status_code}"
+        logger.warning(f"Retrying {method} {found.name} ({attempt}/{retries}) after {reason!r}")
+        await asyncio.sleep(delay)
+
+    if error is not None:
+        raise error
+    return response
+
+# Instrumentation
+
+def instrument_httpx():
+    """Circuit breakers on every httpx request"""
+    if getattr(httpx.AsyncClient.send, "_breaker", False):
+        return
+    async_send = httpx.AsyncClient.send
+    sync_send = httpx.Client.send
+
+    def admit(request: httpx.Request) -> CircuitBreaker:
+        breaker = target(request.url).breaker
+        if not breaker.allow():
+            BREAKER_REJECTED.labels(breaker.target).inc()
+            raise CircuitOpen(breaker.target, breaker.retry_after(), request=request)
+        return breaker
+
+    async def breaker_async_send(self, request, **kwargs):
+        breaker = admit(request)
+        ok = None
+        try:
+            response = await async_send(self, request, **kwargs)
+            ok = response.status_code < 500
+            return response
+        except httpx.TransportError:
+            ok = False
+            raise
+        finally:
+            breaker.record(ok)
+
+    def breaker_sync_send(self, request, **kwargs):
+        breaker = admit(request)
+        ok = None
+        try:
+            response = sync_send(self, request, **kwargs)
+            ok = response.status_code < 500
+            return response
+        except httpx.TransportError:
+            ok = False
+            raise
+        finally:
+            breaker.record(ok)
+
+    breaker_async_send._breaker = True
+    httpx.AsyncClient.send = breaker_async_send
+    httpx.Client.send = breaker_sync_send
+
+def install(app):
+    """Circuit breakers on the httpx requests an app makes; an open breaker that reaches the
+    app unhandled is answered with 503 and Retry-After"""
+    from fastapi.responses import JSONResponse
+
+    async def circuit_open(request, exc: CircuitOpen):
+        return JSONResponse(status_code=503, content={"detail": str(exc)},
+                            headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))})
+
+    app.add_exception_handler(CircuitOpen, circuit_open)
+    instrument_httpx()
@@ -0,0 +1,128 @@
+"""
+Deadline tests
+Budgets taken from the caller, passed on downstream with the margin kept back, and expiry
+"""
+
+import asyncio
+import contextvars
+import time
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import deadlines
+
+def isolated(func):
+    """Run func in a copy of the current context, so deadlines it sets do not leak"""
+    return contextvars.copy_context().run(func)
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/budget")
+    async def budget():
+        left = deadlines.remaining()
+        return {"left_ms": None if left is None else left * 1000}
+
+    app.add_middleware(deadlines.DeadlineMiddleware, default_budget_ms=1000)
+    return TestClient(app)
+
+def left_ms(client, budget=None):
+    headers = {} if budget is None else {deadlines.BUDGET_HEADER: budget}
+    return client.get("/budget", headers=headers).json()["left_ms"]
+
+def test_budget_comes_from_the_caller_capped_at_the_default(client):
+    assert 150 < left_ms(client, "200") <= 200
+    assert 900 < left_ms(client, "60000") <= 1000
+    # Anything that is not a finite number is ignored in favour of the default
+    for sent in ("nan", "inf", "soon"):
+        assert 900 < left_ms(client, sent) <= 1000
+
+def test_spent_budget_is_refused_with_504():
+    # Called directly: a TestClient with instrumented httpx would raise on the 504 itself
+    called = []
+    sent = []
+
+    async def app(scope, receive, send):
+        called.append(scope)
+
+    async def send(message):
+        sent.append(message)
+
+    middleware = deadlines.DeadlineMiddleware(app, default_budget_ms=1000)
+    asyncio.run(middleware({"type": "http", "headers": [(deadlines._BUDGET_KEY, b"0")]}, None, send))
+    assert called == []
+    assert sent[0]["status"] == 504
+    assert deadlines.EXCEEDED_HEADER.encode() in dict(sent[0]["headers"])
+
+def test_no_deadline_without_a_budget():
+    app = FastAPI()
+    app.add_middleware(deadlines.DeadlineMiddleware)
+    app.get("/budget")(lambda: {"left": deadlines.remaining()})
+    assert TestClient(app).get("/budget").json() == {"left": None}
+
+def downstream(handler):
+    deadlines.instrument_httpx()
+    return httpx.Client(base_url="http://downstream", transport=httpx.MockTransport(handler))
+
+def test_remaining_budget_and_timeouts_are_passed_on():
+    seen = {}
+
+    def handler(request):
+        seen["budget_ms"] = int(request.headers[deadlines.BUDGET_HEADER])
+        seen["timeout"] = request.extensions["timeout"]
+        return httpx.Response(200)
+
+    def call():
+        deadlines.set_budget(300)
+        downstream(handler).get("/work", timeout=10.0)
+
+    isolated(call)
+    assert 300 - deadlines.DEADLINE_MARGIN_MS - 50 < seen["budget_ms"] <= 300 - deadlines.DEADLINE_MARGIN_MS
+    assert all(value <= 0.3 for value in seen["timeout"].values())
+
+def test_spent_budget_fails_before_sending_and_downstream_expiry_propagates():
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(504, headers={deadlines.EXCEEDED_HEADER: "worker-service"})
+
+    def spent():
+        deadlines.set_budget(deadlines.DEADLINE_MARGIN_MS / 2)
+        downstream(handler).get("/work")
+
+    with pytest.raises(deadlines.DeadlineExceeded):
+        isolated(spent)
+    assert sent == []
+
+    def expired_downstream():
+        deadlines.set_budget(1000)
+        downstream(handler).get("/work")
+
+    with pytest.raises(deadlines.DeadlineExceeded) as error:
+        isolated(expired_downstream)
+    assert error.value.service == "worker-service"
+
+def test_budget_helpers():
+    def run():
+        assert deadlines.timeout(5.0) == 5.0 and deadlines.allows(60)
+        deadlines.set_budget(2000)
+        assert 1.4 < deadlines.timeout(5.0, reserve=0.5) <= 1.5
+        assert not deadlines.nearly_exhausted()
+        assert deadlines.allows(1.0) and not deadlines.allows(1.8)
+        # tighten only ever shortens
+        deadlines.tighten(5000)
+        assert deadlines.remaining() <= 2.0
+        deadlines.tighten(100)
+        assert deadlines.nearly_exhausted()
+        time.sleep(0.11)
+        with pytest.raises(deadlines.DeadlineExceeded):
+            deadlines.check("the audit write")
+        with pytest.raises(deadlines.DeadlineExceeded):
+            deadlines.timeout(1.0)
+        deadlines.clear()
+        assert deadlines.remaining() is None
+
+    isolated(run)
@@ -0,0 +1,540 @@
+"""
+Tracing
+W3C trace context propagation and spans for requests, httpx, Redis and SQL, exported over OTLP/HTTP, to a file or the console
+"""
+
+import abc
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Configuration
+# none    - no spans are recorded; incoming trace context is still passed downstream
+# console - one log line per span on stderr
+# file    - JSON lines in TRACE_FILE
+# otlp    - OTLP/HTTP JSON to OTEL_EXPORTER_OTLP_ENDPOINT (a collector, Jaeger, Tempo...)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "512"))
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "2"))
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318")
+
+TRACEPARENT = "traceparent"
+
+# OTLP span kinds
+KINDS = {"internal": 1, "server": 2, "client": 3}
+
+class SpanContext:
+    """Identity of a span, local or received in a traceparent header"""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def recording(self) -> bool:
+        return False
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """Parse a W3C traceparent header; None if absent or malformed"""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[0] == "ff":
+        return None
+    try:
+        flags = int(parts[3][:2], 16)
+        int(parts[1], 16)
+        int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return SpanContext(parts[1], parts[2], bool(flags & 1))
+
+class Span(SpanContext):
+    __slots__ = ("name", "kind", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 attributes: Optional[Dict[str, Any]] = None):
+        super().__init__(trace_id, f"{random.getrandbits(64):016x}", sampled)
+        self.name = name
+        self.kind = kind
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    @property
+    def recording(self) -> bool:
+        return self.sampled and not self.end_ns
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if self.end_ns:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            tracer.export(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "service": tracer.service,
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+_current: ContextVar[Optional[SpanContext]] = ContextVar("qubic_current_span", default=None)
+
+def current() -> Optional[SpanContext]:
+    """The active span, or the remote parent of this request when spans are not recorded"""
+    return _current.get()
+
+def inject(headers) -> None:
+    """Add the traceparent of the active span to outgoing request headers"""
+    context = _current.get()
+    if context is not None:
+        headers[TRACEPARENT] = context.traceparent()
+
+# Exporters
+
+class Exporter(abc.ABC):
+    @abc.abstractmethod
+    def export(self, spans: List[Span]):
+        """Send a batch of finished spans"""
+
+    def close(self):
+        pass
+
+class ConsoleExporter(Exporter):
+    def export(self, spans: List[Span]):
+        for span in spans:
+            sys.stderr.write(
+                f"span {tracer.service} {span.name} {span.duration_ms:.2f}ms trace={span.trace_id} "
+                f"span={span.span_id} parent={span.parent_id or '-'}{' error=' + span.error if span.error else ''}\n"
+            )
+
+class FileExporter(Exporter):
+    """JSON lines; several services may append to the same file"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(span.to_dict()) + "\n" for span in spans))
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+class OTLPExporter(Exporter):
+    """OTLP/HTTP with the JSON encoding, so no protobuf or SDK dependency is needed"""
+
+    def __init__(self, endpoint: str):
+        import httpx
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.client = httpx.Client(timeout=10.0)
+
+    def export(self, spans: List[Span]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": tracer.service}}]},
+            "scopeSpans": [{
+                "scope": {"name": "qubic"},
+                "spans": [{
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    "parentSpanId": span.parent_id or "",
+                    "name": span.name,
+                    "kind": KINDS.get(span.kind, 1),
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 0}
+                } for span in spans]
+            }]
+        }]}
+        self.client.post(self.url, json=payload).raise_for_status()
+
+    def close(self):
+        self.client.close()
+
+def build_exporter(name: str) -> Optional[Exporter]:
+    if name == "none":
+        return None
+    if name == "console":
+        return ConsoleExporter()
+    if name == "file":
+        return FileExporter(TRACE_FILE)
+    if name == "otlp":
+        return OTLPExporter(OTEL_EXPORTER_OTLP_ENDPOINT)
+    raise ValueError(f"Unknown trace exporter: {name}")
+
+# Tracer
+
+class Tracer:
+    """Creates spans and exports finished ones in batches from a background thread, so
+    request paths never wait on the exporter; when the queue is full spans are dropped"""
+
+    def __init__(self, exporter: Optional[Exporter] = None, sample_ratio: float = 1.0):
+        self.service = "service"
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._pid = os.getpid()
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def start_span(self, name: str, kind: str = "internal", parent: Optional[SpanContext] = None,
+                   attributes: Optional[Dict[str, Any]] = None) -> Span:
+        parent = parent if parent is not None else _current.get()
+        if parent is None:
+            return Span(name, kind, f"{random.getrandbits(128):032x}", None,
+                        random.random() < self.sample_ratio, attributes)
+        return Span(name, kind, parent.trace_id, parent.span_id, parent.sampled, attributes)
+
+    @contextmanager
+    def span(self, name: str, kind: str = "internal", **attributes) -> Iterator[Optional[Span]]:
+        """Run a block as a child span of the active one (a no-op when tracing is disabled)"""
+        if self.exporter is None:
+            yield None
+            return
+        span = self.start_span(name, kind, attributes=attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    def export(self, span: Span):
+        if self._thread is None or self._pid != os.getpid():
+            self._start()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        # Also restarts the thread in a forked worker, which does not inherit it
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch: List[Span] = []
+            deadline = time.monotonic() + TRACE_EXPORT_INTERVAL
+            stop = False
+            while len(batch) < TRACE_BATCH_SIZE:
+                try:
+                    span = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if span is None:
+                    stop = True
+                    break
+                batch.append(span)
+            if batch:
+                try:
+                    self.exporter.export(batch)
+                    self.exported += len(batch)
+                except Exception as e:
+                    self.failed += len(batch)
+                    logger.warning(f"Exporting {len(batch)} spans failed: {e}")
+            if stop:
+                return
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush queued spans"""
+        if self._thread is None or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+        if self.exporter is not None:
+            self.exporter.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "exporter": TRACE_EXPORTER,
+            "sample_ratio": self.sample_ratio,
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+tracer = Tracer(build_exporter(TRACE_EXPORTER), TRACE_SAMPLE_RATIO)
+atexit.register(tracer.shutdown)
+
+def span(name: str, kind: str = "internal", **attributes):
+    return tracer.span(name, kind, **attributes)
+
+def traced(name: str):
+    """Decorator running an async function as a span"""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# Instrumentation
+
+class TracingMiddleware:
+    """Server span per request, parented to the caller's traceparent"""
+
+    def __init__(self, app, service_app=None):
+        self.app = app
+        self.service_app = service_app
+        self._paths: Optional[Dict[Any, str]] = None
+
+    def route(self, scope) -> str:
+        if self._paths is None:
+            self._paths = {
+                route.endpoint: route.path
+                for route in getattr(self.service_app, "routes", [])
+                if hasattr(route, "endpoint")
+            }
+        return self._paths.get(scope.get("endpoint"), scope["path"])
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        remote = None
+        for key, value in scope["headers"]:
+            if key == b"traceparent":
+                remote = parse_traceparent(value.decode("latin-1"))
+                break
+        if tracer.exporter is None:
+            # Not recording: still hand the caller's context to downstream calls
+            token = _current.set(remote)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _current.reset(token)
+            return
+
+        span = tracer.start_span(scope["method"], "server", parent=remote)
+        token = _current.set(span)
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", span.trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current.reset(token)
+            route = self.route(scope)
+            span.name = f"{scope['method']} {route}"
+            span.attributes.update({"http.method": scope["method"], "http.route": route, "http.status_code": status})
+            span.end()
+
+def instrument_httpx():
+    """Client span and traceparent injection for every httpx request"""
+    import httpx
+    if getattr(httpx.AsyncClient.send, "_traced", False):
+        return
+    async_send = httpx.AsyncClient.send
+    sync_send = httpx.Client.send
+
+    def start(request) -> Optional[Span]:
+        parent = _current.get()
+        if parent is None:
+            return None
+        if not parent.recording:
+            request.headers[TRACEPARENT] = parent.traceparent()
+            return None
+        span = tracer.start_span(f"HTTP {request.method} {request.url.host}:{request.url.port}", "client", attributes={
+            "http.method": request.method,
+            "http.url": str(request.url.copy_with(query=None))
+        })
+        request.headers[TRACEPARENT] = span.traceparent()
+        return span
+
+    def finish(span: Span, response=None, error: Optional[BaseException] = None):
+        if response is not None:
+            span.set_attribute("http.status_code", response.status_code)
+        if error is not None:
+            span.record_error(error)
+        span.end()
+
+    async def traced_async_send(self, request, **kwargs):
+        span = start(request)
+        if span is None:
+            return await async_send(self, request, **kwargs)
+        try:
+            response = await async_send(self, request, **kwargs)
+        except BaseException as e:
+            finish(span, error=e)
+            raise
+        finish(span, response)
+        return response
+
+    def traced_sync_send(self, request, **kwargs):
+        span = start(request)
+        if span is None:
+            return sync_send(self, request, **kwargs)
+        try:
+            response = sync_send(self, request, **kwargs)
+        except BaseException as e:
+            finish(span, error=e)
+            raise
+        finish(span, response)
+        return response
+
+    traced_async_send._traced = True
+    httpx.AsyncClient.send = traced_async_send
+    httpx.Client.send = traced_sync_send
+
+def _redis_statement(args) -> str:
+    return str(args[0]) if args else "?"
+
+def instrument_redis():
+    """Client span per Redis command or pipeline while a span is recording"""
+    import redis
+    import redis.asyncio
+    if getattr(redis.Redis.execute_command, "_traced", False):
+        return
+    sync_command = redis.Redis.execute_command
+    sync_pipeline = redis.client.Pipeline.execute
+    async_command = redis.asyncio.Redis.execute_command
+    async_pipeline = redis.asyncio.client.Pipeline.execute
+
+    def recording() -> bool:
+        parent = _current.get()
+        return parent is not None and parent.recording
+
+    def traced_command(self, *args, **options):
+        if not recording():
+            return sync_command(self, *args, **options)
+        with tracer.span(f"redis {_redis_statement(args)}", "client"):
+            return sync_command(self, *args, **options)
+
+    def traced_pipeline(self, *args, **kwargs):
+        if not recording():
+            return sync_pipeline(self, *args, **kwargs)
+        with tracer.span("redis pipeline", "client", commands=len(self.command_stack)):
+            return sync_pipeline(self, *args, **kwargs)
+
+    async def traced_async_command(self, *args, **options):
+        if not recording():
+            return await async_command(self, *args, **options)
+        with tracer.span(f"redis {_redis_statement(args)}", "client"):
+            return await async_command(self, *args, **options)
+
+    async def traced_async_pipeline(self, *args, **kwargs):
+        if not recording():
+            return await async_pipeline(self, *args, **kwargs)
+        with tracer.span("redis pipeline", "client", commands=len(self.command_stack)):
+            return await async_pipeline(self, *args, **kwargs)
+
+    traced_command._traced = True
+    redis.Redis.execute_command = traced_command
+    redis.client.Pipeline.execute = traced_pipeline
+    redis.asyncio.Redis.execute_command = traced_async_command
+    redis.asyncio.client.Pipeline.execute = traced_async_pipeline
+
+def instrument_sqlalchemy(engine):
+    """Client span per SQL statement while a span is recording"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        if parent is None or not parent.recording:
+            return
+        span = tracer.start_span(f"sql {statement.split(None, 1)[0].upper()}", "client", attributes={
+            "db.statement": statement[:200]
+        })
+        conn.info.setdefault("qubic_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("qubic_spans")
+        if spans:
+            spans.pop().end()
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):
+        spans = context.connection.info.get("qubic_spans") if context.connection is not None else None
+        if spans:
+            span = spans.pop()
+            span.record_error(context.original_exception)
+            span.end()
+
+def install(app, service: str):
+    """Trace every request of an app and the httpx and Redis calls made while serving it"""
+    tracer.service = os.getenv("OTEL_SERVICE_NAME", service)
+    app.add_middleware(TracingMiddleware, service_app=app)
+    instrument_httpx()
+    instrument_redis()
+    app.add_event_handler("shutdown", tracer.shutdown)
@@ -0,0 +1,286 @@
+"""
+Analysis
+Pluggable task analysis providers with response caching, request batching and a latency budget
+"""
+
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import httpx
+import deadlines
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Masked out of descriptions for the cache key, since they change from one request to the next
+# without changing what the task is
+ADDRESS_PATTERN = re.compile(r"\b0x[0-9a-f]+\b")
+NUMBER_PATTERN = re.compile(r"\b\d+(?:[.,]\d+)*\b")
+
+class AnalysisRequest:
+    def __init__(self, task_type: str, description: str, parameters: Dict[str, Any]):
+        self.task_type = task_type
+        self.description = description
+        self.parameters = parameters or {}
+
+    def cache_key(self) -> str:
+        """Key over the request's intent: its task type, its description with addresses and
+        numbers masked, and which parameters it sets. Parameter values are left out: the analysis
+        only classifies the task, while amounts and addresses are judged per request by
+        risk_scoring and the policy rules."""
+        description = re.sub(r"\s+", " ", (self.description or "").strip().lower())
+        normalized = {
+            "task_type": self.task_type.strip().lower(),
+            "description": NUMBER_PATTERN.sub("<n>", ADDRESS_PATTERN.sub("<address>", description)),
+            "parameters": sorted(self.parameters)
+        }
+        data_str = json.dumps(normalized, sort_keys=True, default=str)
+        return hashlib.sha256(data_str.encode()).hexdigest()
+
+class AnalysisProvider:
+    """Analyzes batches of tasks into {action_type, risk_level, requires_approval}"""
+
+    name = "base"
+
+    async def analyze_batch(self, requests: List[AnalysisRequest]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class RuleBasedProvider(AnalysisProvider):
+    """Static rules keyed on task_type; also the fallback when a provider is slow or failing"""
+
+    name = "rules"
+
+    RULES = {
+        "monitor_wallet": {
+            "action_type": "monitoring",
+            "risk_level": "medium",
+            "requires_approval": False
+        },
+        "transfer_funds": {
+            "action_type": "transaction",
+            "risk_level": "high",
+            "requires_approval": True
+        }
+    }
+    DEFAULT = {
+        "action_type": "unknown",
+        "risk_level": "low",
+        "requires_approval": False
+    }
+
+    def analyze(self, request: AnalysisRequest) -> Dict[str, Any]:
+        return dict(self.RULES.get(request.task_type, self.DEFAULT))
+
+    async def analyze_batch(self, requests: List[AnalysisRequest]) -> List[Dict[str, Any]]:
+        return [self.analyze(request) for request in requests]
+
+class StubLLMProvider(RuleBasedProvider):
+    """Deterministic local stand-in for an LLM: keyword matching over the description,
+    with an optional artificial per-batch latency"""
+
+    name = "stub"
+
+    KEYWORDS = [
+        (("transfer", "send", "withdraw", "pay"), "transfer_funds"),
+        (("monitor", "watch", "track", "alert"), "monitor_wallet")
+    ]
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+
+    def analyze(self, request: AnalysisRequest) -> Dict[str, Any]:
+        if request.task_type in self.RULES:
+            return dict(self.RULES[request.task_type])
+        description = (request.description or "").lower()
+        for keywords, task_type in self.KEYWORDS:
+            if any(keyword in description for keyword in keywords):
+                return dict(self.RULES[task_type])
+        return dict(self.DEFAULT)
+
+    async def analyze_batch(self, requests: List[AnalysisRequest]) -> List[Dict[str, Any]]:
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return [self.analyze(request) for request in requests]
+
+class HTTPLLMProvider(AnalysisProvider):
+    """Calls an LLM gateway that accepts a batch of tasks:
+    POST {"tasks": [{task_type, description, parameters}]} -> {"results": [{action_type, risk_level, requires_approval}]}"""
+
+    name = "http"
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def analyze_batch(self, requests: List[AnalysisRequest]) -> List[Dict[str, Any]]:
+        response = await self._client.post(self.url, json={
+            "tasks": [
+                {
+                    "task_type": request.task_type,
+                    "description": request.description,
+                    "parameters": request.parameters
+                }
+                for request in requests
+            ]
+        })
+        response.raise_for_status()
+        results = response.json().get("results", [])
+        if len(results) != len(requests):
+            raise ValueError(f"LLM returned {len(results)} results for {len(requests)} tasks")
+        return results
+
+    async def close(self):
+        await self._client.aclose()
+
+class AnalysisCache:
+    """LRU of analysis results with a TTL"""
+
+    def __init__(self, max_size: int = 4096, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+class Analyzer:
+    """Front door for task analysis: cache, then a batched provider call within a latency
+    budget, then the rule-based fallback"""
+
+    def __init__(self, provider: AnalysisProvider, cache: AnalysisCache, budget_ms: float = 2000.0,
+                 batch_window_ms: float = 5.0, max_batch_size: int = 16):
+        self.provider = provider
+        self.cache = cache
+        self.budget_ms = budget_ms
+        self.batch_window_ms = batch_window_ms
+        self.max_batch_size = max_batch_size
+        self.fallback = RuleBasedProvider()
+        self._queue: List[Tuple[AnalysisRequest, str]] = []
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.fallbacks = 0
+
+    async def analyze(self, task_type: str, description: str, parameters: Dict[str, Any]) -> Dict[str, Any]:
+        request = AnalysisRequest(task_type, description, parameters)
+        if type(self.provider) is RuleBasedProvider:
+            # Nothing to cache or batch for the static rules
+            return self.provider.analyze(request)
+
+        key = request.cache_key()
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached)
+
+        if deadlines.nearly_exhausted():
+            # No time to wait on the provider; leave what is left for the rest of the request
+            self.fallbacks += 1
+            return self.fallback.analyze(request)
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            self._enqueue(request, key)
+
+        try:
+            # shield: a caller timing out must not cancel the shared result for others
+            budget = deadlines.timeout(self.budget_ms / 1000, reserve=deadlines.DEADLINE_SKIP_MS / 1000)
+            result = await asyncio.wait_for(asyncio.shield(future), timeout=budget)
+            return dict(result)
+        except Exception as e:
+            self.fallbacks += 1
+            logger.warning(f"Analysis provider {self.provider.name} unavailable, using rules: {e!r}")
+            return self.fallback.analyze(request)
+
+    def _enqueue(self, request: AnalysisRequest, key: str):
+        self._queue.append((request, key))
+        if len(self._queue) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.batch_window_ms / 1000, self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._queue = self._queue, []
+        if batch:
+            self.batches += 1
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch: List[Tuple[AnalysisRequest, str]]):
+        # Shared by every request in the batch, so not bound by the one that started it
+        deadlines.clear()
+        try:
+            results = await self.provider.analyze_batch([request for request, _ in batch])
+        except Exception as e:
+            for _, key in batch:
+                future = self._inflight.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+                    # Retrieved here so an abandoned future does not log "exception never retrieved"
+                    future.exception()
+            return
+
+        for (_, key), result in zip(batch, results):
+            self.cache.put(key, result)
+            future = self._inflight.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider.name,
+            "cache_size": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "batches": self.batches,
+            "fallbacks": self.fallbacks,
+            "budget_ms": self.budget_ms
+        }
+
+    async def close(self):
+        await self.provider.close()
+
+def build_provider(name: str, url: Optional[str] = None, stub_latency_ms: float = 0.0) -> AnalysisProvider:
+    """Provider factory for the ANALYSIS_PROVIDER setting"""
+    if name == "stub":
+        return StubLLMProvider(latency_ms=stub_latency_ms)
+    if name == "http":
+        if not url:
+            raise ValueError("ANALYSIS_LLM_URL is required for the http analysis provider")
+        return HTTPLLMProvider(url)
+    if name == "rules":
+        return RuleBasedProvider()
+    raise ValueError(f"Unknown analysis provider: {name}")
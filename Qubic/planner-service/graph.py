@@ -0,0 +1,174 @@
+"""
+Graph
+Small declarative LangGraph-style runtime: nodes, edges, conditional routing and a shared state
+"""
+
+import time
+import asyncio
+import logging
+import tracing
+import metrics
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Set, Union
+
+logger = logging.getLogger(__name__)
+
+NODE_SECONDS = metrics.Histogram("qubic_graph_node_duration_seconds", "Graph node latency by node", ("node",))
+
+# A node reads the shared state and returns attribute updates to apply to it
+NodeFunc = Callable[[Any], Awaitable[Optional[Dict[str, Any]]]]
+# A router picks which conditional successor(s) to follow
+Router = Callable[[Any], Union[str, Iterable[str], None]]
+
+class Node:
+    def __init__(self, name: str, func: NodeFunc, memo_key: Optional[Callable[[Any], Hashable]] = None):
+        self.name = name
+        self.func = func
+        self.memo_key = memo_key
+        self.predecessors: Set[str] = set()
+        self.successors: Set[str] = set()
+        self.router: Optional[Router] = None
+        self.routed: Set[str] = set()
+
+class StateGraph:
+    """DAG of async nodes; a node runs once all its predecessors have finished,
+    so nodes with no path between them run concurrently"""
+
+    def __init__(self, memo_size: int = 1024):
+        self.nodes: Dict[str, Node] = {}
+        self.memo_size = memo_size
+        self._memo: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._order: Optional[List[str]] = None
+
+    def add_node(self, name: str, func: NodeFunc, memo_key: Optional[Callable[[Any], Hashable]] = None):
+        """Register a node; memo_key(state) enables output memoization for pure nodes"""
+        if name in self.nodes:
+            raise ValueError(f"Duplicate node: {name}")
+        self.nodes[name] = Node(name, func, memo_key)
+        self._order = None
+
+    def add_edge(self, source: str, target: str):
+        """target runs after source"""
+        self.nodes[source].successors.add(target)
+        self.nodes[target].predecessors.add(source)
+        self._order = None
+
+    def add_conditional_edges(self, source: str, router: Router, targets: Iterable[str]):
+        """After source, only the targets named by router(state) run; the rest are skipped"""
+        node = self.nodes[source]
+        node.router = router
+        for target in targets:
+            self.add_edge(source, target)
+            node.routed.add(target)
+
+    def compile(self) -> "StateGraph":
+        """Validate the graph is acyclic and fix a topological order"""
+        indegree = {name: len(node.predecessors) for name, node in self.nodes.items()}
+        ready = [name for name, degree in indegree.items() if degree == 0]
+        order = []
+        while ready:
+            name = ready.pop()
+            order.append(name)
+            for successor in self.nodes[name].successors:
+                indegree[successor] -= 1
+                if indegree[successor] == 0:
+                    ready.append(successor)
+        if len(order) != len(self.nodes):
+            raise ValueError("Graph contains a cycle")
+        self._order = order
+        return self
+
+    async def _run_node(self, node: Node, state: Any) -> Dict[str, Any]:
+        key = None
+        if node.memo_key is not None:
+            key = (node.name, node.memo_key(state))
+            cached = self._memo.get(key)
+            if cached is not None:
+                self._memo.move_to_end(key)
+                return cached
+
+        updates = await node.func(state) or {}
+
+        if key is not None:
+            self._memo[key] = updates
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return updates
+
+    async def run(self, state: Any) -> Any:
+        """Execute the graph against state, recording per-node timings in state.timings"""
+        if self._order is None:
+            self.compile()
+
+        timings = getattr(state, "timings", None)
+        done: Set[str] = set()
+        skipped: Set[str] = set()
+        running: Dict[asyncio.Task, str] = {}
+        pending = set(self.nodes)
+
+        def schedule():
+            for name in [n for n in self._order if n in pending]:
+                node = self.nodes[name]
+                if not node.predecessors <= (done | skipped):
+                    continue
+                pending.discard(name)
+                if node.predecessors and node.predecessors <= skipped:
+                    skipped.add(name)
+                    continue
+                task = asyncio.create_task(self._timed(node, state))
+                running[task] = name
+
+        schedule()
+        try:
+            while running:
+                finished, _ = await asyncio.wait(running.keys(), return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    name = running.pop(task)
+                    node = self.nodes[name]
+                    updates, elapsed_ms = task.result()
+                    for attr, value in updates.items():
+                        setattr(state, attr, value)
+                    if timings is not None:
+                        timings[name] = elapsed_ms
+                    done.add(name)
+
+                    if node.router is not None:
+                        chosen = node.router(state)
+                        if chosen is None:
+                            chosen = set()
+                        elif isinstance(chosen, str):
+                            chosen = {chosen}
+                        else:
+                            chosen = set(chosen)
+                        for target in node.routed - chosen:
+                            self._skip(target, skipped, pending)
+                # Finished and skipped nodes may unblock successors
+                schedule()
+        finally:
+            # A failed node aborts the run; do not leave siblings running
+            for task in running:
+                task.cancel()
+
+        return state
+
+    def _skip(self, name: str, skipped: Set[str], pending: Set[str]):
+        """Skip a routed-away node; its successors are skipped once all their inputs are"""
+        if name not in pending:
+            return
+        pending.discard(name)
+        skipped.add(name)
+        for successor in self.nodes[name].successors:
+            if self.nodes[successor].predecessors <= skipped:
+                self._skip(successor, skipped, pending)
+
+    async def _timed(self, node: Node, state: Any):
+        start = time.perf_counter()
+        try:
+            with tracing.span(f"graph.{node.name}"):
+                updates = await self._run_node(node, state)
+        except Exception:
+            logger.error(f"Graph node {node.name} failed")
+            raise
+        elapsed = time.perf_counter() - start
+        NODE_SECONDS.labels(node.name).observe(elapsed)
+        return updates, round(elapsed * 1000, 3)
@@ -4,6 +4,7 @@ LangGraph-based task planning service
 """
 
 import os
+import asyncio
 import logging
 import httpx
 from fastapi import FastAPI, HTTPException
@@ -13,6 +14,19 @@ import redis
 import json
 import uuid
 from datetime import datetime
+from policy_client import PolicyCache
+from rule_engine import RuleEngine, RuleError
+from velocity import build_limiter
+from graph import StateGraph
+from analysis import AnalysisCache, Analyzer, build_provider
+from plan_templates import PlanTemplate, PlanTemplateCache, bind_all, bind_constant, bind_fields
+import serve
+import tracing
+import metrics
+import profiling
+import deadlines
+import resilience
+import wire
 
 # Configure logging
 logging.basicConfig(
@@ -27,22 +41,65 @@ app = FastAPI(title="Planner Service", version="1.0.0")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 QUBIC_SERVICE_URL = os.getenv("QUBIC_SERVICE_URL", "http://localhost:8001")
 AGENT_RUNTIME_URL = os.getenv("AGENT_RUNTIME_URL", "http://localhost:8005")
+POLICY_CACHE_TTL = float(os.getenv("POLICY_CACHE_TTL", "30"))
+POLICY_VELOCITY_MODE = os.getenv("POLICY_VELOCITY_MODE", "redis")
+POLICY_VELOCITY_RETENTION_SECONDS = float(os.getenv("POLICY_VELOCITY_RETENTION_SECONDS", "86400"))  # longest velocity window a policy can use
+PLAN_TEMPLATE_CACHE_SIZE = int(os.getenv("PLAN_TEMPLATE_CACHE_SIZE", "256"))
+ANALYSIS_PROVIDER = os.getenv("ANALYSIS_PROVIDER", "rules")
+ANALYSIS_LLM_URL = os.getenv("ANALYSIS_LLM_URL")
+ANALYSIS_BUDGET_MS = float(os.getenv("ANALYSIS_BUDGET_MS", "2000"))
+ANALYSIS_BATCH_WINDOW_MS = float(os.getenv("ANALYSIS_BATCH_WINDOW_MS", "5"))
+ANALYSIS_BATCH_SIZE = int(os.getenv("ANALYSIS_BATCH_SIZE", "16"))
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "4096"))
+ANALYSIS_CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+ANALYSIS_STUB_LATENCY_MS = float(os.getenv("ANALYSIS_STUB_LATENCY_MS", "0"))
+RISK_APPROVAL_THRESHOLD = float(os.getenv("RISK_APPROVAL_THRESHOLD", "0.9"))  # risk score at which the main action waits for a human
 
 # Redis client
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+# Qubic policies and the plan templates compiled against them
+policy_cache = PolicyCache(QUBIC_SERVICE_URL, ttl=POLICY_CACHE_TTL)
+plan_template_cache = PlanTemplateCache(max_size=PLAN_TEMPLATE_CACHE_SIZE)
+
+# Cached policies' rules, compiled here so a plan's decision needs no Qubic round trip;
+# velocity rules read the windows the agent runtime records
+policy_engine = RuleEngine(
+    velocity=build_limiter(POLICY_VELOCITY_MODE, redis_client, window_seconds=POLICY_VELOCITY_RETENTION_SECONDS)
+)
+compiled_policy_versions: Dict[str, Optional[str]] = {}  # action_type -> etag of the rules compiled for it
+
+def on_policy_change(action_type: str, old_policy: Optional[Dict], new_policy: Optional[Dict]):
+    """Templates compiled against a superseded policy are stale"""
+    if old_policy:
+        removed = plan_template_cache.invalidate(old_policy.get("etag"))
+        logger.info(f"Policy {action_type} changed, invalidated {removed} plan templates")
+
+policy_cache.add_listener(on_policy_change)
+
+# Task analysis (LLM provider with cache, batching and rule-based fallback)
+analyzer = Analyzer(
+    build_provider(ANALYSIS_PROVIDER, url=ANALYSIS_LLM_URL, stub_latency_ms=ANALYSIS_STUB_LATENCY_MS),
+    AnalysisCache(max_size=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL),
+    budget_ms=ANALYSIS_BUDGET_MS,
+    batch_window_ms=ANALYSIS_BATCH_WINDOW_MS,
+    max_batch_size=ANALYSIS_BATCH_SIZE
+)
+
 # Request/Response models
 class PlanRequest(BaseModel):
     task_id: str
     task_type: str
     description: str
     parameters: Dict[str, Any]
+    user_id: Optional[str] = None
 
 class Step(BaseModel):
     step_id: str
     type: str
     requires_approval: bool = False
     parameters: Optional[Dict[str, Any]] = None
+    policy_decision: Optional[str] = None
 
 class PlanResponse(BaseModel):
     plan_id: str
@@ -52,140 +109,237 @@ class PlanResponse(BaseModel):
 
 # LangGraph-style state
 class PlanState:
-    def __init__(self, task_id: str, task_type: str, description: str, parameters: Dict):
+    def __init__(self, task_id: str, task_type: str, description: str, parameters: Dict,
+                 user_id: Optional[str] = None):
         self.task_id = task_id
         self.task_type = task_type
         self.description = description
         self.parameters = parameters
+        self.user_id = user_id
         self.analysis_result = None
         self.policy_result = None
+        self.risk_result = None
         self.steps = []
+        self.timings = {}
 
-# LangGraph nodes (simplified implementation)
-async def analyze_task(state: PlanState) -> PlanState:
+# LangGraph nodes: each returns the PlanState attributes it sets
+async def analyze_task(state: PlanState) -> Dict:
     """Analyze task and determine requirements"""
     logger.info(f"Analyzing task: {state.task_type}")
     
-    # Mock LLM analysis - in production, call actual LLM
-    if state.task_type == "monitor_wallet":
-        state.analysis_result = {
-            "action_type": "monitoring",
-            "risk_level": "medium",
-            "requires_approval": False
-        }
-    elif state.task_type == "transfer_funds":
-        state.analysis_result = {
-            "action_type": "transaction",
-            "risk_level": "high",
-            "requires_approval": True
-        }
-    else:
-        state.analysis_result = {
-            "action_type": "unknown",
-            "risk_level": "low",
-            "requires_approval": False
-        }
-    
-    return state
+    analysis_result = await analyzer.analyze(state.task_type, state.description, state.parameters)
+    return {"analysis_result": analysis_result}
+
+def evaluate_policy(action_type: str, policy_data: Dict, parameters: Dict, user_id: Optional[str]) -> Dict:
+    """Evaluate a request against the cached policy's rules, recompiling them only when the
+    policy's ETag changes"""
+    etag = policy_data.get("etag")
+    if action_type not in compiled_policy_versions or compiled_policy_versions[action_type] != etag:
+        policy_engine.update(action_type, policy_data.get("rules") or {})
+        compiled_policy_versions[action_type] = etag
+    return policy_engine.evaluate(action_type, parameters, user_id)
 
-async def policy_check(state: PlanState) -> PlanState:
-    """Check policy with Qubic service"""
+async def policy_check(state: PlanState) -> Dict:
+    """Check policy with Qubic service, and evaluate its rules against this request"""
     logger.info(f"Checking policy for task: {state.task_id}")
     
+    action_type = state.analysis_result.get("action_type", "unknown")
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.get(
-                f"{QUBIC_SERVICE_URL}/policy",
-                params={"action_type": state.analysis_result.get("action_type", "unknown")}
-            )
-            response.raise_for_status()
-            policy_data = response.json()
-            
-            state.policy_result = {
-                "allowed": policy_data.get("allowed", True),
-                "requires_approval": policy_data.get("requires_approval", False),
-                "policy_id": policy_data.get("policy_id")
-            }
-            
+        policy_data = await policy_cache.get(action_type)
     except httpx.HTTPError as e:
         logger.error(f"Policy check failed: {e}")
         # Default to allowing but requiring approval
-        state.policy_result = {
+        return {"policy_result": {
             "allowed": True,
             "requires_approval": True,
-            "policy_id": None
-        }
+            "policy_id": None,
+            "version": f"fallback:{action_type}"
+        }}
     
-    return state
+    policy_result = {
+        "allowed": policy_data.get("allowed", True),
+        "requires_approval": policy_data.get("requires_approval", False),
+        "policy_id": policy_data.get("policy_id"),
+        "version": policy_data.get("etag")
+    }
+    
+    # Without an evaluation the template's static approval flags stand
+    try:
+        # In a thread, since velocity rules read Redis
+        evaluation = await asyncio.to_thread(
+            evaluate_policy, action_type, policy_data, state.parameters, state.user_id
+        )
+    except (RuleError, TypeError, ValueError, redis.RedisError) as e:
+        logger.warning(f"Policy evaluation failed, using static approval flags: {e}")
+    else:
+        policy_result["decision"] = evaluation["decision"]
+        policy_result["matched"] = evaluation["matched"]
+    
+    return {"policy_result": policy_result}
 
-async def plan_builder(state: PlanState) -> PlanState:
-    """Build execution plan steps"""
-    logger.info(f"Building plan for task: {state.task_id}")
+RISK_LEVEL_SCORES = {"low": 0.2, "medium": 0.5, "high": 0.8}
+
+async def risk_scoring(state: PlanState) -> Dict:
+    """Score task risk from the analysis and request parameters"""
+    score = RISK_LEVEL_SCORES.get(state.analysis_result.get("risk_level"), 0.5)
+    factors = [f"risk_level:{state.analysis_result.get('risk_level')}"]
+    
+    try:
+        amount = float(state.parameters.get("amount", 0) or 0)
+    except (TypeError, ValueError):
+        amount = 0.0
+    if amount > 0:
+        # Larger transfers push the score up, saturating at 10k
+        score = min(1.0, score + min(amount, 10000.0) / 50000.0)
+        factors.append(f"amount:{amount}")
+    
+    return {"risk_result": {"score": round(score, 3), "factors": factors}}
+
+def risk_memo_key(state: PlanState):
+    """risk_scoring depends only on the risk level and the amount"""
+    return state.analysis_result.get("risk_level"), repr(state.parameters.get("amount"))
+
+def route_risk(state: PlanState) -> Optional[str]:
+    """Plans scoring at or above RISK_APPROVAL_THRESHOLD go through risk_review"""
+    return "risk_review" if state.risk_result["score"] >= RISK_APPROVAL_THRESHOLD else None
+
+async def risk_review(state: PlanState) -> Dict:
+    """Hold a high-risk plan's main action for a human, whatever the policy decided"""
+    logger.info(f"Task {state.task_id} scored {state.risk_result['score']}, its action requires approval")
+    return {"risk_result": {**state.risk_result, "requires_approval": True}}
+
+# The step that carries out the task, and the one policy rules decide approval for
+ACTION_STEP_ID = "3"
+# Steps that always go through the runtime's compliance agent, which auto-approves them only
+# within its amount and velocity limits; a policy can make them wait for a human, never skip it
+COMPLIANCE_STEP_TYPES = frozenset({"onchain_action"})
+
+def compile_plan_template(task_type: str, analysis: Dict, policy: Optional[Dict]) -> PlanTemplate:
+    """Compile the plan for a task type against a policy, leaving parameters unbound"""
+    requires_approval = policy.get("requires_approval", False) if policy else False
     
     steps = []
     
     # Step 1: Check balance
-    steps.append({
+    steps.append(({
         "step_id": "1",
         "type": "check_balance",
-        "requires_approval": False,
-        "parameters": {
-            "wallet_address": state.parameters.get("wallet_address")
-        }
-    })
+        "requires_approval": False
+    }, bind_fields("wallet_address")))
     
     # Step 2: Policy check
-    steps.append({
+    steps.append(({
         "step_id": "2",
         "type": "policy_check",
-        "requires_approval": False,
-        "parameters": {
-            "policy_id": state.policy_result.get("policy_id") if state.policy_result else None
-        }
-    })
+        "requires_approval": False
+    }, bind_constant({
+        "policy_id": policy.get("policy_id") if policy else None,
+        "action_type": analysis.get("action_type") if analysis else None
+    })))
     
     # Step 3: Main action (may require approval)
-    if state.task_type == "monitor_wallet":
-        steps.append({
-            "step_id": "3",
+    if task_type == "monitor_wallet":
+        steps.append(({
+            "step_id": ACTION_STEP_ID,
             "type": "monitor_action",
-            "requires_approval": state.policy_result.get("requires_approval", False) if state.policy_result else False,
-            "parameters": state.parameters
-        })
-    elif state.task_type == "transfer_funds":
-        steps.append({
-            "step_id": "3",
+            "requires_approval": requires_approval
+        }, bind_all))
+    elif task_type == "transfer_funds":
+        steps.append(({
+            "step_id": ACTION_STEP_ID,
             "type": "onchain_action",
-            "requires_approval": True,  # Always require approval for transfers
-            "parameters": state.parameters
-        })
+            "requires_approval": True
+        }, bind_all))
     else:
-        steps.append({
-            "step_id": "3",
+        steps.append(({
+            "step_id": ACTION_STEP_ID,
             "type": "generic_action",
-            "requires_approval": state.policy_result.get("requires_approval", False) if state.policy_result else False,
-            "parameters": state.parameters
-        })
+            "requires_approval": requires_approval
+        }, bind_all))
     
-    state.steps = steps
-    return state
+    return PlanTemplate(
+        task_type=task_type,
+        policy_version=policy.get("version", "none") if policy else "none",
+        analysis=analysis,
+        policy=policy,
+        steps=steps
+    )
 
-# Simplified LangGraph execution
-async def execute_plan_graph(task_id: str, task_type: str, description: str, parameters: Dict) -> Dict:
-    """Execute LangGraph-style planning graph"""
-    state = PlanState(task_id, task_type, description, parameters)
+async def plan_builder(state: PlanState) -> Dict:
+    """Build execution plan steps"""
+    logger.info(f"Building plan for task: {state.task_id}")
+    
+    version = state.policy_result.get("version", "none") if state.policy_result else "none"
+    template = plan_template_cache.get(state.task_type, version)
+    if template is None:
+        template = compile_plan_template(state.task_type, state.analysis_result, state.policy_result)
+        plan_template_cache.put(template)
     
-    # Execute nodes in sequence
-    state = await analyze_task(state)
-    state = await policy_check(state)
-    state = await plan_builder(state)
+    steps = template.bind(state.parameters)
+    decision = state.policy_result.get("decision") if state.policy_result else None
+    if decision == "deny":
+        raise HTTPException(status_code=403, detail=f"Denied by policy: {', '.join(state.policy_result['matched'])}")
+    if state.risk_result and state.risk_result.get("requires_approval"):
+        # Also stops the runtime from auto-approving a high-risk transfer
+        decision = "require_approval"
+    if decision is not None:
+        # The rules evaluated against this request's parameters decide for the main action
+        for step in steps:
+            if step["step_id"] != ACTION_STEP_ID:
+                continue
+            step["policy_decision"] = decision
+            if step["type"] not in COMPLIANCE_STEP_TYPES:
+                step["requires_approval"] = decision != "allow"
+    return {"steps": steps}
+
+# Planning graph: policy_check and risk_scoring both only need the analysis, so they run
+# concurrently; risk_review only runs for high-risk plans
+#
+#   analyze_task -> policy_check ----------------> plan_builder
+#               \-> risk_scoring -?-> risk_review -/
+plan_graph = StateGraph()
+plan_graph.add_node("analyze_task", analyze_task)
+plan_graph.add_node("policy_check", policy_check)
+plan_graph.add_node("risk_scoring", risk_scoring, memo_key=risk_memo_key)
+plan_graph.add_node("risk_review", risk_review)
+plan_graph.add_node("plan_builder", plan_builder)
+plan_graph.add_edge("analyze_task", "policy_check")
+plan_graph.add_edge("analyze_task", "risk_scoring")
+plan_graph.add_conditional_edges("risk_scoring", route_risk, ["risk_review"])
+plan_graph.add_edge("policy_check", "plan_builder")
+plan_graph.add_edge("risk_review", "plan_builder")
+plan_graph.compile()
+
+async def execute_plan_graph(task_id: str, task_type: str, description: str, parameters: Dict,
+                             user_id: Optional[str] = None) -> Dict:
+    """Execute LangGraph-style planning graph"""
+    state = PlanState(task_id, task_type, description, parameters, user_id)
+    state = await plan_graph.run(state)
     
     return {
         "steps": state.steps,
         "analysis": state.analysis_result,
-        "policy": state.policy_result
+        "policy": state.policy_result,
+        "risk": state.risk_result,
+        "timings": state.timings
     }
 
+@app.on_event("startup")
+async def startup_event():
+    """Warm the policy cache and subscribe to policy changes"""
+    try:
+        warmed = await policy_cache.warm()
+        logger.info(f"Warmed policy cache with {warmed} policies")
+    except httpx.HTTPError as e:
+        logger.warning(f"Policy cache warm-up failed: {e}")
+    policy_cache.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the policy change listener and analysis provider"""
+    await policy_cache.close()
+    await analyzer.close()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -206,7 +360,8 @@ async def create_plan(request: PlanRequest):
         request.task_id,
         request.task_type,
         request.description,
-        request.parameters
+        request.parameters,
+        request.user_id
     )
     
     # Generate plan ID
@@ -219,7 +374,9 @@ async def create_plan(request: PlanRequest):
         "steps": json.dumps(plan_result["steps"]),
         "created_at": datetime.utcnow().isoformat(),
         "analysis": json.dumps(plan_result["analysis"]),
-        "policy": json.dumps(plan_result["policy"])
+        "policy": json.dumps(plan_result["policy"]),
+        "risk": json.dumps(plan_result["risk"]),
+        "timings": json.dumps(plan_result["timings"])
     }
     redis_client.hset(f"plan:{plan_id}", mapping=plan_data)
     
@@ -233,6 +390,27 @@ async def create_plan(request: PlanRequest):
         created_at=plan_data["created_at"]
     )
 
+@app.get("/plan/templates")
+async def get_plan_templates():
+    """Plan template and policy cache statistics"""
+    stats = plan_template_cache.stats()
+    stats["policy_cache"] = policy_cache.stats()
+    stats["policy_engine"] = policy_engine.stats()
+    return stats
+
+@app.post("/plan/templates/invalidate")
+async def invalidate_plan_templates(policy_version: Optional[str] = None):
+    """Drop compiled plan templates (all, or those for one policy version)"""
+    removed = plan_template_cache.invalidate(policy_version)
+    if policy_version is None:
+        policy_cache.invalidate()
+    return {"invalidated": removed}
+
+@app.get("/analysis/stats")
+async def get_analysis_stats():
+    """Task analysis provider, cache and batching statistics"""
+    return analyzer.stats()
+
 @app.get("/plan/{plan_id}")
 async def get_plan(plan_id: str):
     """Get plan details"""
@@ -249,11 +427,20 @@ async def get_plan(plan_id: str):
         "steps": steps,
         "created_at": plan_data.get("created_at"),
         "analysis": json.loads(plan_data.get("analysis", "{}")),
-        "policy": json.loads(plan_data.get("policy", "{}"))
+        "policy": json.loads(plan_data.get("policy", "{}")),
+        "risk": json.loads(plan_data.get("risk", "{}")),
+        "timings": json.loads(plan_data.get("timings", "{}"))
     }
 
+serve.install(app, "planner-service")
+tracing.install(app, "planner-service")
+metrics.install(app, "planner-service")
+profiling.install(app, "planner-service")
+deadlines.install(app, "planner-service")
+resilience.install(app)
+wire.install(app)
+
 if __name__ == "__main__":
-    import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    serve.run(app, port=port)
 
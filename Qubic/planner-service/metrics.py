@@ -0,0 +1,495 @@
+"""
+Metrics
+Prometheus metrics for every service: request, client and queue metrics merged across worker processes
+"""
+
+import os
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import serve
+import tracing
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latencies are counted in serve's fine buckets (0.1ms, each 25% above the last) and exposed
+# at every 4th bound, 0.1ms to ~27s, so request histograms come straight from serve's stats
+EXPOSED_BUCKETS = list(range(0, len(serve.LATENCY_BUCKETS), 4))
+BUCKET_COUNT = len(serve.LATENCY_BUCKETS) + 1
+
+# Set by profiling's slow-request capture: histogram observations made while serving a request
+# are also added to that request's timing breakdown, as name -> [count, seconds]
+breakdown: ContextVar[Optional[Dict[str, list]]] = ContextVar("metrics_breakdown", default=None)
+
+# Metric types
+
+class Value:
+    """Counter or gauge value of one label set"""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def reset(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+class HistogramValue:
+    """Latency histogram of one label set"""
+
+    __slots__ = ("key", "buckets", "sum", "_lock")
+
+    def __init__(self, key: str = ""):
+        self.key = key
+        self.buckets = [0] * BUCKET_COUNT
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = bisect.bisect_left(serve.LATENCY_BUCKETS, seconds * 1000)
+        with self._lock:
+            self.buckets[index] += 1
+            self.sum += seconds
+        request = breakdown.get()
+        if request is not None:
+            entry = request.get(self.key)
+            if entry is None:
+                request[self.key] = [1, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+
+    def time(self) -> "Timer":
+        return Timer(self)
+
+    def reset(self):
+        self.buckets = [0] * BUCKET_COUNT
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+class Timer:
+    """Context manager observing the time spent in its block"""
+
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram: HistogramValue):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Metric:
+    """A named metric with fixed label names.
+
+    Hot paths should keep the child returned by labels() (or look it up with a tuple of
+    label values), which is cached, rather than building label mappings per call.
+
+    function, if given, is called for the value instead of recording one: in every worker
+    when it writes its stats (per-process values, summed across workers), or only in the
+    worker serving the scrape when shared is true (values that every worker would read the
+    same, such as a Redis key's length)."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 function: Optional[Callable[[], float]] = None, shared: bool = False,
+                 registry: Optional["Registry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.shared = shared
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames and function is None:
+            # Exposed as 0 from the start rather than appearing on first use
+            self.labels()
+        (registry or REGISTRY).register(self)
+
+    def _new(self, values: Tuple[str, ...]):
+        return Value()
+
+    def labels(self, *values: str):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new(values))
+        return child
+
+    def reset(self):
+        # In place, so children held by callers keep counting
+        for child in self._children.values():
+            child.reset()
+        self._lock = threading.Lock()
+
+    def entries(self) -> List[list]:
+        """[label values, value] per label set of this process"""
+        if self.function is not None:
+            return [[[], self.function()]]
+        return [[list(labels), child.value] for labels, child in list(self._children.items())]
+
+    # Unlabelled shortcuts
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+class Counter(Metric):
+    kind = "counter"
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    @contextmanager
+    def track_inprogress(self, *labels: str):
+        """Count the block as in progress while it runs"""
+        child = self.labels(*labels)
+        child.inc()
+        try:
+            yield
+        finally:
+            child.dec()
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def _new(self, values: Tuple[str, ...]):
+        # Breakdown name: "redis_command GET" for qubic_redis_command_duration_seconds{command="GET"}
+        short = self.name.replace("qubic_", "", 1).replace("_duration_seconds", "")
+        return HistogramValue(" ".join((short,) + values))
+
+    def entries(self) -> List[list]:
+        return [[list(labels), list(child.buckets), child.sum] for labels, child in list(self._children.items())]
+
+    def observe(self, seconds: float):
+        self.labels().observe(seconds)
+
+    def time(self) -> Timer:
+        return self.labels().time()
+
+# Registry
+
+def _merge(kind: str, into: Dict[tuple, Any], entries: List[list]):
+    for entry in entries:
+        labels = tuple(entry[0])
+        if kind == "histogram":
+            merged = into.get(labels)
+            if merged is None:
+                into[labels] = [list(entry[1]), entry[2]]
+            else:
+                merged[0] = [a + b for a, b in zip(merged[0], entry[1])]
+                merged[1] += entry[2]
+        else:
+            into[labels] = into.get(labels, 0.0) + entry[1]
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _histogram_lines(name: str, labels: str, buckets: List[int], total_seconds: float) -> List[str]:
+    lines = []
+    prefix = f"{labels}," if labels else ""
+    cumulative = 0
+    position = 0
+    for index in EXPOSED_BUCKETS:
+        cumulative += sum(buckets[position:index + 1])
+        position = index + 1
+        lines.append(f'{name}_bucket{{{prefix}le="{serve.LATENCY_BUCKETS[index] / 1000:.6g}"}} {cumulative}')
+    count = sum(buckets)
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {_number(round(total_seconds, 6))}")
+    lines.append(f"{name}_count{suffix} {count}")
+    return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric):
+        if any(existing.name == metric.name for existing in self.metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics.append(metric)
+
+    def reset(self):
+        """Start counting afresh in a newly forked worker"""
+        for metric in self.metrics:
+            metric.reset()
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        """Per-process values, written with this worker's stats"""
+        values = {}
+        for metric in self.metrics:
+            if metric.shared:
+                continue
+            try:
+                values[metric.name] = metric.entries()
+            except Exception as e:
+                logger.warning(f"Metric {metric.name} unavailable: {e}")
+        return values
+
+    def fold(self, retired: Optional[Dict[str, List[list]]], snapshot: Dict[str, List[list]]) -> Dict[str, List[list]]:
+        """Add an exited worker's counters and histograms to the retired totals; its gauges
+        no longer mean anything"""
+        totals = {}
+        for metric in self.metrics:
+            if metric.kind not in ("counter", "histogram"):
+                continue
+            merged: Dict[tuple, Any] = {}
+            _merge(metric.kind, merged, (retired or {}).get(metric.name, []))
+            _merge(metric.kind, merged, snapshot.get(metric.name, []))
+            if merged:
+                totals[metric.name] = [[list(labels), *value] if metric.kind == "histogram" else [list(labels), value]
+                                       for labels, value in merged.items()]
+        return totals
+
+    def collect(self, snapshots: List[Dict[str, List[list]]]) -> Dict[str, Dict[tuple, Any]]:
+        """Values of every metric summed across worker snapshots, with shared metrics read now"""
+        merged: Dict[str, Dict[tuple, Any]] = {}
+        for metric in self.metrics:
+            values: Dict[tuple, Any] = {}
+            if metric.shared:
+                try:
+                    values[()] = metric.function()
+                except Exception as e:
+                    logger.warning(f"Metric {metric.name} unavailable: {e}")
+            else:
+                for snapshot in snapshots:
+                    _merge(metric.kind, values, snapshot.get(metric.name, []))
+            merged[metric.name] = values
+        return merged
+
+    def expose(self, service: str, merged: Dict[str, Dict[tuple, Any]]) -> List[str]:
+        lines = []
+        for metric in self.metrics:
+            values = merged.get(metric.name)
+            if not values:
+                continue
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            names = ("service",) + metric.labelnames
+            for labels, value in sorted(values.items()):
+                label_text = _labels(names, (service,) + labels)
+                if metric.kind == "histogram":
+                    lines.extend(_histogram_lines(metric.name, label_text, value[0], value[1]))
+                else:
+                    lines.append(f"{metric.name}{{{label_text}}} {_number(value)}")
+        return lines
+
+REGISTRY = Registry()
+os.register_at_fork(after_in_child=REGISTRY.reset)
+
+# Client metrics
+
+HTTP_CLIENT_SECONDS = Histogram(
+    "qubic_http_client_request_duration_seconds", "Outgoing HTTP request latency by target",
+    ("method", "target")
+)
+REDIS_COMMAND_SECONDS = Histogram(
+    "qubic_redis_command_duration_seconds", "Redis command latency (pipelines as PIPELINE)", ("command",)
+)
+DB_QUERY_SECONDS = Histogram(
+    "qubic_db_query_duration_seconds", "SQL statement latency by operation", ("operation",)
+)
+TRACE_QUEUE_DEPTH = Gauge(
+    "qubic_trace_queue_depth", "Finished spans waiting for export",
+    function=lambda: tracing.tracer.stats()["queued"]
+)
+TRACE_SPANS_DROPPED = Counter(
+    "qubic_trace_spans_dropped_total", "Spans dropped because the export queue was full",
+    function=lambda: tracing.tracer.dropped
+)
+
+def instrument_httpx():
+    """Time every httpx request"""
+    import httpx
+    if getattr(httpx.AsyncClient.send, "_timed", False):
+        return
+    async_send = httpx.AsyncClient.send
+    sync_send = httpx.Client.send
+
+    async def timed_async_send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await async_send(self, request, **kwargs)
+        finally:
+            HTTP_CLIENT_SECONDS.labels(request.method, request.url.netloc.decode("ascii")).observe(
+                time.perf_counter() - start
+            )
+
+    def timed_sync_send(self, request, **kwargs):
+        start = time.perf_counter()
+        try:
+            return sync_send(self, request, **kwargs)
+        finally:
+            HTTP_CLIENT_SECONDS.labels(request.method, request.url.netloc.decode("ascii")).observe(
+                time.perf_counter() - start
+            )
+
+    timed_async_send._timed = True
+    httpx.AsyncClient.send = timed_async_send
+    httpx.Client.send = timed_sync_send
+
+def instrument_redis():
+    """Time every Redis command and pipeline"""
+    import redis
+    import redis.asyncio
+    if getattr(redis.Redis.execute_command, "_timed", False):
+        return
+    sync_command = redis.Redis.execute_command
+    sync_pipeline = redis.client.Pipeline.execute
+    async_command = redis.asyncio.Redis.execute_command
+    async_pipeline = redis.asyncio.client.Pipeline.execute
+    pipeline_seconds = REDIS_COMMAND_SECONDS.labels("PIPELINE")
+
+    def timed_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return sync_command(self, *args, **options)
+        finally:
+            REDIS_COMMAND_SECONDS.labels(args[0] if args else "?").observe(time.perf_counter() - start)
+
+    def timed_pipeline(self, *args, **kwargs):
+        with pipeline_seconds.time():
+            return sync_pipeline(self, *args, **kwargs)
+
+    async def timed_async_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return await async_command(self, *args, **options)
+        finally:
+            REDIS_COMMAND_SECONDS.labels(args[0] if args else "?").observe(time.perf_counter() - start)
+
+    async def timed_async_pipeline(self, *args, **kwargs):
+        with pipeline_seconds.time():
+            return await async_pipeline(self, *args, **kwargs)
+
+    timed_command._timed = True
+    redis.Redis.execute_command = timed_command
+    redis.client.Pipeline.execute = timed_pipeline
+    redis.asyncio.Redis.execute_command = timed_async_command
+    redis.asyncio.client.Pipeline.execute = timed_async_pipeline
+
+def instrument_sqlalchemy(engine):
+    """Time every SQL statement run on an engine"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("qubic_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("qubic_query_start")
+        if starts:
+            operation = statement.split(None, 1)[0].upper() if statement else "?"
+            DB_QUERY_SECONDS.labels(operation).observe(time.perf_counter() - starts.pop())
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):
+        starts = context.connection.info.get("qubic_query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+# Exposition
+
+def _server_lines(service: str, workers: List[Dict[str, Any]], retired: Dict[str, Any]) -> List[str]:
+    """Request metrics from serve's per-worker stats"""
+    routes: Dict[str, List[Any]] = {}
+    errors = retired.get("errors", 0)
+    for source in workers + [retired]:
+        for route, route_stats in source.get("routes", {}).items():
+            merged = routes.setdefault(route, [[0] * BUCKET_COUNT, 0.0])
+            merged[0] = [a + b for a, b in zip(merged[0], route_stats["buckets"])]
+            merged[1] += route_stats["total_ms"] / 1000
+    for worker in workers:
+        errors += worker["errors"]
+    in_flight = sum(worker["in_flight"] for worker in workers)
+    service_label = _labels(("service",), (service,))
+
+    lines = [
+        "# HELP qubic_http_request_duration_seconds Request latency by route",
+        "# TYPE qubic_http_request_duration_seconds histogram"
+    ]
+    for route, (buckets, total_seconds) in sorted(routes.items()):
+        method, _, path = route.partition(" ")
+        if not path:
+            method, path = "", route
+        lines.extend(_histogram_lines(
+            "qubic_http_request_duration_seconds",
+            _labels(("service", "method", "route"), (service, method, path)),
+            buckets, total_seconds
+        ))
+    lines += [
+        "# HELP qubic_http_requests_in_flight Requests being served",
+        "# TYPE qubic_http_requests_in_flight gauge",
+        f"qubic_http_requests_in_flight{{{service_label}}} {in_flight}",
+        "# HELP qubic_http_server_errors_total Responses with a 5xx status",
+        "# TYPE qubic_http_server_errors_total counter",
+        f"qubic_http_server_errors_total{{{service_label}}} {errors}",
+        "# HELP qubic_workers Live worker processes",
+        "# TYPE qubic_workers gauge",
+        f"qubic_workers{{{service_label}}} {len(workers)}"
+    ]
+    return lines
+
+def render(service: str) -> str:
+    """Prometheus text exposition for every worker of this service"""
+    workers = serve.stats.collect()
+    retired = serve.stats.retired()
+    snapshots = [worker.get("metrics", {}) for worker in workers] + [retired.get("metrics", {})]
+    lines = _server_lines(service, workers, retired)
+    lines += REGISTRY.expose(service, REGISTRY.collect(snapshots))
+    return "\n".join(lines) + "\n"
+
+def install(app, service: str):
+    """Add GET /metrics to an app and time the httpx and Redis calls made while serving it"""
+    from fastapi.responses import Response
+
+    serve.stats.sections["metrics"] = REGISTRY.snapshot
+    serve.stats.mergers["metrics"] = REGISTRY.fold
+    instrument_httpx()
+    instrument_redis()
+
+    def metrics():
+        """Prometheus metrics, merged across this service's workers"""
+        return Response(render(service), media_type=CONTENT_TYPE)
+
+    app.add_api_route("/metrics", metrics, methods=["GET"])
@@ -0,0 +1,95 @@
+"""
+Plan Templates
+Compiled plan templates cached per (task_type, policy version)
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Binds request parameters into a step's parameters
+ParamBinder = Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+def bind_constant(value: Optional[Dict[str, Any]]) -> ParamBinder:
+    """Binder returning fixed parameters resolved at compile time"""
+    return lambda parameters: dict(value) if value is not None else None
+
+def bind_fields(*fields: str) -> ParamBinder:
+    """Binder picking named fields out of the request parameters"""
+    return lambda parameters: {field: parameters.get(field) for field in fields}
+
+def bind_all(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """Binder passing the request parameters through unchanged"""
+    return parameters
+
+class PlanTemplate:
+    """A precompiled plan: static step skeletons plus per-step parameter binders"""
+
+    def __init__(self, task_type: str, policy_version: str, analysis: Dict, policy: Dict,
+                 steps: List[Tuple[Dict[str, Any], ParamBinder]]):
+        self.task_type = task_type
+        self.policy_version = policy_version
+        self.analysis = analysis
+        self.policy = policy
+        self.steps = steps
+
+    def bind(self, parameters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Produce concrete plan steps for one request"""
+        return [
+            {**skeleton, "parameters": binder(parameters)}
+            for skeleton, binder in self.steps
+        ]
+
+class PlanTemplateCache:
+    """Bounded LRU of compiled plan templates keyed by (task_type, policy version)"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._templates: "OrderedDict[Tuple[str, str], PlanTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, task_type: str, policy_version: str) -> Optional[PlanTemplate]:
+        key = (task_type, policy_version)
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                self.misses += 1
+                return None
+            self._templates.move_to_end(key)
+            self.hits += 1
+            return template
+
+    def put(self, template: PlanTemplate):
+        key = (template.task_type, template.policy_version)
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.max_size:
+                self._templates.popitem(last=False)
+
+    def invalidate(self, policy_version: Optional[str] = None) -> int:
+        """Drop templates compiled against policy_version, or all templates"""
+        with self._lock:
+            if policy_version is None:
+                removed = len(self._templates)
+                self._templates.clear()
+                return removed
+            stale = [key for key in self._templates if key[1] == policy_version]
+            for key in stale:
+                del self._templates[key]
+            return len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._templates),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "templates": [
+                    {"task_type": task_type, "policy_version": version}
+                    for task_type, version in self._templates
+                ]
+            }
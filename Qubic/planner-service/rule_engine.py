@@ -0,0 +1,323 @@
+"""
+Rule Engine
+Compiles policy rules (amount thresholds, wallet lists, time windows, velocity, expressions) into predicates
+"""
+
+import ast
+import math
+import operator
+from datetime import datetime, time as dtime
+from typing import Any, Callable, Dict, List, Optional
+from velocity import LocalVelocityLimiter, VelocityLimiter, velocity_subjects
+
+Predicate = Callable[[Dict[str, Any]], Any]
+
+ALLOW = "allow"
+REQUIRE_APPROVAL = "require_approval"
+DENY = "deny"
+EFFECTS = (REQUIRE_APPROVAL, DENY)
+
+class RuleError(ValueError):
+    """A policy rule that cannot be compiled"""
+
+# Expression compiler: a restricted Python expression syntax compiled once into closures
+
+_COMPARE_OPS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b
+}
+
+_BINARY_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod
+}
+
+_FUNCTIONS = {
+    "abs": abs,
+    "len": len,
+    "min": min,
+    "max": max,
+    "lower": lambda value: str(value).lower()
+}
+
+def compile_expression(source: str) -> Predicate:
+    """Compile an expression such as `amount > 500 and currency == "USD"` into a function of
+    the evaluation context. Unknown names evaluate to None; a comparison against None is False."""
+    try:
+        tree = ast.parse(source, mode="eval")
+    except SyntaxError as e:
+        raise RuleError(f"Invalid expression {source!r}: {e.msg}")
+    return _compile_node(tree.body, source)
+
+def _compile_node(node: ast.AST, source: str) -> Predicate:
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda ctx: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        return lambda ctx: ctx.get(name)
+
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        items = [_compile_node(item, source) for item in node.elts]
+        if all(isinstance(item, ast.Constant) for item in node.elts):
+            # Constant collections are built once, as a set for O(1) membership
+            constant = frozenset(item.value for item in node.elts)
+            return lambda ctx: constant
+        return lambda ctx: [item(ctx) for item in items]
+
+    if isinstance(node, ast.BoolOp):
+        operands = [_compile_node(value, source) for value in node.values]
+        if isinstance(node.op, ast.And):
+            return lambda ctx: all(operand(ctx) for operand in operands)
+        return lambda ctx: any(operand(ctx) for operand in operands)
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand, source)
+        if isinstance(node.op, ast.Not):
+            return lambda ctx: not operand(ctx)
+        if isinstance(node.op, ast.USub):
+            return lambda ctx: -operand(ctx)
+
+    if isinstance(node, ast.Compare):
+        left = _compile_node(node.left, source)
+        comparisons = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in _COMPARE_OPS:
+                break
+            comparisons.append((_COMPARE_OPS[type(op)], _compile_node(comparator, source)))
+        else:
+            def compare(ctx):
+                current = left(ctx)
+                for func, right in comparisons:
+                    other = right(ctx)
+                    if current is None or other is None:
+                        return False
+                    try:
+                        if not func(current, other):
+                            return False
+                    except TypeError:
+                        return False
+                    current = other
+                return True
+            return compare
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        func = _BINARY_OPS[type(node.op)]
+        left = _compile_node(node.left, source)
+        right = _compile_node(node.right, source)
+        return lambda ctx: func(left(ctx), right(ctx))
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS and not node.keywords:
+        func = _FUNCTIONS[node.func.id]
+        args = [_compile_node(arg, source) for arg in node.args]
+        return lambda ctx: func(*(arg(ctx) for arg in args))
+
+    raise RuleError(f"Unsupported syntax {type(node).__name__} in expression {source!r}")
+
+# Policy compilation
+
+def _to_float(value: Any) -> Optional[float]:
+    """A finite number, else None; amount rules treat None as failing their check"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) else None
+
+def _parse_time(value: str) -> dtime:
+    try:
+        hour, minute = value.split(":")
+        return dtime(int(hour), int(minute))
+    except (AttributeError, ValueError):
+        raise RuleError(f"Invalid time {value!r}, expected HH:MM")
+
+class CompiledRule:
+    def __init__(self, rule_id: str, effect: str, predicate: Predicate):
+        if effect not in EFFECTS:
+            raise RuleError(f"Rule {rule_id}: effect must be one of {', '.join(EFFECTS)}")
+        self.rule_id = rule_id
+        self.effect = effect
+        self.predicate = predicate
+
+class CompiledPolicy:
+    """A policy's rules compiled to predicates over the evaluation context"""
+
+    def __init__(self, action_type: str, rules: Dict[str, Any]):
+        self.action_type = action_type
+        self.allowed = rules.get("allowed", True)
+        self.requires_approval = rules.get("requires_approval", True)
+        self.risk_level = rules.get("risk_level", "medium")
+        self.velocity_window: Optional[float] = None
+        self.rules: List[CompiledRule] = []
+        self._compile(rules)
+        # Deny rules are checked first so a denial is never masked by an approval rule
+        self.rules.sort(key=lambda rule: rule.effect != DENY)
+
+    def _compile(self, rules: Dict[str, Any]):
+        max_amount = rules.get("max_amount")
+        if max_amount is not None:
+            limit = float(max_amount)
+            # A missing, unparseable or non-finite amount cannot be shown to be under the limit
+            self.rules.append(CompiledRule(
+                "max_amount", REQUIRE_APPROVAL,
+                lambda ctx: ctx["amount"] is None or ctx["amount"] > limit
+            ))
+
+        deny_wallets = rules.get("deny_wallets")
+        if deny_wallets:
+            denied = frozenset(wallet.lower() for wallet in deny_wallets)
+            self.rules.append(CompiledRule("deny_wallets", DENY, lambda ctx: ctx["wallet"] in denied))
+
+        allow_wallets = rules.get("allow_wallets")
+        if allow_wallets:
+            allowed = frozenset(wallet.lower() for wallet in allow_wallets)
+            self.rules.append(CompiledRule(
+                "allow_wallets", REQUIRE_APPROVAL,
+                lambda ctx: ctx["wallet"] is not None and ctx["wallet"] not in allowed
+            ))
+
+        window = rules.get("time_window")
+        if window:
+            start = _parse_time(window.get("start", "00:00"))
+            end = _parse_time(window.get("end", "23:59"))
+            days = frozenset(window.get("days", range(7)))
+            if start <= end:
+                inside = lambda t: start <= t <= end
+            else:
+                # Window wrapping midnight, e.g. 22:00-06:00
+                inside = lambda t: t >= start or t <= end
+            self.rules.append(CompiledRule(
+                "time_window", window.get("effect", REQUIRE_APPROVAL),
+                lambda ctx: ctx["weekday"] not in days or not inside(ctx["time"])
+            ))
+
+        velocity = rules.get("velocity")
+        if velocity:
+            self.velocity_window = float(velocity.get("window_seconds", 3600))
+            max_count = velocity.get("max_count")
+            max_total = velocity.get("max_amount")
+            if max_count is None and max_total is None:
+                raise RuleError("velocity needs max_count and/or max_amount")
+            def exceeded(ctx):
+                # The request being evaluated counts toward the window
+                if max_count is not None and ctx["velocity_count"] + 1 > max_count:
+                    return True
+                if max_total is not None and (ctx["amount"] is None or
+                                              ctx["velocity_amount"] + ctx["amount"] > float(max_total)):
+                    return True
+                return False
+            self.rules.append(CompiledRule("velocity", velocity.get("effect", REQUIRE_APPROVAL), exceeded))
+
+        for index, condition in enumerate(rules.get("conditions", [])):
+            if "when" not in condition:
+                raise RuleError(f"Condition {index} has no 'when' expression")
+            self.rules.append(CompiledRule(
+                condition.get("id", f"condition_{index}"),
+                condition.get("effect", REQUIRE_APPROVAL),
+                compile_expression(condition["when"])
+            ))
+
+    def evaluate(self, ctx: Dict[str, Any]) -> Dict[str, Any]:
+        """Decision for one context: deny, require_approval or allow, with the rules that fired.
+        With no rule firing, a policy that has risk checks allows without approval; a policy
+        without checks falls back to its static requires_approval flag."""
+        if not self.allowed:
+            return {"decision": DENY, "matched": ["allowed"]}
+        if ctx.get("amount") is not None and ctx["amount"] < 0:
+            return {"decision": DENY, "matched": ["negative_amount"]}
+
+        matched = []
+        decision = None
+        for rule in self.rules:
+            try:
+                fired = rule.predicate(ctx)
+            except Exception:
+                # A rule that cannot be evaluated on this input must not silently pass
+                fired = True
+            if fired:
+                matched.append(rule.rule_id)
+                if rule.effect == DENY:
+                    return {"decision": DENY, "matched": matched}
+                decision = REQUIRE_APPROVAL
+        if decision is None:
+            decision = REQUIRE_APPROVAL if self.requires_approval and not self.rules else ALLOW
+        return {"decision": decision, "matched": matched}
+
+class RuleEngine:
+    """Compiled policy set with atomic hot reload"""
+
+    def __init__(self, velocity: Optional[VelocityLimiter] = None, default_action_type: str = "unknown"):
+        self.velocity = velocity or LocalVelocityLimiter(window_seconds=86400.0)
+        self.default_action_type = default_action_type
+        self._policies: Dict[str, CompiledPolicy] = {}
+        self.evaluations = 0
+        self.reloads = 0
+
+    def load(self, rule_set: Dict[str, Dict[str, Any]]):
+        """Compile a whole rule set and swap it in; on any RuleError the current set is kept"""
+        compiled = {action_type: CompiledPolicy(action_type, rules) for action_type, rules in rule_set.items()}
+        self._policies = compiled
+        self.reloads += 1
+
+    def update(self, action_type: str, rules: Dict[str, Any]):
+        """Compile and swap in a single policy"""
+        compiled = CompiledPolicy(action_type, rules)
+        self._policies = {**self._policies, action_type: compiled}
+
+    def _context(self, policy: CompiledPolicy, parameters: Dict[str, Any], user_id: Optional[str],
+                 now: datetime) -> Dict[str, Any]:
+        wallet = parameters.get("to_address") or parameters.get("wallet_address")
+        ctx = dict(parameters)
+        ctx.update({
+            "amount": _to_float(parameters.get("amount")),
+            "wallet": wallet.lower() if isinstance(wallet, str) else None,
+            "user_id": user_id,
+            "hour": now.hour,
+            "weekday": now.weekday(),
+            "time": now.time(),
+            "velocity_count": 0,
+            "velocity_amount": 0.0
+        })
+        if policy.velocity_window is not None and user_id:
+            ctx["velocity_count"], ctx["velocity_amount"] = self.velocity.usage(
+                velocity_subjects(user_id, None)[0], policy.velocity_window, now.timestamp()
+            )
+        return ctx
+
+    def evaluate(self, action_type: str, parameters: Dict[str, Any], user_id: Optional[str] = None,
+                 now: Optional[datetime] = None, record: bool = False) -> Dict[str, Any]:
+        """Evaluate parameters against the policy for action_type. With record=True a
+        non-denied request counts toward the user's velocity window."""
+        policies = self._policies
+        policy = policies.get(action_type) or policies[self.default_action_type]
+        now = now or datetime.utcnow()
+        ctx = self._context(policy, parameters or {}, user_id, now)
+        result = policy.evaluate(ctx)
+        self.evaluations += 1
+        if record and user_id and result["decision"] != DENY:
+            self.velocity.record(velocity_subjects(user_id, None), ctx["amount"] or 0.0, now.timestamp())
+        return {
+            "action_type": action_type,
+            "allowed": result["decision"] != DENY,
+            "requires_approval": result["decision"] == REQUIRE_APPROVAL,
+            "risk_level": policy.risk_level,
+            **result
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policies": len(self._policies),
+            "rules": sum(len(policy.rules) for policy in self._policies.values()),
+            "evaluations": self.evaluations,
+            "reloads": self.reloads
+        }
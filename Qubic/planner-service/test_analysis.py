@@ -0,0 +1,100 @@
+"""
+Analysis tests
+Intent cache keys, shared in-flight requests, batching and the rule-based fallback
+"""
+
+import asyncio
+import time
+import pytest
+from analysis import AnalysisCache, AnalysisRequest, Analyzer, StubLLMProvider, build_provider
+
+def key(task_type, description, parameters):
+    return AnalysisRequest(task_type, description, parameters).cache_key()
+
+def test_key_ignores_amounts_addresses_and_whitespace():
+    assert key("transfer_funds", "Send 25 ETH to 0xAB12", {"amount": 25, "to_address": "0xab12"}) == \
+        key("Transfer_Funds ", "send  40.5 eth to 0xcd34", {"to_address": "0xcd34", "amount": 40.5})
+
+def test_key_keeps_task_type_wording_and_parameter_names():
+    base = key("transfer_funds", "Send 25 ETH", {"amount": 25})
+    assert base != key("monitor_wallet", "Send 25 ETH", {"amount": 25})
+    assert base != key("transfer_funds", "Withdraw 25 ETH", {"amount": 25})
+    assert base != key("transfer_funds", "Send 25 ETH", {"amount": 25, "memo": "rent"})
+
+class CountingProvider(StubLLMProvider):
+    def __init__(self, latency_ms=0.0, fail=False):
+        super().__init__(latency_ms)
+        self.fail = fail
+        self.batches = []
+
+    async def analyze_batch(self, requests):
+        self.batches.append(len(requests))
+        if self.fail:
+            raise RuntimeError("provider down")
+        return await super().analyze_batch(requests)
+
+def analyzer(provider, **options):
+    return Analyzer(provider, AnalysisCache(max_size=8, ttl=60), **options)
+
+def test_concurrent_requests_share_one_provider_call_and_then_the_cache():
+    provider = CountingProvider(latency_ms=10)
+    service = analyzer(provider, batch_window_ms=5)
+
+    async def run():
+        results = await asyncio.gather(*(
+            service.analyze("transfer_funds", f"Send {amount} ETH", {"amount": amount}) for amount in (1, 2, 3)
+        ))
+        cached = await service.analyze("transfer_funds", "Send 4 ETH", {"amount": 4})
+        return results, cached
+
+    results, cached = asyncio.run(run())
+    assert provider.batches == [1]
+    assert all(result["action_type"] == "transaction" for result in results + [cached])
+    assert (service.cache.hits, service.cache.misses) == (1, 3)
+
+def test_distinct_requests_are_batched_up_to_the_batch_size():
+    provider = CountingProvider()
+    service = analyzer(provider, batch_window_ms=50, max_batch_size=2)
+
+    async def run():
+        return await asyncio.gather(
+            service.analyze("transfer_funds", "Send funds", {}),
+            service.analyze("monitor_wallet", "Watch wallet", {}),
+            service.analyze("other", "Something else", {})
+        )
+
+    results = asyncio.run(run())
+    assert provider.batches == [2, 1]
+    assert [result["action_type"] for result in results] == ["transaction", "monitoring", "unknown"]
+
+def test_failing_or_slow_provider_falls_back_to_rules():
+    failing = analyzer(CountingProvider(fail=True), batch_window_ms=1)
+    result = asyncio.run(failing.analyze("transfer_funds", "Send funds", {}))
+    assert result["action_type"] == "transaction"
+    assert failing.fallbacks == 1 and len(failing.cache) == 0
+
+    slow = analyzer(CountingProvider(latency_ms=200), batch_window_ms=1, budget_ms=20)
+    started = time.monotonic()
+    assert asyncio.run(slow.analyze("monitor_wallet", "Watch", {}))["action_type"] == "monitoring"
+    assert time.monotonic() - started < 0.15
+    assert slow.fallbacks == 1
+
+def test_cache_expires_and_evicts_least_recently_used(monkeypatch):
+    cache = AnalysisCache(max_size=2, ttl=10)
+    cache.put("a", {"n": 1})
+    cache.put("b", {"n": 2})
+    cache.get("a")
+    cache.put("c", {"n": 3})
+    assert cache.get("b") is None and cache.get("a") == {"n": 1}
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+    assert cache.get("a") is None
+    assert len(cache) == 1
+
+def test_provider_settings():
+    assert build_provider("stub").name == "stub"
+    with pytest.raises(ValueError):
+        build_provider("http")
+    with pytest.raises(ValueError):
+        build_provider("oracle")
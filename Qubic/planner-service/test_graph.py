@@ -0,0 +1,120 @@
+"""
+Graph tests
+Concurrent scheduling, conditional edges and node memoization
+"""
+
+import asyncio
+import pytest
+from graph import StateGraph
+
+class State:
+    def __init__(self, **values):
+        self.__dict__.update(values)
+        self.ran = []
+        self.timings = {}
+
+def node(name, updates=None, delay=0.0):
+    async def run(state):
+        state.ran.append(name)
+        await asyncio.sleep(delay)
+        return updates
+    return run
+
+def test_independent_nodes_run_concurrently():
+    graph = StateGraph()
+    graph.add_node("start", node("start"))
+    graph.add_node("left", node("left", {"left": 1}, delay=0.05))
+    graph.add_node("right", node("right", {"right": 2}, delay=0.05))
+    graph.add_node("join", node("join"))
+    for source, target in [("start", "left"), ("start", "right"), ("left", "join"), ("right", "join")]:
+        graph.add_edge(source, target)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        state = await graph.run(State())
+        return state, loop.time() - started
+
+    state, elapsed = asyncio.run(run())
+    assert (state.left, state.right) == (1, 2)
+    assert state.ran[0] == "start" and state.ran[-1] == "join"
+    assert elapsed < 0.09
+    assert set(state.timings) == {"start", "left", "right", "join"}
+
+def test_routed_away_branch_is_skipped_but_the_join_runs():
+    graph = StateGraph()
+    graph.add_node("score", node("score", {"score": 0.3}))
+    graph.add_node("review", node("review", {"reviewed": True}))
+    graph.add_node("audit", node("audit"))
+    graph.add_node("other", node("other"))
+    graph.add_node("build", node("build"))
+    graph.add_conditional_edges("score", lambda state: "review" if state.score > 0.5 else None, ["review"])
+    graph.add_edge("review", "audit")
+    graph.add_edge("score", "other")
+    graph.add_edge("audit", "build")
+    graph.add_edge("other", "build")
+
+    state = asyncio.run(graph.run(State()))
+    # The skip carries through review's successors; build still has other as an input
+    assert state.ran == ["score", "other", "build"]
+    assert not hasattr(state, "reviewed")
+
+def test_router_can_pick_several_targets():
+    graph = StateGraph()
+    graph.add_node("route", node("route"))
+    for name in ("a", "b", "c"):
+        graph.add_node(name, node(name))
+    graph.add_conditional_edges("route", lambda state: ["a", "c"], ["a", "b", "c"])
+    assert sorted(asyncio.run(graph.run(State())).ran) == ["a", "c", "route"]
+
+def test_memoized_node_runs_once_per_key():
+    calls = []
+
+    async def square(state):
+        calls.append(state.x)
+        return {"y": state.x * state.x}
+
+    graph = StateGraph(memo_size=2)
+    graph.add_node("square", square, memo_key=lambda state: state.x)
+    assert [asyncio.run(graph.run(State(x=x))).y for x in (2, 2, 3, 2)] == [4, 4, 9, 4]
+    assert calls == [2, 3]
+    # The least recently used key is evicted past memo_size
+    asyncio.run(graph.run(State(x=4)))
+    asyncio.run(graph.run(State(x=3)))
+    assert calls == [2, 3, 4, 3]
+
+def test_failed_node_aborts_the_run_and_cancels_siblings():
+    cancelled = []
+
+    async def slow(state):
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append("slow")
+            raise
+
+    async def fail(state):
+        raise RuntimeError("boom")
+
+    graph = StateGraph()
+    graph.add_node("slow", slow)
+    graph.add_node("fail", fail)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await graph.run(State())
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert cancelled == ["slow"]
+
+def test_cycles_and_duplicates_are_rejected():
+    graph = StateGraph()
+    graph.add_node("a", node("a"))
+    graph.add_node("b", node("b"))
+    with pytest.raises(ValueError):
+        graph.add_node("a", node("a"))
+    graph.add_edge("a", "b")
+    graph.add_edge("b", "a")
+    with pytest.raises(ValueError):
+        graph.compile()
@@ -0,0 +1,67 @@
+"""
+Plan template tests
+Binding requests into cached templates, LRU eviction and invalidation per policy version
+"""
+
+import asyncio
+from plan_templates import PlanTemplate, PlanTemplateCache, bind_all, bind_constant, bind_fields
+
+def template(task_type="transfer_funds", version='"v1"'):
+    return PlanTemplate(task_type, version, {"action_type": "transaction"}, {"version": version}, [
+        ({"step_id": "1", "type": "check_balance", "requires_approval": False}, bind_fields("wallet_address")),
+        ({"step_id": "2", "type": "policy_check", "requires_approval": False}, bind_constant({"policy_id": "p1"})),
+        ({"step_id": "3", "type": "onchain_action", "requires_approval": True}, bind_all)
+    ])
+
+def test_bind_fills_each_request_without_touching_the_template():
+    compiled = template()
+    first = compiled.bind({"wallet_address": "0xa", "amount": 5})
+    assert [step["parameters"] for step in first] == [
+        {"wallet_address": "0xa"}, {"policy_id": "p1"}, {"wallet_address": "0xa", "amount": 5}
+    ]
+    first[0]["requires_approval"] = True
+    first[1]["parameters"]["policy_id"] = "changed"
+
+    second = compiled.bind({"amount": 7})
+    assert second[0] == {"step_id": "1", "type": "check_balance", "requires_approval": False,
+                         "parameters": {"wallet_address": None}}
+    assert second[1]["parameters"] == {"policy_id": "p1"}
+    assert bind_constant(None)({"amount": 1}) is None
+
+def test_cache_evicts_the_least_recently_used():
+    cache = PlanTemplateCache(max_size=2)
+    cache.put(template("a"))
+    cache.put(template("b"))
+    assert cache.get("a", '"v1"') is not None
+    cache.put(template("c"))
+    assert cache.get("b", '"v1"') is None
+    assert [entry["task_type"] for entry in cache.stats()["templates"]] == ["a", "c"]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_invalidate_one_policy_version_or_all():
+    cache = PlanTemplateCache()
+    for task_type in ("a", "b"):
+        cache.put(template(task_type, '"v1"'))
+    cache.put(template("a", '"v2"'))
+    assert cache.invalidate('"v1"') == 2
+    assert cache.get("a", '"v2"') is not None
+    assert cache.invalidate() == 1
+    assert cache.stats()["size"] == 0
+
+def test_planner_compiles_once_per_policy_version_and_drops_superseded_templates(service, monkeypatch):
+    cache = PlanTemplateCache()
+    monkeypatch.setattr(service, "plan_template_cache", cache)
+
+    def build(version, amount):
+        state = service.PlanState("task-1", "monitor_wallet", "test", {"wallet_address": "0xa", "amount": amount})
+        state.analysis_result = {"action_type": "monitoring"}
+        state.policy_result = {"requires_approval": False, "policy_id": "p1", "version": version}
+        return asyncio.run(service.plan_builder(state))["steps"]
+
+    build('"v1"', 1)
+    steps = build('"v1"', 2)
+    assert steps[2]["parameters"]["amount"] == 2
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    service.on_policy_change("monitoring", {"etag": '"v1"'}, {"etag": '"v2"'})
+    assert cache.stats()["size"] == 0
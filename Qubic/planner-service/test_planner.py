@@ -0,0 +1,102 @@
+"""
+Planner tests
+Policy decisions evaluated from the cached rules, and the approval flags the plan builder sets from them
+"""
+
+import asyncio
+import pytest
+from fastapi import HTTPException
+from rule_engine import RuleEngine
+from velocity import build_limiter
+
+ANALYSIS = {"action_type": "transaction", "risk_level": "high"}
+
+TRANSACTION_POLICY = {"policy_id": "policy_transaction", "action_type": "transaction", "allowed": True,
+                      "requires_approval": True, "rules": {"requires_approval": True, "max_amount": 1000},
+                      "etag": '"v1"'}
+
+@pytest.fixture
+def policies(service, monkeypatch):
+    """Serves TRANSACTION_POLICY, or whatever is put in the returned dict, from the policy cache"""
+    served = {"transaction": TRANSACTION_POLICY}
+
+    async def get(action_type):
+        return served[action_type]
+
+    monkeypatch.setattr(service.policy_cache, "get", get)
+    monkeypatch.setattr(service, "policy_engine", RuleEngine(velocity=build_limiter("local", window_seconds=86400)))
+    monkeypatch.setattr(service, "compiled_policy_versions", {})
+    return served
+
+def check(service, parameters):
+    state = service.PlanState("task-1", "transfer_funds", "test", parameters, "alice")
+    state.analysis_result = ANALYSIS
+    return asyncio.run(service.policy_check(state))["policy_result"]
+
+def test_rules_are_evaluated_from_the_cached_policy(service, policies):
+    assert check(service, {"amount": 999})["decision"] == "allow"
+    over = check(service, {"amount": 5000})
+    assert (over["decision"], over["matched"], over["version"]) == ("require_approval", ["max_amount"], '"v1"')
+    assert service.policy_engine.stats()["evaluations"] == 2
+
+def test_rules_are_recompiled_when_the_policy_changes(service, policies):
+    check(service, {"amount": 500})
+    policies["transaction"] = {**TRANSACTION_POLICY, "rules": {"max_amount": 100}, "etag": '"v2"'}
+    assert check(service, {"amount": 500})["decision"] == "require_approval"
+    assert service.compiled_policy_versions == {"transaction": '"v2"'}
+
+def test_uncompilable_rules_leave_the_static_flags(service, policies):
+    policies["transaction"] = {**TRANSACTION_POLICY, "rules": {"velocity": {"window_seconds": 60}}, "etag": '"v3"'}
+    result = check(service, {"amount": 5})
+    assert "decision" not in result
+    assert result["requires_approval"] is True
+
+def build(service, task_type, parameters, decision, matched=()):
+    state = service.PlanState("task-1", task_type, "test", parameters, "alice")
+    state.analysis_result = ANALYSIS
+    state.policy_result = {"allowed": True, "requires_approval": True, "policy_id": "policy_transaction",
+                           "version": "test-v1", "decision": decision, "matched": list(matched)}
+    return {step["step_id"]: step for step in asyncio.run(service.plan_builder(state))["steps"]}
+
+def test_allowed_transfer_still_goes_through_compliance(service):
+    # Under the policy's max_amount, so the rules allow it; the runtime's auto-approval
+    # limits must still see it
+    steps = build(service, "transfer_funds", {"amount": 999, "to_address": "0xabc"}, "allow")
+    action = steps[service.ACTION_STEP_ID]
+    assert action["type"] == "onchain_action"
+    assert action["requires_approval"] is True
+    assert action["policy_decision"] == "allow"
+
+def test_transfer_flagged_by_policy_keeps_the_decision(service):
+    steps = build(service, "transfer_funds", {"amount": 5000}, "require_approval", ["max_amount"])
+    action = steps[service.ACTION_STEP_ID]
+    assert action["requires_approval"] is True
+    assert action["policy_decision"] == "require_approval"
+
+def test_policy_decides_approval_for_other_actions(service):
+    assert build(service, "generic", {}, "allow")[service.ACTION_STEP_ID]["requires_approval"] is False
+    assert build(service, "generic", {}, "require_approval")[service.ACTION_STEP_ID]["requires_approval"] is True
+
+def test_denied_plan_is_refused(service):
+    with pytest.raises(HTTPException) as error:
+        build(service, "transfer_funds", {"to_address": "0xbad"}, "deny", ["deny_wallets"])
+    assert error.value.status_code == 403
+
+def plan(service, parameters):
+    result = asyncio.run(service.execute_plan_graph("task-1", "transfer_funds", "Send funds", parameters, "alice"))
+    action = {step["step_id"]: step for step in result["steps"]}[service.ACTION_STEP_ID]
+    return result, action
+
+def test_high_risk_plan_goes_through_risk_review(service, policies, monkeypatch):
+    monkeypatch.setattr(service, "RISK_APPROVAL_THRESHOLD", 0.85)
+    result, action = plan(service, {"amount": 50, "to_address": "0xabc"})
+    assert "risk_review" not in result["timings"]
+    assert action["policy_decision"] == "allow"
+
+    # Over the threshold: the policy still allows it, but the runtime must not auto-approve it
+    policies["transaction"] = {**TRANSACTION_POLICY, "rules": {"max_amount": 100000}, "etag": '"v4"'}
+    result, action = plan(service, {"amount": 9000, "to_address": "0xabc"})
+    assert result["risk"]["score"] >= 0.85 and result["risk"]["requires_approval"]
+    assert "risk_review" in result["timings"]
+    assert result["policy"]["decision"] == "allow"
+    assert (action["requires_approval"], action["policy_decision"]) == (True, "require_approval")
@@ -0,0 +1,247 @@
+"""
+Velocity
+Sliding-window spend counters per wallet and user, in Redis or in process; shared by the agent
+runtime, which records transfers, and the policy engines in Qubic and the planner, which read them
+"""
+
+import abc
+import time
+import uuid
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+import redis
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "velocity"
+
+# Atomically check every subject's window and, only if all of them have room, record the
+# event in each. Members are "<event id>:<amount>" scored by time in ms, so the window's
+# total is summed from its members. Events are kept for the retention, which may be longer
+# than the window when policy velocity rules look further back.
+#
+# KEYS: one sorted set per subject
+# ARGV: now_ms, window_ms, retention_ms, max_count (0 = none), max_amount (0 = none), amount, member
+# Returns {allowed, index of the blocking key (0 if none), its count, its total}
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local retention = tonumber(ARGV[3])
+local max_count = tonumber(ARGV[4])
+local max_amount = tonumber(ARGV[5])
+local amount = tonumber(ARGV[6])
+for i, key in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', key, '-inf', now - retention)
+    local members = redis.call('ZRANGEBYSCORE', key, '(' .. (now - window), '+inf')
+    local total = 0
+    for _, member in ipairs(members) do
+        total = total + tonumber(string.match(member, ':([^:]+)$'))
+    end
+    if (max_count > 0 and #members + 1 > max_count) or (max_amount > 0 and total + amount > max_amount) then
+        return {0, i, #members, tostring(total)}
+    end
+end
+for _, key in ipairs(KEYS) do
+    redis.call('ZADD', key, now, ARGV[7])
+    redis.call('PEXPIRE', key, retention)
+end
+return {1, 0, 0, '0'}
+"""
+
+def _text(member) -> str:
+    return member.decode() if isinstance(member, bytes) else member
+
+def velocity_subjects(user_id: Optional[str], wallet: Optional[str]) -> List[str]:
+    """Counter subjects for a transfer: the initiating user and the destination wallet"""
+    subjects = []
+    if user_id:
+        subjects.append(f"user:{user_id}")
+    if wallet:
+        subjects.append(f"wallet:{wallet.lower()}")
+    return subjects
+
+class VelocityDecision:
+    def __init__(self, allowed: bool, subject: Optional[str] = None, count: int = 0, total: float = 0.0,
+                 event: Optional[str] = None):
+        self.allowed = allowed
+        self.subject = subject
+        self.count = count
+        self.total = total
+        self.event = event  # the recorded event, for release
+
+    def to_dict(self) -> Dict:
+        return {"allowed": self.allowed, "subject": self.subject, "count": self.count, "total": self.total}
+
+class VelocityLimiter(abc.ABC):
+    """At most max_count events and max_amount total per subject in any window_seconds; events
+    are kept for retention_seconds (at least the window) so usage() can look further back"""
+
+    mode = "base"
+
+    def __init__(self, window_seconds: float = 3600.0, max_count: int = 5, max_amount: float = 1000.0,
+                 retention_seconds: Optional[float] = None):
+        self.window_seconds = window_seconds
+        self.retention_seconds = max(retention_seconds or window_seconds, window_seconds)
+        self.max_count = max_count
+        self.max_amount = max_amount
+        self.allowed = 0
+        self.blocked = 0
+
+    @abc.abstractmethod
+    def check_and_record(self, subjects: List[str], amount: float) -> VelocityDecision:
+        """Record the event against every subject if all of them stay within limits"""
+
+    @abc.abstractmethod
+    def record(self, subjects: List[str], amount: float, now: Optional[float] = None) -> str:
+        """Record the event against every subject, whatever the limits; returns the event"""
+
+    @abc.abstractmethod
+    def release(self, subjects: List[str], event: str):
+        """Take back a recorded event, e.g. for a transfer that did not go through"""
+
+    @abc.abstractmethod
+    def usage(self, subject: str, window_seconds: Optional[float] = None, now: Optional[float] = None) -> Tuple[int, float]:
+        """(count, total amount) of the subject's events in the last window_seconds, at most
+        this limiter's retention"""
+
+    def _count(self, decision: VelocityDecision) -> VelocityDecision:
+        if decision.allowed:
+            self.allowed += 1
+        else:
+            self.blocked += 1
+        return decision
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "window_seconds": self.window_seconds,
+            "retention_seconds": self.retention_seconds,
+            "max_count": self.max_count,
+            "max_amount": self.max_amount,
+            "allowed": self.allowed,
+            "blocked": self.blocked
+        }
+
+class RedisVelocityLimiter(VelocityLimiter):
+    """Sorted-set sliding windows shared by every runtime replica, checked in one Lua call"""
+
+    mode = "redis"
+
+    def __init__(self, client: redis.Redis, **limits):
+        super().__init__(**limits)
+        self.client = client
+        self._script = client.register_script(SLIDING_WINDOW_SCRIPT)
+
+    def check_and_record(self, subjects: List[str], amount: float) -> VelocityDecision:
+        if not subjects:
+            return self._count(VelocityDecision(True))
+        keys = [f"{KEY_PREFIX}:{subject}" for subject in subjects]
+        member = f"{uuid.uuid4().hex}:{amount}"
+        allowed, index, count, total = self._script(keys=keys, args=[
+            int(time.time() * 1000),
+            int(self.window_seconds * 1000),
+            int(self.retention_seconds * 1000),
+            self.max_count or 0,
+            self.max_amount or 0,
+            amount,
+            member
+        ])
+        if allowed:
+            return self._count(VelocityDecision(True, event=member))
+        return self._count(VelocityDecision(False, subjects[int(index) - 1], int(count), float(total)))
+
+    def record(self, subjects: List[str], amount: float, now: Optional[float] = None) -> str:
+        now_ms = int((time.time() if now is None else now) * 1000)
+        retention_ms = int(self.retention_seconds * 1000)
+        member = f"{uuid.uuid4().hex}:{amount}"
+        with self.client.pipeline(transaction=False) as pipe:
+            for subject in subjects:
+                key = f"{KEY_PREFIX}:{subject}"
+                pipe.zremrangebyscore(key, "-inf", now_ms - retention_ms)
+                pipe.zadd(key, {member: now_ms})
+                pipe.pexpire(key, retention_ms)
+            pipe.execute()
+        return member
+
+    def release(self, subjects: List[str], event: str):
+        with self.client.pipeline(transaction=False) as pipe:
+            for subject in subjects:
+                pipe.zrem(f"{KEY_PREFIX}:{subject}", event)
+            pipe.execute()
+
+    def usage(self, subject: str, window_seconds: Optional[float] = None, now: Optional[float] = None) -> Tuple[int, float]:
+        now_ms = int((time.time() if now is None else now) * 1000)
+        window_ms = int(min(window_seconds or self.window_seconds, self.retention_seconds) * 1000)
+        members = self.client.zrangebyscore(f"{KEY_PREFIX}:{subject}", f"({now_ms - window_ms}", "+inf")
+        return len(members), sum((float(_text(member).rsplit(":", 1)[1]) for member in members), 0.0)
+
+class LocalVelocityLimiter(VelocityLimiter):
+    """In-process sliding windows for a single replica, tests and local development"""
+
+    mode = "local"
+
+    def __init__(self, **limits):
+        super().__init__(**limits)
+        self._events: Dict[str, Deque[Tuple[float, float, str]]] = defaultdict(deque)  # (time, amount, event)
+        self._lock = threading.Lock()
+
+    def check_and_record(self, subjects: List[str], amount: float) -> VelocityDecision:
+        now = time.time()
+        with self._lock:
+            for subject in subjects:
+                self._trim(self._events[subject], now)
+            for subject in subjects:
+                count, total = self._window(subject, now - self.window_seconds)
+                if (self.max_count and count + 1 > self.max_count) or \
+                        (self.max_amount and total + amount > self.max_amount):
+                    return self._count(VelocityDecision(False, subject, count, total))
+            event = uuid.uuid4().hex
+            for subject in subjects:
+                self._events[subject].append((now, amount, event))
+        return self._count(VelocityDecision(True, event=event))
+
+    def record(self, subjects: List[str], amount: float, now: Optional[float] = None) -> str:
+        now = time.time() if now is None else now
+        event = uuid.uuid4().hex
+        with self._lock:
+            for subject in subjects:
+                self._events[subject].append((now, amount, event))
+                self._trim(self._events[subject], now)
+        return event
+
+    def release(self, subjects: List[str], event: str):
+        with self._lock:
+            for subject in subjects:
+                events = self._events.get(subject)
+                if events:
+                    self._events[subject] = deque(entry for entry in events if entry[2] != event)
+
+    def usage(self, subject: str, window_seconds: Optional[float] = None, now: Optional[float] = None) -> Tuple[int, float]:
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._window(subject, now - min(window_seconds or self.window_seconds, self.retention_seconds))
+
+    def _trim(self, events: Deque[Tuple[float, float, str]], now: float):
+        while events and events[0][0] <= now - self.retention_seconds:
+            events.popleft()
+
+    def _window(self, subject: str, cutoff: float) -> Tuple[int, float]:
+        """(count, total amount) of the subject's events after cutoff; call with the lock held"""
+        count = 0
+        total = 0.0
+        for timestamp, amount, _ in reversed(self._events.get(subject, ())):
+            if timestamp <= cutoff:
+                break
+            count += 1
+            total += amount
+        return count, total
+
+def build_limiter(mode: str, client: Optional[redis.Redis] = None, **limits) -> VelocityLimiter:
+    """Limiter factory for the VELOCITY_MODE setting"""
+    if mode == "redis":
+        return RedisVelocityLimiter(client, **limits)
+    if mode == "local":
+        return LocalVelocityLimiter(**limits)
+    raise ValueError(f"Unknown velocity mode: {mode}")
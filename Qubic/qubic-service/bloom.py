@@ -0,0 +1,194 @@
+"""
+Bloom
+Scalable Bloom filter over anchored hashes, snapshotted to Redis, for fast negative verification
+"""
+
+import json
+import math
+import hashlib
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import redis
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_META_KEY = "qubic:bloom:meta"
+SNAPSHOT_SLICE_KEY = "qubic:bloom:slice:{index}"
+
+def _base_hashes(item: str):
+    """Two 64-bit hashes for double hashing (rehashed so non-uniform inputs still spread)"""
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+class BloomFilter:
+    """Fixed-size Bloom filter sized for capacity items at error_rate"""
+
+    def __init__(self, capacity: int, error_rate: float, bits: Optional[bytearray] = None, count: int = 0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.count = count
+
+    def add(self, item: str):
+        h1, h2 = _base_hashes(item)
+        bits = self.bits
+        m = self.num_bits
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % m
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        h1, h2 = _base_hashes(item)
+        bits = self.bits
+        m = self.num_bits
+        for i in range(self.num_hashes):
+            position = (h1 + i * h2) % m
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def estimated_fp_rate(self) -> float:
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+class ScalableBloomFilter:
+    """Chain of Bloom filters: each new slice doubles capacity and halves its error rate,
+    keeping the compound false-positive rate under ~2x the initial error rate"""
+
+    def __init__(self, initial_capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.slices: List[BloomFilter] = [BloomFilter(initial_capacity, error_rate / 2)]
+        self.height = 0  # highest chain height fully applied
+
+    def add(self, item: str):
+        current = self.slices[-1]
+        if current.count >= current.capacity:
+            current = BloomFilter(current.capacity * 2, current.error_rate / 2)
+            self.slices.append(current)
+        current.add(item)
+
+    def add_many(self, items: Iterable[str]):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item: str) -> bool:
+        # Newest slice first: recent hashes are the most likely to be verified
+        for bloom in reversed(self.slices):
+            if item in bloom:
+                return True
+        return False
+
+    @property
+    def count(self) -> int:
+        return sum(bloom.count for bloom in self.slices)
+
+    def estimated_fp_rate(self) -> float:
+        miss = 1.0
+        for bloom in self.slices:
+            miss *= 1 - bloom.estimated_fp_rate()
+        return 1 - miss
+
+    def memory_bytes(self) -> int:
+        return sum(len(bloom.bits) for bloom in self.slices)
+
+    def snapshot(self) -> Tuple[str, List[bytes]]:
+        """Copy of the slices and the chain height they cover, as (meta JSON, slice bits).
+
+        Take it on the thread that updates the filter, so the copy is consistent; writing it
+        with write_snapshot can then happen anywhere."""
+        meta = {
+            "initial_capacity": self.initial_capacity,
+            "error_rate": self.error_rate,
+            "height": self.height,
+            "slices": [
+                {"capacity": bloom.capacity, "error_rate": bloom.error_rate, "count": bloom.count}
+                for bloom in self.slices
+            ]
+        }
+        return json.dumps(meta), [bytes(bloom.bits) for bloom in self.slices]
+
+    @staticmethod
+    def write_snapshot(client: redis.Redis, snapshot: Tuple[str, List[bytes]]):
+        meta, slices = snapshot
+        with client.pipeline(transaction=True) as pipe:
+            for index, bits in enumerate(slices):
+                pipe.set(SNAPSHOT_SLICE_KEY.format(index=index), bits)
+            pipe.set(SNAPSHOT_META_KEY, meta)
+            pipe.execute()
+
+    def save(self, client: redis.Redis):
+        """Snapshot all slices and the chain height they cover"""
+        self.write_snapshot(client, self.snapshot())
+
+    @classmethod
+    def load(cls, client: redis.Redis) -> Optional["ScalableBloomFilter"]:
+        """Restore from the latest snapshot, or None if there is none"""
+        raw = client.get(SNAPSHOT_META_KEY)
+        if not raw:
+            return None
+        meta = json.loads(raw)
+        bloom = cls(meta["initial_capacity"], meta["error_rate"])
+        bloom.slices = []
+        for index, info in enumerate(meta["slices"]):
+            bits = client.get(SNAPSHOT_SLICE_KEY.format(index=index))
+            if bits is None:
+                return None
+            bloom.slices.append(BloomFilter(info["capacity"], info["error_rate"], bytearray(bits), info["count"]))
+        bloom.height = meta["height"]
+        return bloom
+
+class HashFilter:
+    """Bloom filter kept in step with the ledger: definite negatives skip the store.
+
+    A miss is only definite while the filter covers the chain head. Blocks committed by
+    another worker or replica reach this filter at the next sync, so until then callers must
+    check covers() and go to the store."""
+
+    def __init__(self, bloom: ScalableBloomFilter):
+        self.bloom = bloom
+        self.negatives = 0
+        self.passed = 0
+        self.false_positives = 0
+        self.behind = 0
+
+    def covers(self, head_height: int) -> bool:
+        """Whether every block up to head_height has been applied"""
+        if self.bloom.height >= head_height:
+            return True
+        self.behind += 1
+        return False
+
+    def might_contain(self, hash: str) -> bool:
+        if hash in self.bloom:
+            self.passed += 1
+            return True
+        self.negatives += 1
+        return False
+
+    def record_false_positive(self):
+        self.false_positives += 1
+
+    def apply_block(self, height: int, hashes: List[str]):
+        """Add a block's hashes; the covered height only advances over contiguous blocks,
+        so a block committed elsewhere in between is still picked up by the next sync"""
+        self.bloom.add_many(hashes)
+        if height == self.bloom.height + 1:
+            self.bloom.height = height
+
+    def stats(self) -> Dict[str, Any]:
+        absent = self.negatives + self.false_positives
+        return {
+            "items": self.bloom.count,
+            "slices": len(self.bloom.slices),
+            "memory_bytes": self.bloom.memory_bytes(),
+            "height": self.bloom.height,
+            "estimated_fp_rate": self.bloom.estimated_fp_rate(),
+            "observed_fp_rate": self.false_positives / absent if absent else 0.0,
+            "fast_negatives": self.negatives,
+            "passed_to_store": self.passed,
+            "false_positives": self.false_positives,
+            "bypassed_while_behind": self.behind
+        }
@@ -0,0 +1,22 @@
+"""
+Test fixtures
+The service's main module, loaded under its own name so every service's main.py can be
+imported in one pytest run
+"""
+
+import os
+import sys
+import importlib.util
+import pytest
+
+MODULE_NAME = "qubic_service_main"
+
+@pytest.fixture(scope="session")
+def service():
+    module = sys.modules.get(MODULE_NAME)
+    if module is None:
+        spec = importlib.util.spec_from_file_location(MODULE_NAME, os.path.join(os.path.dirname(__file__), "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[MODULE_NAME] = module
+        spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,548 @@
+"""
+Ledger
+Block-batching ledger engine: accumulates hash writes into hash-chained blocks
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import redis
+from segment_log import SegmentLog
+
+logger = logging.getLogger(__name__)
+
+HEAD_HEIGHT_KEY = "qubic:chain:height"
+HEAD_HASH_KEY = "qubic:chain:head"
+GENESIS_HASH = "0" * 64
+
+def sha256_hex(data: str) -> str:
+    return hashlib.sha256(data.encode()).hexdigest()
+
+def merkle_levels(leaves: List[str]) -> List[List[str]]:
+    """All Merkle tree levels, leaves first (last node duplicated on odd levels)"""
+    if not leaves:
+        return [[GENESIS_HASH]]
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        if len(level) % 2:
+            level = level + [level[-1]]
+        levels.append([sha256_hex(level[i] + level[i + 1]) for i in range(0, len(level), 2)])
+    return levels
+
+def merkle_root(leaves: List[str]) -> str:
+    """Merkle root over hex leaf hashes"""
+    return merkle_levels(leaves)[-1][0]
+
+def merkle_path(levels: List[List[str]], position: int) -> List[Dict[str, str]]:
+    """Sibling hashes from leaf to root; side says where the sibling sits"""
+    path = []
+    for level in levels[:-1]:
+        sibling = position ^ 1
+        sibling_hash = level[sibling] if sibling < len(level) else level[position]
+        path.append({"hash": sibling_hash, "side": "left" if sibling < position else "right"})
+        position //= 2
+    return path
+
+def verify_merkle_path(leaf: str, path: List[Dict[str, str]], root: str) -> bool:
+    """Recompute the root from a leaf and its inclusion path"""
+    current = leaf
+    for step in path:
+        if step["side"] == "left":
+            current = sha256_hex(step["hash"] + current)
+        else:
+            current = sha256_hex(current + step["hash"])
+    return current == root
+
+def header_hash(header: Dict[str, Any]) -> str:
+    return sha256_hex(json.dumps(header, sort_keys=True))
+
+class PendingWrite:
+    def __init__(self, hash: str, txid: str, metadata_json: str, future: asyncio.Future):
+        self.hash = hash
+        self.txid = txid
+        self.metadata_json = metadata_json
+        self.future = future
+        self.submitted_at = time.perf_counter()
+
+class LedgerEngine:
+    """Collects writes for up to block_interval_ms (or max_block_size writes), then commits
+    them as one block: monotonic height, header chained to the previous header hash.
+
+    Without a segment log all keys of a block are written in a single Redis transaction and
+    Redis is the store. With a log, each block is appended to it before it is acknowledged;
+    lookups are served from in-memory indexes rebuilt from the log at startup, and Redis
+    (optional) only receives a write-through copy of the keys as a hot cache."""
+
+    def __init__(self, redis_client: Optional[redis.Redis], block_interval_ms: float = 20.0,
+                 max_block_size: int = 500, log: Optional[SegmentLog] = None):
+        if redis_client is None and log is None:
+            raise ValueError("LedgerEngine needs a Redis client, a segment log, or both")
+        self.redis = redis_client
+        self.log = log
+        self.block_interval_ms = block_interval_ms
+        self.max_block_size = max_block_size
+        self._pending: List[PendingWrite] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.blocks_committed = 0
+        self.writes_committed = 0
+        self._confirmation_ms: deque = deque(maxlen=10000)
+        self._commit_ms: deque = deque(maxlen=1000)
+        self._commit_listeners: List[Callable[[int, List[str]], None]] = []
+        # Blocks are immutable, so their Merkle trees can be cached indefinitely
+        self._trees: "OrderedDict[int, List[List[str]]]" = OrderedDict()
+        self._tree_cache_size = 256
+        self._trees_lock = threading.Lock()
+        # Log mode: chain head and hash/txid -> (height, position) indexes, plus decoded blocks
+        self._head_height = 0
+        self._head_hash = GENESIS_HASH
+        self._hash_index: Dict[str, Tuple[int, int]] = {}
+        self._tx_index: Dict[str, Tuple[int, int]] = {}
+        self._blocks: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._block_cache_size = 1024
+        self._log_lock = threading.Lock()
+        self.cache_errors = 0
+
+    def open(self):
+        """Open the segment log and rebuild the indexes (and a stale Redis cache) from it"""
+        if self.log is None:
+            return
+        start = time.perf_counter()
+        self.log.open()
+        for height, payload in self.log.replay():
+            self._index_block(json.loads(payload))
+        elapsed = time.perf_counter() - start
+        logger.info(f"Replayed {self._head_height} blocks ({len(self._hash_index)} hashes) in {elapsed:.3f}s")
+
+        if self.redis is not None:
+            try:
+                cached = int(self.redis.get(HEAD_HEIGHT_KEY) or 0)
+                if cached != self._head_height:
+                    self.rebuild_cache(cached + 1 if cached < self._head_height else 1)
+            except redis.RedisError as e:
+                logger.warning(f"Redis cache unavailable, serving from the segment log only: {e}")
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+
+    def _index_block(self, record: Dict[str, Any]):
+        height = record["height"]
+        for position, (hash, txid, _) in enumerate(record["writes"]):
+            self._hash_index[hash] = (height, position)
+            self._tx_index[txid] = (height, position)
+        self._head_height = height
+        self._head_hash = record["hash"]
+
+    def rebuild_cache(self, from_height: int = 1):
+        """Rewrite the Redis hot cache from the segment log"""
+        count = 0
+        for height, payload in self.log.replay(from_height):
+            self._cache_block(json.loads(payload))
+            count += 1
+        logger.info(f"Rebuilt Redis cache for {count} blocks from height {from_height}")
+
+    def add_commit_listener(self, listener: Callable[[int, List[str]], None]):
+        """Register a callback fired with (height, hashes) after each committed block"""
+        self._commit_listeners.append(listener)
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush pending writes and stop the block producer"""
+        if self._task is None:
+            return
+        # The producer finishes the block in flight, commits what is still pending, then returns;
+        # cancelling it mid-commit would leave the taken batch's futures unresolved
+        self._stopping = True
+        self._wakeup.set()
+        self._full.set()
+        await self._task
+        self._task = None
+
+    def _enqueue(self, hash: str, txid: str, metadata_json: str) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(PendingWrite(hash, txid, metadata_json, future))
+        return future
+
+    def _signal(self):
+        self._wakeup.set()
+        if len(self._pending) >= self.max_block_size:
+            self._full.set()
+
+    async def submit(self, hash: str, txid: str, metadata_json: str) -> Dict[str, Any]:
+        """Queue a write and wait until its block is committed"""
+        future = self._enqueue(hash, txid, metadata_json)
+        self._signal()
+        return await future
+
+    async def submit_many(self, writes: List[tuple]) -> List[Any]:
+        """Queue (hash, txid, metadata_json) writes together; returns a receipt or exception per write"""
+        futures = [self._enqueue(hash, txid, metadata_json) for hash, txid, metadata_json in writes]
+        self._signal()
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def _take_batch(self) -> List[PendingWrite]:
+        batch = self._pending[:self.max_block_size]
+        self._pending = self._pending[self.max_block_size:]
+        if len(self._pending) < self.max_block_size:
+            self._full.clear()
+        return batch
+
+    async def _run(self):
+        while self._pending or not self._stopping:
+            await self._wakeup.wait()
+            if len(self._pending) < self.max_block_size and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.block_interval_ms / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._take_batch()
+            if not self._pending and not self._stopping:
+                self._wakeup.clear()
+            if batch:
+                await self._commit(batch)
+
+    async def _commit(self, batch: List[PendingWrite]):
+        start = time.perf_counter()
+        try:
+            block = await asyncio.to_thread(self._commit_block, batch)
+        except Exception as e:
+            logger.error(f"Block commit failed for {len(batch)} writes: {e}")
+            for write in batch:
+                if not write.future.done():
+                    write.future.set_exception(e)
+            return
+
+        committed_at = time.perf_counter()
+        hashes = [write.hash for write in batch]
+        for listener in self._commit_listeners:
+            try:
+                listener(block["height"], hashes)
+            except Exception as e:
+                logger.error(f"Block commit listener failed: {e}")
+        self._commit_ms.append((committed_at - start) * 1000)
+        self.blocks_committed += 1
+        self.writes_committed += len(batch)
+        for position, write in enumerate(batch):
+            self._confirmation_ms.append((committed_at - write.submitted_at) * 1000)
+            if not write.future.done():
+                write.future.set_result({
+                    "block_height": block["height"],
+                    "block_hash": block["hash"],
+                    "position": position,
+                    "timestamp": block["timestamp"]
+                })
+
+    def _commit_block(self, batch: List[PendingWrite]) -> Dict[str, Any]:
+        if self.log is not None:
+            return self._append_block(batch)
+        return self._commit_redis_block(batch)
+
+    def _append_block(self, batch: List[PendingWrite]) -> Dict[str, Any]:
+        """Append one block to the segment log (the single producer), then refresh the cache"""
+        with self._log_lock:
+            height = self._head_height + 1
+            timestamp = datetime.utcnow().isoformat()
+            header = {
+                "height": height,
+                "prev_hash": self._head_hash,
+                "tx_root": merkle_root([write.hash for write in batch]),
+                "tx_count": len(batch),
+                "timestamp": timestamp
+            }
+            record = {
+                **header,
+                "hash": header_hash(header),
+                "writes": [[write.hash, write.txid, write.metadata_json] for write in batch]
+            }
+            self.log.append(height, json.dumps(record, separators=(",", ":")).encode())
+            self._index_block(record)
+            self._remember_block(height, record)
+
+        if self.redis is not None:
+            try:
+                self._cache_block(record)
+            except redis.RedisError as e:
+                # The block is durable in the log; the cache is rebuilt on the next start
+                self.cache_errors += 1
+                logger.warning(f"Redis cache write failed for block {height}: {e}")
+        return {"height": height, "hash": record["hash"], "timestamp": timestamp}
+
+    def _cache_block(self, record: Dict[str, Any]):
+        """Write a block's keys to Redis in the layout of the Redis-only mode"""
+        height = record["height"]
+        timestamp = record["timestamp"]
+        with self.redis.pipeline(transaction=True) as pipe:
+            for position, (hash, txid, metadata_json) in enumerate(record["writes"]):
+                pipe.hset(f"qubic:hash:{hash}", mapping={
+                    "hash": hash,
+                    "txid": txid,
+                    "metadata": metadata_json,
+                    "timestamp": timestamp,
+                    "block_height": height,
+                    "position": position
+                })
+                pipe.hset(f"qubic:tx:{txid}", mapping={
+                    "hash": hash,
+                    "metadata": metadata_json,
+                    "timestamp": timestamp,
+                    "block_height": height,
+                    "position": position
+                })
+            pipe.hset(f"qubic:block:{height}", mapping={
+                "height": str(height),
+                "prev_hash": record["prev_hash"],
+                "tx_root": record["tx_root"],
+                "tx_count": str(record["tx_count"]),
+                "timestamp": timestamp,
+                "hash": record["hash"],
+                "hashes": json.dumps([write[0] for write in record["writes"]])
+            })
+            if height >= self._head_height:
+                pipe.set(HEAD_HEIGHT_KEY, height)
+                pipe.set(HEAD_HASH_KEY, record["hash"])
+            pipe.execute()
+
+    def _commit_redis_block(self, batch: List[PendingWrite]) -> Dict[str, Any]:
+        """Build and commit one block, retrying if another producer extended the chain first"""
+        with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    pipe.watch(HEAD_HEIGHT_KEY, HEAD_HASH_KEY)
+                    height = int(pipe.get(HEAD_HEIGHT_KEY) or 0) + 1
+                    prev_hash = pipe.get(HEAD_HASH_KEY) or GENESIS_HASH
+                    timestamp = datetime.utcnow().isoformat()
+                    header = {
+                        "height": height,
+                        "prev_hash": prev_hash,
+                        "tx_root": merkle_root([write.hash for write in batch]),
+                        "tx_count": len(batch),
+                        "timestamp": timestamp
+                    }
+                    block_hash = header_hash(header)
+
+                    pipe.multi()
+                    for position, write in enumerate(batch):
+                        pipe.hset(f"qubic:hash:{write.hash}", mapping={
+                            "hash": write.hash,
+                            "txid": write.txid,
+                            "metadata": write.metadata_json,
+                            "timestamp": timestamp,
+                            "block_height": height,
+                            "position": position
+                        })
+                        # Self-contained so /tx/{txid} is a single lookup
+                        pipe.hset(f"qubic:tx:{write.txid}", mapping={
+                            "hash": write.hash,
+                            "metadata": write.metadata_json,
+                            "timestamp": timestamp,
+                            "block_height": height,
+                            "position": position
+                        })
+                    pipe.hset(f"qubic:block:{height}", mapping={
+                        **{key: str(value) for key, value in header.items()},
+                        "hash": block_hash,
+                        "hashes": json.dumps([write.hash for write in batch])
+                    })
+                    pipe.set(HEAD_HEIGHT_KEY, height)
+                    pipe.set(HEAD_HASH_KEY, block_hash)
+                    pipe.execute()
+                    return {"height": height, "hash": block_hash, "timestamp": timestamp}
+                except redis.WatchError:
+                    continue
+
+    def _remember_block(self, height: int, record: Dict[str, Any]):
+        self._blocks[height] = record
+        self._blocks.move_to_end(height)
+        while len(self._blocks) > self._block_cache_size:
+            self._blocks.popitem(last=False)
+
+    def _read_record(self, height: int) -> Optional[Dict[str, Any]]:
+        """Decoded block record from the segment log"""
+        with self._log_lock:
+            record = self._blocks.get(height)
+            if record is not None:
+                self._blocks.move_to_end(height)
+                return record
+            payload = self.log.read(height)
+            if payload is None:
+                return None
+            record = json.loads(payload)
+            self._remember_block(height, record)
+            return record
+
+    def get_block(self, height: int) -> Optional[Dict[str, Any]]:
+        if self.log is not None:
+            record = self._read_record(height)
+            if record is None:
+                return None
+            return {
+                "height": record["height"],
+                "hash": record["hash"],
+                "prev_hash": record["prev_hash"],
+                "tx_root": record["tx_root"],
+                "tx_count": record["tx_count"],
+                "timestamp": record["timestamp"],
+                "hashes": [write[0] for write in record["writes"]]
+            }
+        data = self.redis.hgetall(f"qubic:block:{height}")
+        if not data:
+            return None
+        return {
+            "height": int(data["height"]),
+            "hash": data["hash"],
+            "prev_hash": data["prev_hash"],
+            "tx_root": data["tx_root"],
+            "tx_count": int(data["tx_count"]),
+            "timestamp": data["timestamp"],
+            "hashes": json.loads(data.get("hashes", "[]"))
+        }
+
+    def _block_tree(self, block: Dict[str, Any]) -> List[List[str]]:
+        height = block["height"]
+        with self._trees_lock:
+            levels = self._trees.get(height)
+            if levels is not None:
+                self._trees.move_to_end(height)
+                return levels
+        levels = merkle_levels(block["hashes"])
+        with self._trees_lock:
+            self._trees[height] = levels
+            while len(self._trees) > self._tree_cache_size:
+                self._trees.popitem(last=False)
+        return levels
+
+    def _logged_write(self, location: Optional[Tuple[int, int]]) -> Optional[Dict[str, Any]]:
+        if location is None:
+            return None
+        height, position = location
+        record = self._read_record(height)
+        hash, txid, metadata_json = record["writes"][position]
+        return {
+            "hash": hash,
+            "txid": txid,
+            "metadata": metadata_json,
+            "timestamp": record["timestamp"],
+            "block_height": height,
+            "position": position
+        }
+
+    def lookup_hash(self, hash: str) -> Optional[Dict[str, Any]]:
+        """Stored record of an anchored hash (txid, metadata JSON, timestamp, block location)"""
+        if self.log is not None:
+            return self._logged_write(self._hash_index.get(hash))
+        data = self.redis.hgetall(f"qubic:hash:{hash}")
+        return data or None
+
+    def lookup_hashes(self, hashes: List[str]) -> List[Dict[str, Any]]:
+        """txid and timestamp of many hashes ({} when absent), in one pipelined round trip"""
+        if self.log is not None:
+            results = []
+            for hash in hashes:
+                record = self._logged_write(self._hash_index.get(hash))
+                results.append({"txid": record["txid"], "timestamp": record["timestamp"]} if record else {})
+            return results
+        with self.redis.pipeline(transaction=False) as pipe:
+            for hash in hashes:
+                pipe.hmget(f"qubic:hash:{hash}", "txid", "timestamp")
+            return [
+                {"txid": txid, "timestamp": timestamp} if txid else {}
+                for txid, timestamp in pipe.execute()
+            ]
+
+    def lookup_tx(self, txid: str) -> Optional[Dict[str, Any]]:
+        """Stored record of a transaction (hash, metadata JSON, timestamp, block location)"""
+        if self.log is not None:
+            return self._logged_write(self._tx_index.get(txid))
+        data = self.redis.hgetall(f"qubic:tx:{txid}")
+        if data and "metadata" not in data:
+            # Records written before transactions were self-contained
+            data = {**self.redis.hgetall(f"qubic:hash:{data.get('hash')}"), **data}
+        return data or None
+
+    def iter_hashes(self) -> Iterator[str]:
+        """Every anchored hash"""
+        if self.log is not None:
+            yield from list(self._hash_index)
+            return
+        for key in self.redis.scan_iter(match="qubic:hash:*", count=1000):
+            yield key[len("qubic:hash:"):]
+
+    def get_proof(self, hash: str) -> Optional[Dict[str, Any]]:
+        """Inclusion proof of a hash against its block header"""
+        if self.log is not None:
+            location = self._hash_index.get(hash)
+        else:
+            stored = self.redis.hmget(f"qubic:hash:{hash}", "block_height", "position")
+            location = (int(stored[0]), int(stored[1])) if None not in stored else None
+        if location is None:
+            return None
+        height, position = location
+        block = self.get_block(height)
+        if block is None or position >= len(block["hashes"]) or block["hashes"][position] != hash:
+            return None
+
+        path = merkle_path(self._block_tree(block), position)
+        return {
+            "hash": hash,
+            "block_height": height,
+            "position": position,
+            "path": path,
+            "header": {
+                "height": block["height"],
+                "prev_hash": block["prev_hash"],
+                "tx_root": block["tx_root"],
+                "tx_count": block["tx_count"],
+                "timestamp": block["timestamp"]
+            },
+            "block_hash": block["hash"]
+        }
+
+    def head_height(self) -> int:
+        if self.log is not None:
+            return self._head_height
+        return int(self.redis.get(HEAD_HEIGHT_KEY) or 0)
+
+    def head_hash(self) -> str:
+        if self.log is not None:
+            return self._head_hash
+        return self.redis.get(HEAD_HASH_KEY) or GENESIS_HASH
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        confirmations = sorted(self._confirmation_ms)
+        def percentile(p: float) -> Optional[float]:
+            if not confirmations:
+                return None
+            return round(confirmations[min(len(confirmations) - 1, int(p * len(confirmations)))], 3)
+        return {
+            "height": self.head_height(),
+            "head": self.head_hash(),
+            "pending": self.pending_writes,
+            "blocks_committed": self.blocks_committed,
+            "writes_committed": self.writes_committed,
+            "avg_block_size": round(self.writes_committed / self.blocks_committed, 2) if self.blocks_committed else 0,
+            "avg_commit_ms": round(sum(self._commit_ms) / len(self._commit_ms), 3) if self._commit_ms else None,
+            "confirmation_ms": {"p50": percentile(0.50), "p95": percentile(0.95), "p99": percentile(0.99)},
+            "block_interval_ms": self.block_interval_ms,
+            "max_block_size": self.max_block_size,
+            "log": {**self.log.stats(), "cache_errors": self.cache_errors} if self.log is not None else None
+        }
@@ -5,13 +5,30 @@ Mock Qubic blockchain service for policy and hash storage
 
 import os
 import logging
-from fastapi import FastAPI, HTTPException, Query
+import asyncio
+import threading
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+import hmac
 import hashlib
 import json
 from datetime import datetime
 import redis
+import redis.asyncio as aioredis
+import executor
+from ledger import LedgerEngine
+from segment_log import SegmentLog
+from bloom import HashFilter, ScalableBloomFilter
+from rule_engine import RuleEngine, RuleError
+from velocity import build_limiter
+import serve
+import tracing
+import metrics
+import profiling
+import deadlines
+import wire
 
 # Configure logging
 logging.basicConfig(
@@ -24,10 +41,61 @@ app = FastAPI(title="Qubic Service", version="1.0.0")
 
 # Configuration
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+BLOCK_INTERVAL_MS = float(os.getenv("BLOCK_INTERVAL_MS", "20"))
+MAX_BLOCK_SIZE = int(os.getenv("MAX_BLOCK_SIZE", "500"))
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "10000"))
+BLOOM_ENABLED = os.getenv("BLOOM_ENABLED", "true").lower() == "true"
+BLOOM_CAPACITY = int(os.getenv("BLOOM_CAPACITY", "1000000"))
+BLOOM_ERROR_RATE = float(os.getenv("BLOOM_ERROR_RATE", "0.001"))
+BLOOM_SYNC_INTERVAL = float(os.getenv("BLOOM_SYNC_INTERVAL", "1"))
+BLOOM_SNAPSHOT_INTERVAL = float(os.getenv("BLOOM_SNAPSHOT_INTERVAL", "60"))
+LEDGER_LOG_DIR = os.getenv("LEDGER_LOG_DIR", "")
+LEDGER_SEGMENT_BYTES = int(os.getenv("LEDGER_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+LEDGER_FSYNC_INTERVAL_MS = float(os.getenv("LEDGER_FSYNC_INTERVAL_MS", "0"))
+LEDGER_INDEX_COMPACT_AFTER = int(os.getenv("LEDGER_INDEX_COMPACT_AFTER", "8"))
+POLICY_RULES_FILE = os.getenv("POLICY_RULES_FILE", "")
+POLICY_RELOAD_INTERVAL = float(os.getenv("POLICY_RELOAD_INTERVAL", "5"))
+POLICY_ADMIN_TOKEN = os.getenv("POLICY_ADMIN_TOKEN", "")  # required by the policy write routes; unset disables them
+POLICY_VELOCITY_MODE = os.getenv("POLICY_VELOCITY_MODE", "redis")
+POLICY_VELOCITY_RETENTION_SECONDS = float(os.getenv("POLICY_VELOCITY_RETENTION_SECONDS", "86400"))  # longest velocity window a policy can use
 
 # Redis client for persistent storage (simulating blockchain)
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+# Binary-safe client for Bloom filter snapshots
+redis_binary_client = redis.from_url(REDIS_URL)
+
+# Durable block log; without it Redis is the ledger store
+segment_log = SegmentLog(
+    LEDGER_LOG_DIR,
+    segment_bytes=LEDGER_SEGMENT_BYTES,
+    fsync_interval_ms=LEDGER_FSYNC_INTERVAL_MS,
+    compact_after=LEDGER_INDEX_COMPACT_AFTER
+) if LEDGER_LOG_DIR else None
+
+# Block producer (simulating Qubic block batching)
+ledger = LedgerEngine(
+    redis_client,
+    block_interval_ms=BLOCK_INTERVAL_MS,
+    max_block_size=MAX_BLOCK_SIZE,
+    log=segment_log
+)
+
+# Metrics
+LEDGER_PENDING_WRITES = metrics.Gauge(
+    "qubic_ledger_pending_writes", "Writes waiting for the next block", function=lambda: ledger.pending_writes
+)
+LEDGER_WRITES_COMMITTED = metrics.Counter(
+    "qubic_ledger_writes_committed_total", "Writes committed to blocks", function=lambda: ledger.writes_committed
+)
+LEDGER_BLOCKS_COMMITTED = metrics.Counter(
+    "qubic_ledger_blocks_committed_total", "Blocks committed", function=lambda: ledger.blocks_committed
+)
+
+# Fast negative path for verification; None until loaded at startup (all lookups go to the store)
+hash_filter: Optional[HashFilter] = None
+bloom_task: Optional[asyncio.Task] = None
+
 # Request/Response models
 class WriteRequest(BaseModel):
     hash: str
@@ -37,6 +105,26 @@ class WriteResponse(BaseModel):
     txid: str
     hash: str
     timestamp: str
+    block_height: Optional[int] = None
+
+class BatchWriteRequest(BaseModel):
+    items: List[WriteRequest]
+
+class BatchWriteItem(BaseModel):
+    hash: str
+    status: str
+    txid: Optional[str] = None
+    timestamp: Optional[str] = None
+    block_height: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchWriteResponse(BaseModel):
+    written: int
+    failed: int
+    results: List[BatchWriteItem]
+
+class BatchVerifyRequest(BaseModel):
+    hashes: List[str]
 
 class PolicyResponse(BaseModel):
     policy_id: str
@@ -44,6 +132,42 @@ class PolicyResponse(BaseModel):
     allowed: bool
     requires_approval: bool
     rules: Dict[str, Any]
+    version: int
+    etag: str
+
+class PolicyUpdateRequest(BaseModel):
+    allowed: bool
+    requires_approval: bool
+    risk_level: str = "medium"
+    max_amount: Optional[float] = None
+    allow_wallets: Optional[List[str]] = None
+    deny_wallets: Optional[List[str]] = None
+    time_window: Optional[Dict[str, Any]] = None
+    velocity: Optional[Dict[str, Any]] = None
+    conditions: Optional[List[Dict[str, Any]]] = None
+
+class PolicyEvaluateRequest(BaseModel):
+    action_type: str
+    parameters: Dict[str, Any] = {}
+    user_id: Optional[str] = None
+    record: bool = False
+
+class PolicyDecision(BaseModel):
+    action_type: str
+    policy_id: str
+    decision: str
+    allowed: bool
+    requires_approval: bool
+    risk_level: str
+    matched: List[str]
+    version: int
+
+class BatchEvaluateRequest(BaseModel):
+    items: List[PolicyEvaluateRequest]
+
+class BatchEvaluateResponse(BaseModel):
+    version: int
+    results: List[PolicyDecision]
 
 class VerifyResponse(BaseModel):
     hash: str
@@ -51,6 +175,11 @@ class VerifyResponse(BaseModel):
     txid: Optional[str] = None
     timestamp: Optional[str] = None
 
+class BatchVerifyResponse(BaseModel):
+    verified: int
+    missing: int
+    results: List[VerifyResponse]
+
 # Policy rules (simulating Qubic policy engine)
 POLICY_RULES = {
     "monitoring": {
@@ -67,7 +196,9 @@ POLICY_RULES = {
     "transfer_funds": {
         "allowed": True,
         "requires_approval": True,
-        "risk_level": "high"
+        "risk_level": "high",
+        "max_amount": 1000.0,
+        "velocity": {"max_count": 5, "window_seconds": 3600}
     },
     "unknown": {
         "allowed": True,
@@ -76,10 +207,258 @@ POLICY_RULES = {
     }
 }
 
-def generate_txid(hash: str, metadata: Dict) -> str:
+# Policy set version, bumped on every policy change
+POLICY_CHANNEL = "qubic:policy:changes"
+policy_version = 1
+
+# Shared policy state, so every worker and replica serves the same rules and version
+POLICY_RULES_KEY = "qubic:policy:rules"
+POLICY_VERSION_KEY = "qubic:policy:version"
+
+# Compiled form of POLICY_RULES, swapped atomically on every change
+# Velocity rules read the agent runtime's transfer windows (velocity:user:<id>) in redis mode
+rule_engine = RuleEngine(
+    velocity=build_limiter(POLICY_VELOCITY_MODE, redis_client, window_seconds=POLICY_VELOCITY_RETENTION_SECONDS)
+)
+rule_engine.load(POLICY_RULES)
+policy_reload_task: Optional[asyncio.Task] = None
+policy_follow_task: Optional[asyncio.Task] = None
+policy_rules_mtime: Optional[float] = None
+# Reloads run in worker threads; the file watcher and POST /policy/reload take turns
+policy_reload_lock = threading.Lock()
+
+def build_policy(action_type: str) -> PolicyResponse:
+    """Resolve the policy for an action type, falling back to the unknown policy"""
+    policy = POLICY_RULES.get(action_type, POLICY_RULES["unknown"])
+    policy_id = policy_id_for(action_type)
+    content = json.dumps({"policy_id": policy_id, "rules": policy}, sort_keys=True)
+    etag = f'"{hashlib.sha256(content.encode()).hexdigest()[:16]}"'
+    
+    return PolicyResponse(
+        policy_id=policy_id,
+        action_type=action_type,
+        # Defaults as in CompiledPolicy, for rule sets that leave them out
+        allowed=policy.get("allowed", True),
+        requires_approval=policy.get("requires_approval", True),
+        rules=policy,
+        version=policy_version,
+        etag=etag
+    )
+
+def policy_id_for(action_type: str) -> str:
+    return f"policy_{action_type}_{hashlib.md5(action_type.encode()).hexdigest()[:8]}"
+
+def publish_policy_change(action_type: str, etag: str):
+    """Notify policy subscribers of a changed policy"""
+    redis_client.publish(POLICY_CHANNEL, json.dumps({
+        "version": policy_version,
+        "action_type": action_type,
+        "etag": etag
+    }))
+
+def load_shared_policies(force: bool = False) -> bool:
+    """Adopt the shared rule set if it is newer than this worker's; returns whether it changed"""
+    global policy_version
+    with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hgetall(POLICY_RULES_KEY)
+        pipe.get(POLICY_VERSION_KEY)
+        stored, version = pipe.execute()
+    version = int(version or 0)
+    if not stored or (version <= policy_version and not force):
+        return False
+    rule_set = {action_type: json.loads(rules) for action_type, rules in stored.items()}
+    rule_engine.load(rule_set)
+    POLICY_RULES.clear()
+    POLICY_RULES.update(rule_set)
+    policy_version = max(version, 1)
+    return True
+
+def seed_shared_policies():
+    """Publish the built-in rules as the shared set unless one already exists, then adopt it"""
+    with redis_client.pipeline(transaction=True) as pipe:
+        for action_type, rules in POLICY_RULES.items():
+            pipe.hsetnx(POLICY_RULES_KEY, action_type, json.dumps(rules))
+        pipe.setnx(POLICY_VERSION_KEY, policy_version)
+        pipe.execute()
+    load_shared_policies(force=True)
+
+def store_policy_rules(rule_set: Dict[str, Dict[str, Any]], removed: List[str] = ()) -> int:
+    """Write rules to the shared set and bump its version; returns the new version"""
+    with redis_client.pipeline(transaction=True) as pipe:
+        pipe.hset(POLICY_RULES_KEY, mapping={
+            action_type: json.dumps(rules) for action_type, rules in rule_set.items()
+        })
+        if removed:
+            pipe.hdel(POLICY_RULES_KEY, *removed)
+        pipe.incr(POLICY_VERSION_KEY)
+        return pipe.execute()[-1]
+
+async def follow_policy_changes():
+    """Adopt rule changes made through any worker or replica"""
+    while True:
+        client = aioredis.from_url(REDIS_URL, decode_responses=True)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(POLICY_CHANNEL)
+            # Catch up on anything missed while (re)subscribing
+            await asyncio.to_thread(load_shared_policies)
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=15.0)
+                if message is None:
+                    continue
+                if json.loads(message["data"]).get("version", 0) > policy_version:
+                    if await asyncio.to_thread(load_shared_policies):
+                        logger.info(f"Adopted shared policy rules version {policy_version}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Policy change subscription failed, retrying: {e}")
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.close()
+            await client.close()
+
+def reload_policy_rules() -> List[str]:
+    """Load POLICY_RULES_FILE, compile it and swap it in; returns the changed action types.
+    A rule set that fails to compile is rejected as a whole and the current one stays live.
+    Reads the file and writes Redis, so call it through asyncio.to_thread."""
+    with policy_reload_lock:
+        return _reload_policy_rules()
+
+def _reload_policy_rules() -> List[str]:
+    global policy_version, policy_rules_mtime
+    mtime = os.path.getmtime(POLICY_RULES_FILE)
+    with open(POLICY_RULES_FILE) as f:
+        rule_set = json.load(f)
+    if "unknown" not in rule_set:
+        rule_set["unknown"] = POLICY_RULES["unknown"]
+    rule_engine.load(rule_set)
+    policy_rules_mtime = mtime
+    
+    changed = [
+        action_type for action_type in set(POLICY_RULES) | set(rule_set)
+        if POLICY_RULES.get(action_type) != rule_set.get(action_type)
+    ]
+    if not changed:
+        return []
+    try:
+        policy_version = store_policy_rules(rule_set, [action_type for action_type in POLICY_RULES if action_type not in rule_set])
+    except redis.RedisError:
+        rule_engine.load(POLICY_RULES)
+        raise
+    POLICY_RULES.clear()
+    POLICY_RULES.update(rule_set)
+    for action_type in changed:
+        publish_policy_change(action_type, build_policy(action_type).etag)
+    logger.info(f"Reloaded policy rules from {POLICY_RULES_FILE}: {len(changed)} changed, version {policy_version}")
+    return changed
+
+async def watch_policy_rules():
+    """Hot-reload POLICY_RULES_FILE when it changes on disk"""
+    while True:
+        await asyncio.sleep(POLICY_RELOAD_INTERVAL)
+        try:
+            if await asyncio.to_thread(os.path.getmtime, POLICY_RULES_FILE) != policy_rules_mtime:
+                await asyncio.to_thread(reload_policy_rules)
+        except (OSError, ValueError, redis.RedisError) as e:
+            logger.error(f"Policy rules reload failed, keeping version {policy_version}: {e}")
+
+async def generate_txid(hash: str, metadata: Dict) -> str:
     """Generate a mock transaction ID"""
-    data = f"{hash}{json.dumps(metadata, sort_keys=True)}{datetime.utcnow().isoformat()}"
-    return f"qubic_tx_{hashlib.sha256(data.encode()).hexdigest()[:32]}"
+    metadata_json = await executor.dumps_async(metadata, sort_keys=True)
+    data = f"{hash}{metadata_json}{datetime.utcnow().isoformat()}"
+    digest = await executor.sha256_hex_async(data.encode())
+    return f"qubic_tx_{digest[:32]}"
+
+def load_hash_filter() -> HashFilter:
+    """Restore the Bloom filter snapshot, or rebuild it from stored hashes"""
+    bloom = ScalableBloomFilter.load(redis_binary_client)
+    if bloom is None:
+        logger.info("No Bloom filter snapshot, rebuilding from stored hashes")
+        bloom = ScalableBloomFilter(BLOOM_CAPACITY, BLOOM_ERROR_RATE)
+        bloom.height = ledger.head_height()
+        bloom.add_many(ledger.iter_hashes())
+    return HashFilter(bloom)
+
+def sync_hash_filter():
+    """Apply blocks committed since the filter's covered height"""
+    head = ledger.head_height()
+    while hash_filter.bloom.height < head:
+        block = ledger.get_block(hash_filter.bloom.height + 1)
+        if block is None:
+            break
+        hash_filter.apply_block(block["height"], block["hashes"])
+
+async def current_hash_filter() -> Optional[HashFilter]:
+    """The hash filter if it covers the chain head, so a miss means never anchored; None
+    while it has yet to pick up blocks another worker committed"""
+    if hash_filter is None:
+        return None
+    head = ledger.head_height() if ledger.log is not None else await asyncio.to_thread(ledger.head_height)
+    return hash_filter if hash_filter.covers(head) else None
+
+async def maintain_hash_filter():
+    """Keep the filter in step with blocks from other producers and snapshot it periodically"""
+    last_snapshot = asyncio.get_running_loop().time()
+    while True:
+        await asyncio.sleep(BLOOM_SYNC_INTERVAL)
+        try:
+            await asyncio.to_thread(sync_hash_filter)
+            now = asyncio.get_running_loop().time()
+            if now - last_snapshot >= BLOOM_SNAPSHOT_INTERVAL:
+                # Copied here, where blocks are applied, so the thread writes a consistent state
+                snapshot = hash_filter.bloom.snapshot()
+                await asyncio.to_thread(hash_filter.bloom.write_snapshot, redis_binary_client, snapshot)
+                last_snapshot = now
+        except Exception as e:
+            logger.error(f"Bloom filter maintenance failed: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    """Load shared policy rules, replay the block log, load the hash filter and start the block producer"""
+    global hash_filter, bloom_task, policy_reload_task, policy_follow_task
+    try:
+        await asyncio.to_thread(seed_shared_policies)
+    except redis.RedisError as e:
+        logger.error(f"Shared policy rules unavailable, serving built-in rules: {e}")
+    policy_follow_task = asyncio.create_task(follow_policy_changes())
+    if POLICY_RULES_FILE:
+        try:
+            await asyncio.to_thread(reload_policy_rules)
+        except (OSError, ValueError, redis.RedisError) as e:
+            logger.error(f"Policy rules file rejected, serving built-in rules: {e}")
+        policy_reload_task = asyncio.create_task(watch_policy_rules())
+    await asyncio.to_thread(ledger.open)
+    if BLOOM_ENABLED:
+        try:
+            hash_filter = await asyncio.to_thread(load_hash_filter)
+            await asyncio.to_thread(sync_hash_filter)
+            ledger.add_commit_listener(hash_filter.apply_block)
+            bloom_task = asyncio.create_task(maintain_hash_filter())
+            logger.info(f"Bloom filter ready with {hash_filter.bloom.count} hashes")
+        except Exception as e:
+            hash_filter = None
+            logger.error(f"Bloom filter unavailable, verifying against the store only: {e}")
+    ledger.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Commit pending writes, snapshot the hash filter and release hashing executor pools"""
+    await ledger.stop()
+    await asyncio.to_thread(ledger.close)
+    if policy_reload_task is not None:
+        policy_reload_task.cancel()
+    if policy_follow_task is not None:
+        policy_follow_task.cancel()
+    if bloom_task is not None:
+        bloom_task.cancel()
+    if hash_filter is not None:
+        try:
+            snapshot = hash_filter.bloom.snapshot()
+            await asyncio.to_thread(hash_filter.bloom.write_snapshot, redis_binary_client, snapshot)
+        except Exception as e:
+            logger.error(f"Bloom filter snapshot failed: {e}")
+    executor.shutdown()
 
 @app.get("/health")
 async def health_check():
@@ -92,67 +471,221 @@ async def health_check():
         return {"status": "unhealthy", "error": str(e)}, 503
 
 @app.get("/policy", response_model=PolicyResponse)
-async def get_policy(action_type: str = Query(..., description="Action type to check")):
+async def get_policy(
+    request: Request,
+    response: Response,
+    action_type: str = Query(..., description="Action type to check")
+):
     """Get policy for an action type"""
     logger.info(f"Checking policy for action type: {action_type}")
     
-    # Get policy rules
-    policy = POLICY_RULES.get(action_type, POLICY_RULES["unknown"])
+    policy = build_policy(action_type)
     
-    policy_id = f"policy_{action_type}_{hashlib.md5(action_type.encode()).hexdigest()[:8]}"
+    # Conditional request: client already holds this exact policy
+    if request.headers.get("if-none-match") == policy.etag:
+        return Response(status_code=304, headers={"ETag": policy.etag, "X-Policy-Version": str(policy_version)})
     
-    return PolicyResponse(
-        policy_id=policy_id,
-        action_type=action_type,
-        allowed=policy["allowed"],
-        requires_approval=policy["requires_approval"],
-        rules=policy
+    response.headers["ETag"] = policy.etag
+    response.headers["X-Policy-Version"] = str(policy_version)
+    return policy
+
+def require_policy_admin(x_policy_admin_token: Optional[str] = Header(None)):
+    """Policy writes need POLICY_ADMIN_TOKEN in X-Policy-Admin-Token, and are refused
+    when no token is configured"""
+    if not POLICY_ADMIN_TOKEN or not hmac.compare_digest(x_policy_admin_token or "", POLICY_ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid policy admin token")
+
+@app.put("/policy/{action_type}", response_model=PolicyResponse, dependencies=[Depends(require_policy_admin)])
+async def update_policy(action_type: str, request: PolicyUpdateRequest):
+    """Create or replace the policy for an action type and notify subscribers"""
+    global policy_version
+    
+    rules = request.model_dump(exclude_none=True)
+    
+    # Compile before accepting so a bad rule never reaches the live set
+    try:
+        rule_engine.update(action_type, rules)
+    except (RuleError, TypeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    
+    try:
+        policy_version = store_policy_rules({action_type: rules})
+    except redis.RedisError as e:
+        rule_engine.load(POLICY_RULES)
+        raise HTTPException(status_code=503, detail=f"Policy store unavailable: {e}")
+    POLICY_RULES[action_type] = rules
+    policy = build_policy(action_type)
+    logger.info(f"Policy {action_type} updated to version {policy_version}")
+    
+    publish_policy_change(action_type, policy.etag)
+    
+    return policy
+
+@app.post("/policy/reload", dependencies=[Depends(require_policy_admin)])
+async def reload_policies():
+    """Reload and recompile POLICY_RULES_FILE now"""
+    if not POLICY_RULES_FILE:
+        raise HTTPException(status_code=400, detail="POLICY_RULES_FILE is not configured")
+    try:
+        changed = await asyncio.to_thread(reload_policy_rules)
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Policy rules rejected: {e}")
+    except redis.RedisError as e:
+        raise HTTPException(status_code=503, detail=f"Policy store unavailable: {e}")
+    return {"version": policy_version, "changed": changed}
+
+def evaluate_policy(item: PolicyEvaluateRequest) -> PolicyDecision:
+    result = rule_engine.evaluate(item.action_type, item.parameters, user_id=item.user_id, record=item.record)
+    return PolicyDecision(policy_id=policy_id_for(item.action_type), version=policy_version, **result)
+
+@app.post("/policy/evaluate", response_model=PolicyDecision)
+async def evaluate(request: PolicyEvaluateRequest):
+    """Evaluate step parameters against the compiled policy for an action type"""
+    return evaluate_policy(request)
+
+@app.post("/policy/evaluate:batch", response_model=BatchEvaluateResponse)
+async def evaluate_batch(request: BatchEvaluateRequest):
+    """Evaluate many requests against the compiled policies in one call"""
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_ITEMS} items")
+    return BatchEvaluateResponse(
+        version=policy_version,
+        results=[evaluate_policy(item) for item in request.items]
     )
 
+@app.get("/policy/changes")
+async def policy_changes():
+    """Server-sent event stream of policy changes"""
+    async def event_stream():
+        client = aioredis.from_url(REDIS_URL, decode_responses=True)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(POLICY_CHANNEL)
+        try:
+            yield f"event: hello\ndata: {json.dumps({'version': policy_version})}\n\n"
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=15.0)
+                if message is None:
+                    # Keep-alive comment so proxies do not drop idle streams
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: policy\ndata: {message['data']}\n\n"
+        except asyncio.CancelledError:
+            pass
+        finally:
+            await pubsub.unsubscribe(POLICY_CHANNEL)
+            await pubsub.close()
+            await client.close()
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/write", response_model=WriteResponse)
 async def write_hash(request: WriteRequest):
     """Write hash to Qubic (mock blockchain)"""
     logger.info(f"Writing hash to Qubic: {request.hash[:16]}...")
     
     # Generate transaction ID
-    txid = generate_txid(request.hash, request.metadata)
-    timestamp = datetime.utcnow().isoformat()
-    
-    # Store in Redis (simulating immutable blockchain storage)
-    qubic_key = f"qubic:hash:{request.hash}"
-    qubic_data = {
-        "hash": request.hash,
-        "txid": txid,
-        "metadata": json.dumps(request.metadata),
-        "timestamp": timestamp,
-        "block_height": int(datetime.utcnow().timestamp())  # Mock block height
-    }
-    redis_client.hset(qubic_key, mapping=qubic_data)
+    txid = await generate_txid(request.hash, request.metadata)
     
-    # Also store by txid for lookup
-    tx_key = f"qubic:tx:{txid}"
-    redis_client.hset(tx_key, mapping={
-        "hash": request.hash,
-        "timestamp": timestamp
-    })
+    # Queue for the next block; returns once the block is committed
+    metadata_json = await executor.dumps_async(request.metadata)
+    with tracing.span("ledger.submit"):
+        receipt = await ledger.submit(request.hash, txid, metadata_json)
     
-    logger.info(f"Hash written to Qubic with txid: {txid}")
+    logger.info(f"Hash written to Qubic with txid: {txid} in block {receipt['block_height']}")
     
     return WriteResponse(
         txid=txid,
         hash=request.hash,
-        timestamp=timestamp
+        timestamp=receipt["timestamp"],
+        block_height=receipt["block_height"]
     )
 
+@app.post("/write:batch", response_model=BatchWriteResponse)
+async def write_batch(request: BatchWriteRequest):
+    """Write many hashes to Qubic in one request"""
+    if len(request.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_ITEMS} items")
+    logger.info(f"Writing batch of {len(request.items)} hashes to Qubic")
+    
+    results: List[Optional[BatchWriteItem]] = [None] * len(request.items)
+    writes = []
+    positions = []
+    for index, item in enumerate(request.items):
+        if not item.hash:
+            results[index] = BatchWriteItem(hash=item.hash, status="failed", error="hash is required")
+            continue
+        txid = await generate_txid(item.hash, item.metadata)
+        writes.append((item.hash, txid, await executor.dumps_async(item.metadata)))
+        positions.append(index)
+    
+    with tracing.span("ledger.submit", writes=len(writes)):
+        receipts = await ledger.submit_many(writes) if writes else []
+    for index, (hash, txid, _), receipt in zip(positions, writes, receipts):
+        if isinstance(receipt, Exception):
+            results[index] = BatchWriteItem(hash=hash, status="failed", txid=txid, error=str(receipt))
+        else:
+            results[index] = BatchWriteItem(
+                hash=hash,
+                status="written",
+                txid=txid,
+                timestamp=receipt["timestamp"],
+                block_height=receipt["block_height"]
+            )
+    
+    written = sum(1 for result in results if result.status == "written")
+    return BatchWriteResponse(written=written, failed=len(results) - written, results=results)
+
+@app.post("/verify:batch", response_model=BatchVerifyResponse)
+async def verify_batch(request: BatchVerifyRequest):
+    """Verify many hashes in one request"""
+    if len(request.hashes) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_ITEMS} items")
+    logger.info(f"Verifying batch of {len(request.hashes)} hashes")
+    
+    # Only hashes the filter cannot rule out go to the store
+    bloom = await current_hash_filter()
+    if bloom is not None:
+        candidates = [hash for hash in request.hashes if bloom.might_contain(hash)]
+    else:
+        candidates = request.hashes
+    found = dict(zip(candidates, await asyncio.to_thread(ledger.lookup_hashes, candidates))) if candidates else {}
+    if bloom is not None:
+        for hash in candidates:
+            if not found[hash]:
+                bloom.record_false_positive()
+    records = [found.get(hash, {}) for hash in request.hashes]
+    
+    results = [
+        VerifyResponse(
+            hash=hash,
+            verified=bool(record),
+            txid=record.get("txid"),
+            timestamp=record.get("timestamp")
+        )
+        for hash, record in zip(request.hashes, records)
+    ]
+    
+    verified = sum(1 for result in results if result.verified)
+    return BatchVerifyResponse(verified=verified, missing=len(results) - verified, results=results)
+
 @app.get("/verify/{hash}", response_model=VerifyResponse)
 async def verify_hash(hash: str):
     """Verify hash exists in Qubic"""
     logger.info(f"Verifying hash: {hash[:16]}...")
     
-    qubic_key = f"qubic:hash:{hash}"
-    qubic_data = redis_client.hgetall(qubic_key)
+    # Definite negative: never anchored
+    bloom = await current_hash_filter()
+    if bloom is not None and not bloom.might_contain(hash):
+        return VerifyResponse(
+            hash=hash,
+            verified=False
+        )
+    
+    qubic_data = await asyncio.to_thread(ledger.lookup_hash, hash)
     
     if not qubic_data:
+        if bloom is not None:
+            bloom.record_false_positive()
         return VerifyResponse(
             hash=hash,
             verified=False
@@ -168,42 +701,81 @@ async def verify_hash(hash: str):
 @app.get("/tx/{txid}")
 async def get_transaction(txid: str):
     """Get transaction details by txid"""
-    tx_key = f"qubic:tx:{txid}"
-    tx_data = redis_client.hgetall(tx_key)
+    tx_data = await asyncio.to_thread(ledger.lookup_tx, txid)
     
     if not tx_data:
         raise HTTPException(status_code=404, detail="Transaction not found")
     
-    # Get full hash data
-    hash = tx_data.get("hash")
-    qubic_key = f"qubic:hash:{hash}"
-    hash_data = redis_client.hgetall(qubic_key)
-    
     return {
         "txid": txid,
-        "hash": hash,
-        "timestamp": hash_data.get("timestamp"),
-        "metadata": json.loads(hash_data.get("metadata", "{}")),
-        "block_height": hash_data.get("block_height")
+        "hash": tx_data.get("hash"),
+        "timestamp": tx_data.get("timestamp"),
+        "metadata": json.loads(tx_data.get("metadata", "{}")),
+        "block_height": int(tx_data["block_height"]) if tx_data.get("block_height") is not None else None
     }
 
+# Committed blocks and proofs never change
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.get("/block/{height}")
+async def get_block(height: int, response: Response):
+    """Get a block header and the hashes it contains"""
+    block = await asyncio.to_thread(ledger.get_block, height)
+    if not block:
+        raise HTTPException(status_code=404, detail="Block not found")
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return block
+
+@app.get("/proof/{hash}")
+async def get_proof(hash: str, response: Response):
+    """Merkle inclusion proof of a hash against its block header"""
+    bloom = await current_hash_filter()
+    if bloom is not None and not bloom.might_contain(hash):
+        raise HTTPException(status_code=404, detail="Hash not anchored")
+    
+    proof = await asyncio.to_thread(ledger.get_proof, hash)
+    if not proof:
+        raise HTTPException(status_code=404, detail="No proof available for hash")
+    
+    response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    response.headers["ETag"] = f'"{proof["block_hash"][:16]}-{proof["position"]}"'
+    return proof
+
+@app.get("/chain")
+async def get_chain():
+    """Chain head, block producer and hash filter statistics"""
+    stats = ledger.stats()
+    stats["bloom"] = hash_filter.stats() if hash_filter is not None else None
+    return stats
+
 @app.get("/policies")
-async def list_policies():
-    """List all policy rules"""
+async def list_policies(
+    action_types: Optional[str] = Query(None, description="Comma-separated action types to resolve")
+):
+    """List policy rules, or resolve a set of action types in one call"""
+    if action_types:
+        requested = [a.strip() for a in action_types.split(",") if a.strip()]
+    else:
+        requested = list(POLICY_RULES.keys())
+    
     policies = []
-    for action_type, rules in POLICY_RULES.items():
-        policy_id = f"policy_{action_type}_{hashlib.md5(action_type.encode()).hexdigest()[:8]}"
-        policies.append({
-            "policy_id": policy_id,
-            "action_type": action_type,
-            "allowed": rules["allowed"],
-            "requires_approval": rules["requires_approval"],
-            "risk_level": rules.get("risk_level", "unknown")
-        })
-    return {"policies": policies}
+    for action_type in requested:
+        policy = build_policy(action_type)
+        entry = policy.model_dump()
+        entry["risk_level"] = policy.rules.get("risk_level", "unknown")
+        policies.append(entry)
+    return {"version": policy_version, "policies": policies}
+
+serve.install(app, "qubic-service")
+tracing.install(app, "qubic-service")
+metrics.install(app, "qubic-service")
+profiling.install(app, "qubic-service")
+deadlines.install(app, "qubic-service")
+wire.install(app)
 
 if __name__ == "__main__":
-    import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # The block log and in-process velocity windows belong to a single process
+    single_process = bool(LEDGER_LOG_DIR) or POLICY_VELOCITY_MODE != "redis"
+    serve.run(app, port=port, max_workers=1 if single_process else None)
 
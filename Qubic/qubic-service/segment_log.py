@@ -0,0 +1,360 @@
+"""
+Segment Log
+Durable append-only block log: rolling segment files, offset indexes, batched fsync
+"""
+
+import os
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Record: length and CRC32 of the payload, then the payload
+RECORD_HEADER = struct.Struct("<II")
+# Per-segment index entry: block height, record offset in the segment
+INDEX_ENTRY = struct.Struct("<QQ")
+# Compacted index entry: block height, segment base height, record offset
+COMPACT_ENTRY = struct.Struct("<QQQ")
+
+COMPACT_INDEX_NAME = "index.compact"
+LOCK_NAME = "LOCK"
+
+class Segment:
+    """One segment file plus its index; the base height is the first block it holds"""
+
+    def __init__(self, directory: str, base_height: int):
+        self.base_height = base_height
+        self.log_path = os.path.join(directory, f"{base_height:020d}.log")
+        self.idx_path = os.path.join(directory, f"{base_height:020d}.idx")
+        self.size = 0
+        self.sealed = False
+        self._mmap: Optional[mmap.mmap] = None
+
+    def open_for_read(self):
+        """Map a sealed segment into memory"""
+        if self._mmap is None and self.size > 0:
+            with open(self.log_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def read_at(self, offset: int) -> bytes:
+        if self._mmap is not None:
+            header = self._mmap[offset:offset + RECORD_HEADER.size]
+            length, crc = RECORD_HEADER.unpack(header)
+            start = offset + RECORD_HEADER.size
+            payload = self._mmap[start:start + length]
+        else:
+            # Active segment: still growing, so read it with pread rather than a mapping
+            fd = os.open(self.log_path, os.O_RDONLY)
+            try:
+                length, crc = RECORD_HEADER.unpack(os.pread(fd, RECORD_HEADER.size, offset))
+                payload = os.pread(fd, length, offset + RECORD_HEADER.size)
+            finally:
+                os.close(fd)
+        if zlib.crc32(payload) != crc:
+            raise IOError(f"Corrupt record at {self.log_path}:{offset}")
+        return payload
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+def scan_records(path: str, start: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """Yield (offset, payload) for every intact record, stopping at a torn or corrupt tail"""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            offset = start
+            while offset + RECORD_HEADER.size <= size:
+                length, crc = RECORD_HEADER.unpack(mm[offset:offset + RECORD_HEADER.size])
+                end = offset + RECORD_HEADER.size + length
+                if end > size:
+                    return
+                payload = mm[offset + RECORD_HEADER.size:end]
+                if zlib.crc32(payload) != crc:
+                    return
+                yield offset, payload
+                offset = end
+
+class SegmentLog:
+    """Append-only log of block records with contiguous heights.
+
+    The log files are the source of truth; index files only speed up opening and are
+    rebuilt from the log when missing or behind. fsync_interval_ms=0 syncs every append
+    before it returns, otherwise a background thread syncs dirty data on that interval."""
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024,
+                 fsync_interval_ms: float = 0.0, compact_after: int = 8):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval_ms = fsync_interval_ms
+        self.compact_after = compact_after
+        self.segments: List[Segment] = []
+        self.first_height: Optional[int] = None
+        self.last_height: Optional[int] = None
+        self._locations: List[Tuple[Segment, int]] = []  # indexed by height - first_height
+        self._active_fd: Optional[int] = None
+        self._active_idx_fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._flusher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.fsyncs = 0
+
+    # Opening and recovery
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock_fd = os.open(os.path.join(self.directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise RuntimeError(f"Segment log {self.directory} is owned by another process")
+
+        bases = sorted(
+            int(name[:-4]) for name in os.listdir(self.directory) if name.endswith(".log")
+        )
+        compacted = self._read_compact_index()
+        for position, base in enumerate(bases):
+            segment = Segment(self.directory, base)
+            segment.size = os.path.getsize(segment.log_path)
+            is_last = position == len(bases) - 1
+            entries = compacted.get(base)
+            if entries is None:
+                entries = self._read_segment_index(segment)
+            if is_last:
+                entries = self._recover_tail(segment, entries)
+            else:
+                segment.sealed = True
+                segment.open_for_read()
+            for height, offset in entries:
+                self._track(height, segment, offset)
+            self.segments.append(segment)
+
+        if not self.segments:
+            self.segments.append(Segment(self.directory, 1))
+        self._open_active()
+
+        if self.fsync_interval_ms > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="segment-log-fsync", daemon=True)
+            self._flusher.start()
+        logger.info(f"Opened segment log with {len(self.segments)} segments, heights {self.first_height}..{self.last_height}")
+
+    def _read_compact_index(self) -> Dict[int, List[Tuple[int, int]]]:
+        path = os.path.join(self.directory, COMPACT_INDEX_NAME)
+        entries: Dict[int, List[Tuple[int, int]]] = {}
+        if not os.path.exists(path):
+            return entries
+        with open(path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % COMPACT_ENTRY.size
+        for height, base, offset in COMPACT_ENTRY.iter_unpack(data[:usable]):
+            entries.setdefault(base, []).append((height, offset))
+        return entries
+
+    def _read_segment_index(self, segment: Segment) -> List[Tuple[int, int]]:
+        if not os.path.exists(segment.idx_path):
+            return self._rebuild_index(segment)
+        with open(segment.idx_path, "rb") as f:
+            data = f.read()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        entries = list(INDEX_ENTRY.iter_unpack(data[:usable]))
+        return entries if entries else self._rebuild_index(segment)
+
+    def _rebuild_index(self, segment: Segment) -> List[Tuple[int, int]]:
+        """Recreate a segment's index from its records"""
+        entries = []
+        height = segment.base_height
+        for offset, _ in scan_records(segment.log_path):
+            entries.append((height, offset))
+            height += 1
+        with open(segment.idx_path, "wb") as f:
+            for entry in entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+        return entries
+
+    def _recover_tail(self, segment: Segment, entries: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Bring the active segment's index up to the log and cut any torn tail record"""
+        # Drop index entries pointing past the log (index written, log record lost)
+        entries = [entry for entry in entries if entry[1] < segment.size]
+        resume = 0
+        height = segment.base_height
+        if entries:
+            # Rescan from the last indexed record so it is re-validated too
+            height, resume = entries.pop()
+        valid_end = resume
+        for offset, payload in scan_records(segment.log_path, resume):
+            entries.append((height, offset))
+            height += 1
+            valid_end = offset + RECORD_HEADER.size + len(payload)
+        if valid_end < segment.size:
+            logger.warning(f"Truncating torn tail of {segment.log_path} at {valid_end} ({segment.size - valid_end} bytes)")
+            with open(segment.log_path, "r+b") as f:
+                f.truncate(valid_end)
+            segment.size = valid_end
+        with open(segment.idx_path, "wb") as f:
+            for entry in entries:
+                f.write(INDEX_ENTRY.pack(*entry))
+        return entries
+
+    def _track(self, height: int, segment: Segment, offset: int):
+        if self.first_height is None:
+            self.first_height = height
+        self._locations.append((segment, offset))
+        self.last_height = height
+
+    def _open_active(self):
+        active = self.segments[-1]
+        self._active_fd = os.open(active.log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._active_idx_fd = os.open(active.idx_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    # Writing
+
+    def append(self, height: int, payload: bytes) -> int:
+        """Append the record for block `height`; heights must be contiguous"""
+        with self._lock:
+            if self.last_height is not None and height != self.last_height + 1:
+                raise ValueError(f"Expected block {self.last_height + 1}, got {height}")
+            active = self.segments[-1]
+            if active.size >= self.segment_bytes and active.size > 0:
+                active = self._roll(height)
+            elif active.size == 0 and self.last_height is None and active.base_height != height:
+                # Empty log: name the first segment after the first block it will hold
+                os.close(self._active_fd)
+                os.close(self._active_idx_fd)
+                for path in (active.log_path, active.idx_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                active = Segment(self.directory, height)
+                self.segments[-1] = active
+                self._open_active()
+
+            offset = active.size
+            record = RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+            os.write(self._active_fd, record)
+            os.write(self._active_idx_fd, INDEX_ENTRY.pack(height, offset))
+            active.size += len(record)
+            self._track(height, active, offset)
+
+            if self.fsync_interval_ms <= 0:
+                self._fsync()
+            else:
+                self._dirty = True
+            return offset
+
+    def _fsync(self):
+        os.fsync(self._active_fd)
+        os.fsync(self._active_idx_fd)
+        self._dirty = False
+        self.fsyncs += 1
+
+    def sync(self):
+        with self._lock:
+            if self._dirty and self._active_fd is not None:
+                self._fsync()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.fsync_interval_ms / 1000):
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Segment log fsync failed: {e}")
+
+    def _roll(self, next_height: int) -> Segment:
+        """Seal the active segment and start a new one at next_height"""
+        active = self.segments[-1]
+        self._fsync()
+        os.close(self._active_fd)
+        os.close(self._active_idx_fd)
+        active.sealed = True
+        active.open_for_read()
+
+        segment = Segment(self.directory, next_height)
+        self.segments.append(segment)
+        self._open_active()
+
+        sealed_indexes = [s for s in self.segments if s.sealed and os.path.exists(s.idx_path)]
+        if len(sealed_indexes) >= self.compact_after:
+            self.compact_indexes()
+        return segment
+
+    def compact_indexes(self):
+        """Merge sealed segments' index files into one compacted index, written atomically"""
+        with self._lock:
+            sealed = {s.base_height for s in self.segments if s.sealed}
+            path = os.path.join(self.directory, COMPACT_INDEX_NAME)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                for index, (segment, offset) in enumerate(self._locations):
+                    if segment.base_height in sealed:
+                        f.write(COMPACT_ENTRY.pack(self.first_height + index, segment.base_height, offset))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            for segment in self.segments:
+                if segment.sealed and os.path.exists(segment.idx_path):
+                    os.remove(segment.idx_path)
+            logger.info(f"Compacted indexes of {len(sealed)} sealed segments")
+
+    # Reading
+
+    def read(self, height: int) -> Optional[bytes]:
+        if self.first_height is None or height < self.first_height or height > self.last_height:
+            return None
+        segment, offset = self._locations[height - self.first_height]
+        return segment.read_at(offset)
+
+    def replay(self, from_height: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+        """Sequentially yield (height, payload) from from_height to the end of the log"""
+        if self.first_height is None:
+            return
+        height = max(from_height or self.first_height, self.first_height)
+        while height <= self.last_height:
+            segment, offset = self._locations[height - self.first_height]
+            for record_offset, payload in scan_records(segment.log_path, offset):
+                yield height, payload
+                height += 1
+                if height > self.last_height:
+                    return
+
+    def close(self):
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        with self._lock:
+            if self._active_fd is not None:
+                self._fsync()
+                os.close(self._active_fd)
+                os.close(self._active_idx_fd)
+                self._active_fd = None
+                self._active_idx_fd = None
+            for segment in self.segments:
+                segment.close()
+            if self._lock_fd is not None:
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "directory": self.directory,
+            "segments": len(self.segments),
+            "first_height": self.first_height,
+            "last_height": self.last_height,
+            "active_segment_bytes": self.segments[-1].size if self.segments else 0,
+            "segment_bytes": self.segment_bytes,
+            "fsync_interval_ms": self.fsync_interval_ms,
+            "fsyncs": self.fsyncs
+        }
@@ -0,0 +1,52 @@
+"""
+Bloom tests
+The hash filter must never answer "absent" for an anchored hash
+"""
+
+import fakeredis
+from bloom import HashFilter, ScalableBloomFilter
+from ledger import sha256_hex
+
+def hashes(start: int, count: int):
+    return [sha256_hex(f"hash-{i}") for i in range(start, start + count)]
+
+def test_no_false_negatives_as_slices_grow():
+    bloom = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+    added = hashes(0, 2000)
+    bloom.add_many(added)
+    assert len(bloom.slices) > 1
+    assert all(hash in bloom for hash in added)
+
+    # And false positives stay near the configured rate
+    absent = hashes(10000, 5000)
+    false_positives = sum(hash in bloom for hash in absent)
+    assert false_positives / len(absent) < 4 * bloom.error_rate
+
+def test_no_false_negatives_after_snapshot_restore():
+    client = fakeredis.FakeRedis()
+    bloom = ScalableBloomFilter(initial_capacity=50, error_rate=0.01)
+    added = hashes(0, 300)
+    bloom.add_many(added)
+    bloom.height = 7
+    snapshot = bloom.snapshot()
+    # Changes after the snapshot is taken do not leak into what is written
+    bloom.add_many(hashes(300, 100))
+    ScalableBloomFilter.write_snapshot(client, snapshot)
+
+    restored = ScalableBloomFilter.load(client)
+    assert restored.height == 7
+    assert restored.count == 300
+    assert all(hash in restored for hash in added)
+
+def test_filter_defers_to_store_until_it_covers_the_head():
+    hash_filter = HashFilter(ScalableBloomFilter(initial_capacity=100))
+    hash_filter.apply_block(1, hashes(0, 10))
+    # Block 2 was committed by another worker and not applied yet; block 3 arrives first
+    hash_filter.apply_block(3, hashes(20, 10))
+    assert hash_filter.bloom.height == 1
+    assert not hash_filter.covers(3)
+
+    hash_filter.apply_block(2, hashes(10, 10))
+    assert hash_filter.bloom.height == 2
+    assert hash_filter.covers(2)
+    assert all(hash_filter.might_contain(hash) for hash in hashes(0, 30))
@@ -0,0 +1,87 @@
+"""
+Ledger tests
+Merkle inclusion proofs, standalone and against committed blocks
+"""
+
+import asyncio
+import threading
+import pytest
+from ledger import LedgerEngine, header_hash, merkle_levels, merkle_path, merkle_root, sha256_hex, verify_merkle_path
+from segment_log import SegmentLog
+
+def leaves(count: int):
+    return [sha256_hex(f"leaf-{i}") for i in range(count)]
+
+@pytest.mark.parametrize("count", [1, 2, 3, 5, 6, 7, 11, 16, 17])
+def test_every_leaf_proves_against_root(count):
+    # 5, 6, 7, 11 and 17 leave odd levels above the leaves, where the last node pairs with itself
+    hashes = leaves(count)
+    levels = merkle_levels(hashes)
+    root = merkle_root(hashes)
+    for position, leaf in enumerate(hashes):
+        path = merkle_path(levels, position)
+        assert len(path) == len(levels) - 1
+        assert verify_merkle_path(leaf, path, root)
+
+def test_proof_rejects_other_leaf_and_tampered_path():
+    hashes = leaves(7)
+    levels = merkle_levels(hashes)
+    root = merkle_root(hashes)
+    path = merkle_path(levels, 6)
+    assert not verify_merkle_path(hashes[5], path, root)
+
+    tampered = [dict(step) for step in path]
+    tampered[1]["hash"] = sha256_hex("forged")
+    assert not verify_merkle_path(hashes[6], tampered, root)
+
+    flipped = [dict(step, side="left" if step["side"] == "right" else "right") for step in path]
+    assert not verify_merkle_path(hashes[6], flipped, root)
+
+def test_get_proof_verifies_against_block_header(tmp_path):
+    hashes = leaves(5)
+
+    async def commit(engine: LedgerEngine):
+        engine.start()
+        await engine.submit_many([(h, f"tx-{i}", "{}") for i, h in enumerate(hashes)])
+        await engine.stop()
+
+    engine = LedgerEngine(None, max_block_size=10, log=SegmentLog(str(tmp_path)))
+    engine.open()
+    asyncio.run(commit(engine))
+    for hash in hashes:
+        proof = engine.get_proof(hash)
+        assert verify_merkle_path(hash, proof["path"], proof["header"]["tx_root"])
+        assert header_hash(proof["header"]) == proof["block_hash"]
+    assert engine.get_proof(sha256_hex("never anchored")) is None
+    engine.close()
+
+def test_stop_resolves_the_block_in_flight(tmp_path):
+    engine = LedgerEngine(None, block_interval_ms=1, max_block_size=2, log=SegmentLog(str(tmp_path)))
+    engine.open()
+    commit_block = engine._commit_block
+    committing = threading.Event()
+    release = threading.Event()
+
+    def slow_commit_block(batch):
+        committing.set()
+        release.wait(5)
+        return commit_block(batch)
+
+    engine._commit_block = slow_commit_block
+    hashes = leaves(5)
+
+    async def run():
+        engine.start()
+        writes = asyncio.ensure_future(engine.submit_many([(h, f"tx-{i}", "{}") for i, h in enumerate(hashes)]))
+        await asyncio.to_thread(committing.wait, 5)
+        # Stop while the first block is still being written
+        stopping = asyncio.ensure_future(engine.stop())
+        await asyncio.sleep(0.01)
+        release.set()
+        await asyncio.wait_for(stopping, 5)
+        return await asyncio.wait_for(writes, 1)
+
+    receipts = asyncio.run(run())
+    assert [receipt["block_height"] for receipt in receipts] == [1, 1, 2, 2, 3]
+    assert engine.pending_writes == 0
+    engine.close()
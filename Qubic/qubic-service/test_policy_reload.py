@@ -0,0 +1,68 @@
+"""
+Policy admin tests
+Policy writes need the admin token; POLICY_RULES_FILE reloads leave the live rules alone on a bad file
+"""
+
+import asyncio
+import copy
+import json
+import fakeredis
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+from rule_engine import RuleEngine
+
+@pytest.fixture
+def qubic(service, monkeypatch, tmp_path):
+    monkeypatch.setattr(service, "redis_client", fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(service, "POLICY_RULES", copy.deepcopy(service.POLICY_RULES))
+    monkeypatch.setattr(service, "POLICY_RULES_FILE", str(tmp_path / "rules.json"))
+    monkeypatch.setattr(service, "policy_version", service.policy_version)
+    monkeypatch.setattr(service, "policy_rules_mtime", None)
+    engine = RuleEngine()
+    engine.load(service.POLICY_RULES)
+    monkeypatch.setattr(service, "rule_engine", engine)
+    return service
+
+def write_rules(qubic, rules):
+    with open(qubic.POLICY_RULES_FILE, "w") as f:
+        json.dump(rules, f)
+
+def decision(qubic, amount):
+    return qubic.rule_engine.evaluate("transaction", {"amount": amount})["decision"]
+
+def test_reload_swaps_in_the_file_and_publishes_the_version(qubic):
+    assert decision(qubic, 500) == "allow"
+    write_rules(qubic, {**qubic.POLICY_RULES, "transaction": {"max_amount": 100}})
+
+    result = asyncio.run(qubic.reload_policies())
+    assert result["changed"] == ["transaction"]
+    assert decision(qubic, 500) == "require_approval"
+    assert int(qubic.redis_client.get(qubic.POLICY_VERSION_KEY)) == result["version"]
+
+    # Reloading an unchanged file is a no-op
+    assert asyncio.run(qubic.reload_policies())["changed"] == []
+
+def test_rules_that_do_not_compile_are_rejected_whole(qubic):
+    write_rules(qubic, {"transaction": {"max_amount": 100}, "monitoring": {"time_window": {"start": "noon"}}})
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(qubic.reload_policies())
+    assert error.value.status_code == 422
+    assert decision(qubic, 500) == "allow"
+    assert qubic.redis_client.get(qubic.POLICY_VERSION_KEY) is None
+
+def test_policy_writes_need_the_admin_token(qubic, monkeypatch):
+    client = TestClient(qubic.app)
+    rules = {"allowed": True, "requires_approval": True, "max_amount": 100}
+    # No token configured: policy writes are off
+    assert client.put("/policy/transaction", json=rules).status_code == 403
+
+    monkeypatch.setattr(qubic, "POLICY_ADMIN_TOKEN", "s3cret")
+    assert client.put("/policy/transaction", json=rules).status_code == 403
+    assert client.put("/policy/transaction", json=rules, headers={"X-Policy-Admin-Token": "guess"}).status_code == 403
+    assert client.post("/policy/reload", headers={"X-Policy-Admin-Token": "guess"}).status_code == 403
+    assert decision(qubic, 500) == "allow"
+
+    response = client.put("/policy/transaction", json=rules, headers={"X-Policy-Admin-Token": "s3cret"})
+    assert response.status_code == 200
+    assert decision(qubic, 500) == "require_approval"
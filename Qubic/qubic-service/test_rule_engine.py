@@ -0,0 +1,112 @@
+"""
+Rule engine tests
+Decisions of compiled policies, failing closed on amounts that cannot be checked
+"""
+
+from datetime import datetime
+import pytest
+from rule_engine import RuleEngine, RuleError, compile_expression
+from velocity import LocalVelocityLimiter
+
+RULES = {
+    "transaction": {"allowed": True, "requires_approval": True, "risk_level": "high", "max_amount": 1000.0},
+    "transfer_funds": {
+        "max_amount": 1000.0,
+        "deny_wallets": ["0xBAD"],
+        "velocity": {"max_count": 2, "max_amount": 1500, "window_seconds": 3600}
+    },
+    "office_hours": {"time_window": {"start": "22:00", "end": "06:00"}},
+    "allow_listed": {"allow_wallets": ["0xabc"]},
+    "eur": {"conditions": [{"id": "eur", "when": "currency == 'EUR' and amount > 100", "effect": "deny"}]},
+    "closed": {"allowed": False},
+    "unknown": {"requires_approval": True}
+}
+
+# A Tuesday
+NOON = datetime(2026, 10, 20, 12, 0)
+
+@pytest.fixture
+def engine():
+    engine = RuleEngine(velocity=LocalVelocityLimiter(window_seconds=86400))
+    engine.load(RULES)
+    return engine
+
+def decide(engine, action_type, parameters, user_id=None, **options):
+    return engine.evaluate(action_type, parameters, user_id, now=options.pop("now", NOON), **options)
+
+@pytest.mark.parametrize("amount", [None, "", "5000 ETH", "abc", float("nan"), float("inf"), "-inf", [1]])
+def test_unusable_amount_requires_approval(engine, amount):
+    parameters = {} if amount is None else {"amount": amount}
+    result = decide(engine, "transaction", parameters)
+    assert result["decision"] == "require_approval"
+    assert result["matched"] == ["max_amount"]
+
+@pytest.mark.parametrize("amount", [-5000, "-0.01"])
+def test_negative_amount_is_denied(engine, amount):
+    result = decide(engine, "transaction", {"amount": amount})
+    assert result["decision"] == "deny"
+    assert not result["allowed"]
+
+def test_amount_threshold(engine):
+    assert decide(engine, "transaction", {"amount": "999.5"})["decision"] == "allow"
+    assert decide(engine, "transaction", {"amount": 1000})["decision"] == "allow"
+    assert decide(engine, "transaction", {"amount": 1000.01})["decision"] == "require_approval"
+
+def test_deny_rule_wins_over_approval_rules(engine):
+    result = decide(engine, "transfer_funds", {"amount": 5000, "to_address": "0xbad"})
+    assert result["decision"] == "deny"
+    assert result["matched"] == ["deny_wallets"]
+
+def test_allow_list(engine):
+    assert decide(engine, "allow_listed", {"to_address": "0xABC"})["decision"] == "allow"
+    assert decide(engine, "allow_listed", {"to_address": "0xdef"})["decision"] == "require_approval"
+
+def test_time_window_wrapping_midnight(engine):
+    assert decide(engine, "office_hours", {}, now=datetime(2026, 10, 20, 23, 30))["decision"] == "allow"
+    assert decide(engine, "office_hours", {}, now=datetime(2026, 10, 20, 5, 0))["decision"] == "allow"
+    assert decide(engine, "office_hours", {}, now=NOON)["decision"] == "require_approval"
+
+def test_velocity_counts_recorded_requests(engine):
+    for _ in range(2):
+        assert decide(engine, "transfer_funds", {"amount": 100}, "alice", record=True)["decision"] == "allow"
+    result = decide(engine, "transfer_funds", {"amount": 100}, "alice")
+    assert result["decision"] == "require_approval"
+    assert result["matched"] == ["velocity"]
+    # Other users have their own window
+    assert decide(engine, "transfer_funds", {"amount": 100}, "bob")["decision"] == "allow"
+
+def test_velocity_total_fails_closed_without_amount(engine):
+    result = decide(engine, "transfer_funds", {"amount": "lots"}, "alice")
+    assert set(result["matched"]) == {"max_amount", "velocity"}
+
+def test_denied_request_is_not_recorded(engine):
+    for _ in range(3):
+        decide(engine, "transfer_funds", {"amount": 100, "to_address": "0xbad"}, "alice", record=True)
+    assert decide(engine, "transfer_funds", {"amount": 100}, "alice")["decision"] == "allow"
+
+def test_conditions(engine):
+    assert decide(engine, "eur", {"currency": "EUR", "amount": 500})["decision"] == "deny"
+    assert decide(engine, "eur", {"currency": "USD", "amount": 500})["decision"] == "allow"
+    assert decide(engine, "eur", {"currency": "EUR"})["decision"] == "allow"
+
+def test_static_flags(engine):
+    assert decide(engine, "closed", {"amount": 1})["decision"] == "deny"
+    # No checks to run, so the static flag stands; unknown action types use the unknown policy
+    assert decide(engine, "unknown", {})["decision"] == "require_approval"
+    assert decide(engine, "no_such_action", {})["decision"] == "require_approval"
+
+def test_expressions():
+    predicate = compile_expression("abs(amount) >= 10 and lower(currency) in ['usd', 'eur']")
+    assert predicate({"amount": -12, "currency": "EUR"})
+    assert not predicate({"amount": 5, "currency": "USD"})
+    assert not compile_expression("missing > 3")({})
+    with pytest.raises(RuleError):
+        compile_expression("__import__('os')")
+    with pytest.raises(RuleError):
+        compile_expression("amount >")
+
+def test_rule_set_that_fails_to_compile_keeps_the_live_one(engine):
+    with pytest.raises(RuleError):
+        engine.load({"transaction": {"velocity": {"window_seconds": 60}}})
+    assert decide(engine, "transaction", {"amount": 5000})["decision"] == "require_approval"
+    assert engine.stats()["reloads"] == 1
@@ -0,0 +1,97 @@
+"""
+Token verification benchmark
+Measures the api-gateway's per-request cost of checking a bearer JWT locally: a full signature
+check for each algorithm, and a cache hit for a token seen before
+
+Usage:
+    python scripts/bench_auth.py [--iterations 2000] [--cache-hits 200000]
+
+Needs the gateway's requirements (PyJWT[crypto]); keys are generated and written to a JWKS
+file in a temporary directory, so no identity provider is involved.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api-gateway"))
+
+import jwt  # noqa: E402
+from jwt.algorithms import ECAlgorithm, RSAAlgorithm  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ec, rsa  # noqa: E402
+from auth import KeySet, TokenVerifier  # noqa: E402
+
+ISSUER = "https://idp.example.com/"
+AUDIENCE = "qubic-api"
+
+def signing_keys():
+    """{kid: (algorithm, private key, public JWK)} for each algorithm benchmarked"""
+    rsa_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ec_key = ec.generate_private_key(ec.SECP256R1())
+    keys = {}
+    for kid, algorithm, private, to_jwk in (
+        ("rs256", "RS256", rsa_key, RSAAlgorithm.to_jwk),
+        ("es256", "ES256", ec_key, ECAlgorithm.to_jwk)
+    ):
+        public = json.loads(to_jwk(private.public_key()))
+        public.update({"kid": kid, "use": "sig", "alg": algorithm})
+        keys[kid] = (algorithm, private, public)
+    return keys
+
+def issue(kid: str, algorithm: str, private, subject: str) -> str:
+    now = int(time.time())
+    claims = {"sub": subject, "email": f"{subject}@example.com", "iss": ISSUER, "aud": AUDIENCE,
+              "iat": now, "exp": now + 3600}
+    return jwt.encode(claims, private, algorithm=algorithm, headers={"kid": kid})
+
+async def run(args, keys, jwks_path: str) -> dict:
+    verifier = TokenVerifier(
+        KeySet(path=jwks_path),
+        algorithms=[algorithm for algorithm, _, _ in keys.values()],
+        issuer=ISSUER,
+        audience=AUDIENCE,
+        cache_size=args.cache_size
+    )
+    results = {}
+    for kid, (algorithm, private, _) in keys.items():
+        # A distinct token per iteration, so every call checks a signature
+        tokens = [issue(kid, algorithm, private, f"user{i}") for i in range(args.iterations)]
+        start = time.perf_counter()
+        for token in tokens:
+            await verifier.verify(token)
+        results[f"{algorithm}_verify_us"] = round((time.perf_counter() - start) / len(tokens) * 1e6, 1)
+
+    # The common case: clients reuse a token for its lifetime
+    algorithm, private, _ = next(iter(keys.values()))
+    tokens = [issue(next(iter(keys)), algorithm, private, f"client{i}") for i in range(min(1000, args.cache_size))]
+    for token in tokens:
+        await verifier.claims(token)
+    start = time.perf_counter()
+    for i in range(args.cache_hits):
+        await verifier.claims(tokens[i % len(tokens)])
+    results["cache_hit_us"] = round((time.perf_counter() - start) / args.cache_hits * 1e6, 2)
+
+    results["stats"] = {key: value for key, value in verifier.stats().items() if key != "jwks"}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=2000, help="Signature checks per algorithm")
+    parser.add_argument("--cache-hits", type=int, default=200000)
+    parser.add_argument("--cache-size", type=int, default=10000)
+    args = parser.parse_args()
+
+    keys = signing_keys()
+    with tempfile.TemporaryDirectory() as tmp:
+        jwks_path = os.path.join(tmp, "jwks.json")
+        with open(jwks_path, "w") as f:
+            json.dump({"keys": [public for _, _, public in keys.values()]}, f)
+        results = asyncio.run(run(args, keys, jwks_path))
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Bloom filter benchmark
+Loads N anchored hashes into the qubic-service scalable Bloom filter and measures insert
+throughput, negative lookup cost, memory and the observed false-positive rate
+
+Usage:
+    python scripts/bench_bloom.py [--count 100000000] [--probes 1000000]
+
+The default of 100M hashes needs ~300MB of RAM and takes about 15 minutes in pure Python;
+use e.g. --count 1000000 for a quick run.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "qubic-service"))
+
+from bloom import ScalableBloomFilter  # noqa: E402
+
+def anchored_hash(i: int) -> str:
+    return hashlib.sha256(f"anchored:{i}".encode()).hexdigest()
+
+def absent_hash(i: int) -> str:
+    return hashlib.sha256(f"absent:{i}".encode()).hexdigest()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100_000_000)
+    parser.add_argument("--probes", type=int, default=1_000_000)
+    parser.add_argument("--capacity", type=int, default=1_000_000, help="Initial slice capacity")
+    parser.add_argument("--error-rate", type=float, default=0.001)
+    args = parser.parse_args()
+
+    bloom = ScalableBloomFilter(args.capacity, args.error_rate)
+
+    start = time.perf_counter()
+    report_every = max(1, args.count // 10)
+    for i in range(args.count):
+        bloom.add(anchored_hash(i))
+        if (i + 1) % report_every == 0:
+            print(f"  inserted {i + 1:,} ({(i + 1) / (time.perf_counter() - start):,.0f}/s)", file=sys.stderr)
+    insert_s = time.perf_counter() - start
+
+    # Hashes that were never anchored: every hit is a false positive
+    start = time.perf_counter()
+    false_positives = sum(1 for i in range(args.probes) if absent_hash(i) in bloom)
+    negative_s = time.perf_counter() - start
+
+    probes = min(args.probes, args.count)
+    start = time.perf_counter()
+    misses = sum(1 for i in range(probes) if anchored_hash(i) not in bloom)
+    positive_s = time.perf_counter() - start
+
+    print(json.dumps({
+        "anchored": args.count,
+        "slices": len(bloom.slices),
+        "memory_mb": round(bloom.memory_bytes() / 1024 / 1024, 1),
+        "insert_per_s": round(args.count / insert_s),
+        "negative_lookup_us": round(negative_s / args.probes * 1e6, 3),
+        "positive_lookup_us": round(positive_s / probes * 1e6, 3),
+        "observed_fp_rate": false_positives / args.probes,
+        "estimated_fp_rate": bloom.estimated_fp_rate(),
+        "false_negatives": misses
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+End-to-end benchmark
+Drives task mixes through the whole stack open-loop and reports throughput and latency per
+scenario, per gateway endpoint and per service hop
+
+By default the six services are started as local processes against an in-memory Redis
+(fakeredis, in its own process) and a SQLite audit database, so no infrastructure is needed.
+--external targets a running stack on the docker-compose ports instead.
+
+Requests are issued at --rate per second whatever the response times, and scenario latency
+is measured from the scheduled start, so a slow stack shows up as latency, not as a lower
+request rate. Per-hop latencies come from each service's GET /workers route histograms.
+
+Usage:
+    python scripts/bench_e2e.py [--rate 20] [--duration 30] [--mix monitor_wallet=6,transfer_funds=3,approval=1]
+    python scripts/bench_e2e.py --output current.json --compare baseline.json [--tolerance 0.2]
+    python scripts/bench_e2e.py --trace   # then scripts/trace_summary.py on the printed span file
+    python scripts/bench_e2e.py --external [--host localhost]
+"""
+
+import os
+import sys
+import time
+import json
+import uuid
+import random
+import socket
+import signal
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+import multiprocessing
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "api-gateway"))
+
+import serve  # noqa: E402
+
+# (service, port offset) in start-up order; offsets match docker-compose
+SERVICES = [
+    ("qubic-service", 1),
+    ("audit-service", 2),
+    ("worker-service", 3),
+    ("planner-service", 4),
+    ("agent-runtime", 5),
+    ("api-gateway", 0)
+]
+
+DEFAULT_MIX = "monitor_wallet=6,transfer_funds=3,approval=1"
+
+# Load generation
+
+class Recorder:
+    """Latency samples in ms and error counts, keyed by scenario or endpoint"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def observe(self, key: str, elapsed_ms: float, ok: bool):
+        self.samples[key].append(elapsed_ms)
+        if not ok:
+            self.errors[key] += 1
+
+    def summary(self, duration: float) -> Dict[str, Dict[str, Any]]:
+        return {key: {**summarize(samples, duration), "errors": self.errors[key]}
+                for key, samples in sorted(self.samples.items())}
+
+def quantile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def summarize(samples: List[float], duration: float) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "throughput_per_s": round(len(ordered) / duration, 2),
+        "mean_ms": round(sum(ordered) / len(ordered), 2),
+        "p50_ms": round(quantile(ordered, 0.50), 2),
+        "p95_ms": round(quantile(ordered, 0.95), 2),
+        "p99_ms": round(quantile(ordered, 0.99), 2),
+        "max_ms": round(ordered[-1], 2)
+    }
+
+class ScenarioFailed(Exception):
+    pass
+
+async def call(client: httpx.AsyncClient, endpoints: Recorder, endpoint: str, method: str, path: str,
+               **kwargs) -> Dict[str, Any]:
+    """One gateway request, timed under its endpoint template; raises on an error response"""
+    start = time.perf_counter()
+    try:
+        response = await client.request(method, path, **kwargs)
+    except httpx.HTTPError as e:
+        endpoints.observe(endpoint, (time.perf_counter() - start) * 1000, False)
+        raise ScenarioFailed(f"{endpoint}: {e!r}")
+    endpoints.observe(endpoint, (time.perf_counter() - start) * 1000, response.status_code < 400)
+    if response.status_code >= 400:
+        raise ScenarioFailed(f"{endpoint}: HTTP {response.status_code}")
+    return response.json()
+
+def wallet() -> str:
+    return f"0x{uuid.uuid4().hex[:16]}"
+
+async def start_task(client, endpoints, task_type: str, parameters: Dict[str, Any]) -> str:
+    result = await call(client, endpoints, "POST /task/start", "POST", "/task/start", json={
+        "task_type": task_type,
+        "wallet_address": parameters.get("wallet_address"),
+        "description": f"bench {task_type}",
+        "parameters": parameters
+    })
+    return result["task_id"]
+
+async def monitor_wallet(client, endpoints):
+    """Monitoring task: runs every step straight through"""
+    await start_task(client, endpoints, "monitor_wallet", {"wallet_address": wallet()})
+
+async def transfer_funds(client, endpoints):
+    """Low-value transfer: auto-approved while within the velocity limits"""
+    await start_task(client, endpoints, "transfer_funds", {
+        "wallet_address": wallet(), "to_address": wallet(), "amount": random.choice([10, 25, 50])
+    })
+
+async def approval(client, endpoints):
+    """High-value transfer: waits for approval, is polled, then approved by an operator"""
+    task_id = await start_task(client, endpoints, "transfer_funds", {
+        "wallet_address": wallet(), "to_address": wallet(), "amount": 5000
+    })
+    status = await call(client, endpoints, "GET /task/{task_id}", "GET", f"/task/{task_id}")
+    if status.get("requires_approval"):
+        await call(client, endpoints, "POST /task/{task_id}/approve", "POST", f"/task/{task_id}/approve",
+                   json={"approved": True, "reason": "bench"})
+
+SCENARIOS = {
+    "monitor_wallet": monitor_wallet,
+    "transfer_funds": transfer_funds,
+    "approval": approval
+}
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for entry in mix.split(","):
+        name, _, weight = entry.partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+async def run_load(base_url: str, args) -> Dict[str, Any]:
+    """Open loop: start scenarios on a fixed (or Poisson) schedule regardless of completions"""
+    weights = parse_mix(args.mix)
+    names, cumulative = list(weights), list(weights.values())
+    scenarios, endpoints = Recorder(), Recorder()
+    failures: Dict[str, int] = defaultdict(int)
+    dropped = 0
+    rng = random.Random(args.seed)
+
+    async def run_one(name: str, scheduled: float, client: httpx.AsyncClient):
+        ok = True
+        try:
+            await SCENARIOS[name](client, endpoints)
+        except ScenarioFailed as e:
+            ok = False
+            failures[str(e)] += 1
+        scenarios.observe(name, (loop.time() - scheduled) * 1000, ok)
+
+    loop = asyncio.get_running_loop()
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=args.timeout) as client:
+        in_flight = set()
+        start = loop.time()
+        scheduled = start
+        while scheduled - start < args.duration:
+            await asyncio.sleep(max(0.0, scheduled - loop.time()))
+            if len(in_flight) >= args.max_in_flight:
+                dropped += 1
+            else:
+                name = rng.choices(names, weights=cumulative)[0]
+                task = asyncio.create_task(run_one(name, scheduled, client))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+            gap = rng.expovariate(args.rate) if args.poisson else 1.0 / args.rate
+            scheduled += gap
+        await asyncio.gather(*in_flight)
+        elapsed = loop.time() - start
+
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "dropped": dropped,
+        "failures": dict(failures),
+        "scenarios": scenarios.summary(elapsed),
+        "endpoints": endpoints.summary(elapsed)
+    }
+
+# Per-hop latencies from the services' own route histograms
+
+def route_histograms(urls: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    histograms = {}
+    for service, url in urls.items():
+        try:
+            histograms[service] = httpx.get(f"{url}/workers", timeout=5.0).json().get("routes", {})
+        except (httpx.HTTPError, ValueError):
+            histograms[service] = {}
+    return histograms
+
+def hop_latencies(before: Dict[str, Dict], after: Dict[str, Dict]) -> Dict[str, Dict[str, Any]]:
+    """Server-side latency of every route hit during the run, per service"""
+    hops = {}
+    for service, routes in after.items():
+        for route, current in routes.items():
+            if route in ("GET /workers", "unmatched"):
+                continue
+            previous = before.get(service, {}).get(route, {"buckets": [0] * len(current["buckets"]), "total_ms": 0.0})
+            buckets = [a - b for a, b in zip(current["buckets"], previous["buckets"])]
+            if sum(buckets):
+                hops[f"{service} {route}"] = serve.summarize(buckets, current["total_ms"] - previous["total_ms"])
+    return hops
+
+# Local stack
+
+def free_port_base(count: int = 6) -> int:
+    for _ in range(50):
+        base = random.randint(20000, 40000)
+        try:
+            for offset in range(count + 1):
+                with socket.socket() as sock:
+                    sock.bind(("127.0.0.1", base + offset))
+            return base
+        except OSError:
+            continue
+    raise RuntimeError("No free port range")
+
+def serve_fake_redis(port: int):
+    """In-memory Redis stand-in, in its own process so it does not share the load generator's GIL"""
+    import fakeredis
+    server = fakeredis.TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    server.daemon_threads = True
+    server.serve_forever()
+
+class LocalStack:
+    def __init__(self, args):
+        self.args = args
+        self.base = free_port_base()
+        self.workdir = tempfile.mkdtemp(prefix="qubic-bench-")
+        self.redis_port = self.base + 6
+        self.trace_file = os.path.join(self.workdir, "traces.jsonl")
+        self.processes: List[subprocess.Popen] = []
+        self.redis_process: Optional[multiprocessing.Process] = None
+
+    def url(self, service: str) -> str:
+        return f"http://127.0.0.1:{self.base + dict(SERVICES)[service]}"
+
+    def urls(self) -> Dict[str, str]:
+        return {service: self.url(service) for service, _ in SERVICES}
+
+    def env(self, service: str) -> Dict[str, str]:
+        env = dict(
+            os.environ,
+            PORT=str(self.base + dict(SERVICES)[service]),
+            LOG_LEVEL=self.args.log_level,
+            REDIS_URL=f"redis://127.0.0.1:{self.redis_port}/0",
+            DATABASE_URL=f"sqlite:///{os.path.join(self.workdir, 'audit.db')}",
+            SERVE_STATE_DIR=os.path.join(self.workdir, "serve"),
+            QUBIC_SERVICE_URL=self.url("qubic-service"),
+            AUDIT_SERVICE_URL=self.url("audit-service"),
+            WORKER_SERVICE_URL=self.url("worker-service"),
+            PLANNER_SERVICE_URL=self.url("planner-service"),
+            AGENT_RUNTIME_URL=self.url("agent-runtime"),
+            WEB_CONCURRENCY="1",
+            # Every scenario runs as the same stub user; measure the pipeline, not the rate limit
+            RATE_LIMIT_PER_SECOND="0"
+        )
+        if importlib.util.find_spec("lupa") is None:
+            # fakeredis runs Lua scripts only with lupa installed
+            env["VELOCITY_MODE"] = "local"
+            env["RATE_LIMIT_MODE"] = "local"
+        if service == "api-gateway":
+            env["WEB_CONCURRENCY"] = str(self.args.gateway_workers)
+        if self.args.trace:
+            env["TRACE_EXPORTER"] = "file"
+            env["TRACE_FILE"] = self.trace_file
+        for override in self.args.env:
+            key, _, value = override.partition("=")
+            env[key] = value
+        return env
+
+    def wait_ready(self, service: str, process: subprocess.Popen, timeout: float = 30.0):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{service} exited with status {process.returncode}")
+            try:
+                if httpx.get(f"{self.url(service)}/workers", timeout=1.0).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{service} did not become ready")
+
+    def start(self):
+        self.redis_process = multiprocessing.Process(target=serve_fake_redis, args=(self.redis_port,), daemon=True)
+        self.redis_process.start()
+
+        # Tables normally come from Alembic migrations
+        subprocess.run(
+            [sys.executable, "-c", "import main; main.Base.metadata.create_all(main.engine)"],
+            cwd=os.path.join(ROOT, "audit-service"), env=self.env("audit-service"),
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        for service, _ in SERVICES:
+            log = open(os.path.join(self.workdir, f"{service}.log"), "w")
+            process = subprocess.Popen(
+                [sys.executable, "main.py"], cwd=os.path.join(ROOT, service), env=self.env(service),
+                stdout=log, stderr=subprocess.STDOUT
+            )
+            self.processes.append(process)
+            self.wait_ready(service, process)
+
+    def stop(self):
+        for process in reversed(self.processes):
+            process.send_signal(signal.SIGTERM)
+        for process in self.processes:
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.redis_process is not None:
+            self.redis_process.terminate()
+
+# Regression comparison
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Latency percentiles more than tolerance above the baseline, or throughput below it"""
+    regressions = []
+    for section in ("scenarios", "endpoints", "hops"):
+        for key, before in baseline.get(section, {}).items():
+            after = current.get(section, {}).get(key)
+            if after is None:
+                continue
+            for metric in ("p50_ms", "p95_ms", "p99_ms"):
+                if before.get(metric) and after.get(metric) and after[metric] > before[metric] * (1 + tolerance):
+                    regressions.append(f"{section} {key} {metric}: {before[metric]} -> {after[metric]}")
+            if section == "scenarios" and after["throughput_per_s"] < before["throughput_per_s"] * (1 - tolerance):
+                regressions.append(f"{section} {key} throughput_per_s: {before['throughput_per_s']} -> {after['throughput_per_s']}")
+            if after.get("errors", 0) > before.get("errors", 0):
+                regressions.append(f"{section} {key} errors: {before.get('errors', 0)} -> {after['errors']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=20.0, help="Scenarios started per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds of load")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds of unrecorded load first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals instead of a fixed interval")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Scenarios beyond this are dropped and counted")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--gateway-workers", type=int, default=1)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for every local service")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--trace", action="store_true", help="Record spans from every service (see scripts/trace_summary.py)")
+    parser.add_argument("--external", action="store_true", help="Benchmark a running stack")
+    parser.add_argument("--host", default="localhost", help="Host of the running stack")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--compare", help="Baseline JSON report; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    stack = None
+    if args.external:
+        urls = {service: f"http://{args.host}:{8000 + offset}" for service, offset in SERVICES}
+    else:
+        stack = LocalStack(args)
+        print(f"Starting services on ports {stack.base}-{stack.base + 5} (logs in {stack.workdir})", file=sys.stderr)
+        stack.start()
+        urls = stack.urls()
+
+    try:
+        if args.warmup > 0:
+            asyncio.run(run_load(urls["api-gateway"], argparse.Namespace(**{**vars(args), "duration": args.warmup})))
+        before = route_histograms(urls)
+        result = asyncio.run(run_load(urls["api-gateway"], args))
+        result["hops"] = hop_latencies(before, route_histograms(urls))
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    report = {
+        "config": {
+            "rate": args.rate,
+            "duration": args.duration,
+            "mix": parse_mix(args.mix),
+            "poisson": args.poisson,
+            "gateway_workers": args.gateway_workers,
+            "external": args.external,
+            "cpus": os.cpu_count()
+        },
+        **result
+    }
+    print(json.dumps(report, indent=2))
+    if stack is not None and args.trace:
+        print(f"Spans written to {stack.trace_file}", file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} of {args.compare}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Event loop lag benchmark
+Measures how long hashing ~1MB payloads stalls the event loop for each executor mode
+
+Usage:
+    python scripts/bench_event_loop_lag.py [--size-kb 1024] [--requests 20]
+"""
+
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "worker-service"))
+
+import executor  # noqa: E402
+
+def build_payload(size_kb: int) -> dict:
+    """Build a nested context of roughly size_kb kilobytes"""
+    entries = max(1, size_kb * 1024 // 128)
+    return {
+        "step": {"step_id": "1", "type": "check_balance"},
+        "context": {
+            f"entry_{i}": {"wallet": f"0x{i:040x}", "note": "x" * 64}
+            for i in range(entries)
+        }
+    }
+
+async def monitor_lag(stop: asyncio.Event, samples: list, interval: float = 0.001):
+    """Record how late each 1ms tick fires"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected) * 1000)
+
+async def run_mode(mode: str, payload: dict, requests: int) -> dict:
+    executor.HASH_EXECUTOR_MODE = mode
+    # Warm up pools so pool start-up cost is not counted
+    await executor.hash_data_async(payload)
+
+    samples = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_lag(stop, samples))
+    start = time.perf_counter()
+    await asyncio.gather(*(executor.hash_data_async(payload) for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await monitor
+
+    samples = samples or [0.0]
+    return {
+        "mode": mode,
+        "elapsed_s": round(elapsed, 3),
+        "ticks": len(samples),
+        "lag_p50_ms": round(statistics.median(samples), 2),
+        "lag_max_ms": round(max(samples), 2)
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-kb", type=int, default=1024)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    payload = build_payload(args.size_kb)
+    actual_kb = len(executor.canonical_json(payload)) // 1024
+    print(f"Payload: {actual_kb} KB, {args.requests} concurrent hashes, threshold {executor.HASH_OFFLOAD_THRESHOLD} bytes")
+
+    results = []
+    for mode in ("inline", "thread", "process"):
+        results.append(await run_mode(mode, payload, args.requests))
+    executor.shutdown()
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,119 @@
+"""
+Gateway worker scaling benchmark
+Measures API gateway requests/sec against WEB_CONCURRENCY
+
+Starts the gateway once per worker count and drives it with closed-loop HTTP clients spread
+over several load-generator processes. /health needs Redis; use --path /openapi.json to
+measure the serving stack alone.
+
+Usage:
+    python scripts/bench_gateway_workers.py [--workers 1,2,4] [--duration 10] [--connections 64]
+"""
+
+import os
+import sys
+import time
+import json
+import signal
+import asyncio
+import argparse
+import subprocess
+import multiprocessing
+
+import httpx
+
+GATEWAY_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api-gateway")
+
+async def drive(url: str, connections: int, duration: float) -> dict:
+    """Closed loop: each connection sends its next request as soon as the last one returns"""
+    deadline = time.perf_counter() + duration
+    counts = {"ok": 0, "errors": 0}
+
+    async def connection(client: httpx.AsyncClient):
+        while time.perf_counter() < deadline:
+            try:
+                response = await client.get(url)
+                counts["ok" if response.status_code < 500 else "errors"] += 1
+            except httpx.HTTPError:
+                counts["errors"] += 1
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(limits=limits, timeout=10.0) as client:
+        await asyncio.gather(*(connection(client) for _ in range(connections)))
+    return counts
+
+def load_process(url: str, connections: int, duration: float, results):
+    results.put(asyncio.run(drive(url, connections, duration)))
+
+def wait_ready(base_url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{base_url}/workers", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Gateway did not become ready")
+
+def run_workers(workers: int, args) -> dict:
+    env = dict(os.environ, PORT=str(args.port), WEB_CONCURRENCY=str(workers), LOG_LEVEL="WARNING")
+    gateway = subprocess.Popen(
+        [sys.executable, "main.py"],
+        cwd=GATEWAY_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_ready(base_url)
+        # Let every worker finish starting before measuring
+        time.sleep(1.0)
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=load_process,
+                args=(base_url + args.path, args.connections // args.clients, args.duration, results)
+            )
+            for _ in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        counts = [results.get() for _ in clients]
+        for client in clients:
+            client.join()
+    finally:
+        gateway.send_signal(signal.SIGTERM)
+        gateway.wait(timeout=60)
+
+    ok = sum(count["ok"] for count in counts)
+    errors = sum(count["errors"] for count in counts)
+    return {
+        "workers": workers,
+        "requests": ok,
+        "errors": errors,
+        "requests_per_s": round(ok / args.duration, 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--connections", type=int, default=64)
+    parser.add_argument("--clients", type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="Load-generator processes")
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, GET {args.path}, {args.connections} connections from {args.clients} processes, {args.duration}s per run")
+    results = [run_workers(int(workers), args) for workers in args.workers.split(",")]
+    baseline = results[0]["requests_per_s"] or 1
+    for result in results:
+        result["speedup"] = round(result["requests_per_s"] / baseline, 2)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
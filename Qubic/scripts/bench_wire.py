@@ -0,0 +1,164 @@
+"""
+Wire format benchmark
+Measures the serialization CPU one task spends across the internal hops of the pipeline
+(gateway -> planner -> runtime -> worker/audit -> qubic) for each way bodies can travel
+
+Usage:
+    python scripts/bench_wire.py [--tasks 2000] [--steps 3] [--context-kb 4]
+
+Per hop, the cost counted is what both ends do with the bodies: the caller encodes the
+request, the service decodes and validates it, encodes its response, and the caller decodes
+that. Modes:
+
+    json                 stdlib json, as before wire.py
+    orjson               WIRE_FORMAT=json: orjson both ways
+    msgpack              WIRE_FORMAT=msgpack
+    msgpack-unvalidated  msgpack with models built by model_construct instead of validated,
+                         as skipping validation for trusted callers would; with pydantic v2
+                         this is no cheaper, which is why the services always validate
+
+Needs the services' requirements (msgpack, orjson, pydantic).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "api-gateway"))
+
+from pydantic import BaseModel  # noqa: E402
+import wire  # noqa: E402
+
+# The request models of the hops, with the same fields as in the services
+
+class PlanRequest(BaseModel):
+    task_id: str
+    task_type: str
+    description: str
+    parameters: Dict[str, Any]
+
+class PlanExecuteRequest(BaseModel):
+    task_id: str
+    plan: Dict[str, Any]
+    user_id: Optional[str] = None
+    task_type: Optional[str] = None
+    priority: Optional[str] = None
+
+class ExecuteRequest(BaseModel):
+    task_id: str
+    step: Dict[str, Any]
+    context: Dict[str, Any]
+
+class AuditRecordRequest(BaseModel):
+    task_id: str
+    step_index: int
+    step_type: str
+    input_data: Dict[str, Any]
+    output_data: Dict[str, Any]
+    input_hash: Optional[str] = None
+    output_hash: Optional[str] = None
+
+class WriteRequest(BaseModel):
+    hash: str
+    metadata: Dict[str, Any]
+
+def task_hops(task_id: str, steps: int, context_kb: int) -> List[tuple]:
+    """(model, request body, response body) for every internal call one task makes"""
+    now = datetime.utcnow().isoformat()
+    history = {f"entry_{i}": {"wallet": f"0x{i:040x}", "note": "x" * 64} for i in range(context_kb * 1024 // 128)}
+    parameters = {"wallet_address": "0x1234567890abcdef", "to_address": "0xfedcba0987654321", "amount": 25.0}
+    plan = {
+        "plan_id": f"plan-{task_id}",
+        "task_id": task_id,
+        "created_at": now,
+        "steps": [
+            {"step_id": str(i), "type": "onchain_action" if i == steps - 1 else "check_balance",
+             "requires_approval": i == steps - 1, "parameters": parameters}
+            for i in range(steps)
+        ]
+    }
+    hops = [
+        (PlanRequest, {"task_id": task_id, "task_type": "transfer_funds", "description": "Send 25 ETH",
+                       "parameters": parameters}, plan),
+        (PlanExecuteRequest, {"task_id": task_id, "plan": plan, "user_id": "demo_user",
+                              "task_type": "transfer_funds", "priority": None},
+         {"task_id": task_id, "status": "completed", "priority": "interactive", "message": "Plan execution started"})
+    ]
+    for step in plan["steps"]:
+        result = {"balance": "1000.0", "currency": "ETH", "last_updated": now}
+        input_data = {"step": step, "context": history}
+        hashes = {"input_hash": "a" * 64, "output_hash": "b" * 64}
+        audit_response = {"id": 1, "task_id": task_id, "step_index": int(step["step_id"]), **hashes,
+                          "qubic_txid": "c" * 64}
+        audit_request = {"task_id": task_id, "step_index": int(step["step_id"]), "step_type": step["type"],
+                         "input_data": input_data, "output_data": result}
+        write = {"hash": "b" * 64, "metadata": {"task_id": task_id, "step_index": int(step["step_id"]),
+                                                "step_type": step["type"], "input_hash": "a" * 64, "timestamp": now}}
+        hops += [
+            (ExecuteRequest, {"task_id": task_id, "step": step, "context": history},
+             {"status": "completed", "result": result, "error": None, **hashes}),
+            # The worker's audit copy and the runtime's audit agent, each anchored in Qubic
+            (AuditRecordRequest, {**audit_request, **hashes}, audit_response),
+            (WriteRequest, write, {"txid": "c" * 64, "status": "confirmed"}),
+            (AuditRecordRequest, audit_request, audit_response),
+            (WriteRequest, write, {"txid": "c" * 64, "status": "confirmed"})
+        ]
+    return hops
+
+def stdlib_dumps(payload: Any) -> bytes:
+    # As httpx sends json= bodies and Starlette renders JSONResponse
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode()
+
+def run_hop(mode: str, model, request: Dict, response: Dict) -> int:
+    """One round trip; returns bytes on the wire"""
+    if mode == "json":
+        body = stdlib_dumps(request)
+        model.model_validate(json.loads(body))
+        reply = stdlib_dumps(response)
+        json.loads(reply)
+        return len(body) + len(reply)
+    format = "json" if mode == "orjson" else "msgpack"
+    content_type = wire.MSGPACK if format == "msgpack" else wire.JSON
+    body = wire.dumps(request, format)
+    data = wire.loads(body, content_type)
+    if mode == "msgpack-unvalidated":
+        model.model_construct(**data)
+    else:
+        model.model_validate(data)
+    reply = wire.dumps(response, format)
+    wire.loads(reply, content_type)
+    return len(body) + len(reply)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--steps", type=int, default=3, help="Plan steps per task")
+    parser.add_argument("--context-kb", type=int, default=4, help="Size of the context passed to each step")
+    args = parser.parse_args()
+
+    tasks = [task_hops(f"task-{i}", args.steps, args.context_kb) for i in range(args.tasks)]
+    results = {}
+    for mode in ("json", "orjson", "msgpack", "msgpack-unvalidated"):
+        wire_bytes = 0
+        start = time.process_time()
+        for hops in tasks:
+            for model, request, response in hops:
+                wire_bytes += run_hop(mode, model, request, response)
+        cpu = time.process_time() - start
+        results[mode] = {
+            "cpu_us_per_task": round(cpu / args.tasks * 1e6, 1),
+            "kb_per_task": round(wire_bytes / args.tasks / 1024, 1)
+        }
+    baseline = results["json"]["cpu_us_per_task"]
+    for mode in results:
+        results[mode]["vs_json"] = round(results[mode]["cpu_us_per_task"] / baseline, 2)
+
+    print(json.dumps({"hops_per_task": len(tasks[0]), "steps": args.steps, "context_kb": args.context_kb,
+                      "modes": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Shared module check
+Each service is built from its own directory, so modules used by several services are copied
+into each of them; this fails if any copy has drifted from the others
+
+Usage:
+    python scripts/check_shared_modules.py
+
+Edit one copy, then copy it over the others listed below for that module. Exits 1 and names
+the copies that differ when they are not all identical, or when one is missing.
+"""
+
+import os
+import sys
+import hashlib
+from collections import defaultdict
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ALL_SERVICES = ("api-gateway", "planner-service", "agent-runtime", "worker-service", "audit-service", "qubic-service")
+
+# Module -> the services carrying a copy of it
+SHARED_MODULES = {
+    "serve.py": ALL_SERVICES,
+    "metrics.py": ALL_SERVICES,
+    "tracing.py": ALL_SERVICES,
+    "profiling.py": ALL_SERVICES,
+    "deadlines.py": ALL_SERVICES,
+    "wire.py": ALL_SERVICES,
+    "resilience.py": ("api-gateway", "planner-service", "agent-runtime", "worker-service", "audit-service"),
+    "executor.py": ("worker-service", "audit-service", "qubic-service"),
+    "policy_client.py": ("planner-service", "worker-service"),
+    "velocity.py": ("agent-runtime", "qubic-service", "planner-service"),
+    "rule_engine.py": ("qubic-service", "planner-service")
+}
+
+def digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def check(module: str, services: tuple) -> List[str]:
+    """Problems with one module's copies; empty when they are all present and identical"""
+    copies: Dict[str, List[str]] = defaultdict(list)  # digest -> services
+    problems = []
+    for service in services:
+        path = os.path.join(ROOT, service, module)
+        if not os.path.exists(path):
+            problems.append(f"{module}: missing from {service}")
+            continue
+        copies[digest(path)].append(service)
+    if len(copies) > 1:
+        variants = sorted(copies.values(), key=len, reverse=True)
+        problems.append(f"{module}: {len(copies)} different versions: " +
+                        "; ".join(", ".join(group) for group in variants))
+    return problems
+
+def main() -> int:
+    problems = []
+    for module, services in SHARED_MODULES.items():
+        problems += check(module, services)
+    for problem in problems:
+        print(problem)
+    if problems:
+        return 1
+    print(f"{len(SHARED_MODULES)} shared modules identical across services")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
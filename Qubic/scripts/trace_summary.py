@@ -0,0 +1,109 @@
+"""
+Trace summary
+Latency per span and the self time behind the slowest traces, from TRACE_EXPORTER=file output
+
+Self time is a span's duration minus the time covered by its children, so in the slowest
+traces it shows which hop the time was actually spent in rather than waited through.
+
+Usage:
+    python scripts/trace_summary.py traces.jsonl [more.jsonl ...] [--root "POST /task/start"] [--quantile 0.99]
+"""
+
+import json
+import argparse
+from collections import defaultdict
+from typing import Any, Dict, List
+
+def load(paths: List[str]) -> List[Dict[str, Any]]:
+    spans = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    spans.append(json.loads(line))
+    return spans
+
+def quantile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+def covered_ns(intervals: List[tuple]) -> int:
+    """Length of the union of (start, end) intervals"""
+    total = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+def summarize(spans: List[Dict[str, Any]], root_name: str, q: float) -> Dict[str, Any]:
+    by_name: Dict[str, List[float]] = defaultdict(list)
+    for span in spans:
+        by_name[f"{span['service']} {span['name']}"].append(span["duration_ms"])
+    latency = {}
+    for key, durations in sorted(by_name.items()):
+        durations.sort()
+        latency[key] = {
+            "count": len(durations),
+            "p50_ms": round(quantile(durations, 0.50), 2),
+            "p95_ms": round(quantile(durations, 0.95), 2),
+            "p99_ms": round(quantile(durations, 0.99), 2)
+        }
+
+    traces: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    for span in spans:
+        traces[span["trace_id"]].append(span)
+    roots = []
+    for trace_spans in traces.values():
+        ids = {span["span_id"] for span in trace_spans}
+        for span in trace_spans:
+            if (span["parent_id"] is None or span["parent_id"] not in ids) and (not root_name or span["name"] == root_name):
+                roots.append(span)
+    if not roots:
+        return {"latency": latency, "slow_traces": 0}
+
+    threshold = quantile(sorted(root["duration_ms"] for root in roots), q)
+    slow = [root for root in roots if root["duration_ms"] >= threshold]
+    self_time: Dict[str, float] = defaultdict(float)
+    total = 0.0
+    for root in slow:
+        trace_spans = traces[root["trace_id"]]
+        children: Dict[str, List[tuple]] = defaultdict(list)
+        for span in trace_spans:
+            if span["parent_id"]:
+                children[span["parent_id"]].append((span["start_ns"], span["end_ns"]))
+        for span in trace_spans:
+            own = span["end_ns"] - span["start_ns"] - covered_ns(children.get(span["span_id"], []))
+            self_time[f"{span['service']} {span['name']}"] += max(0, own) / 1e6
+        total += root["duration_ms"]
+
+    owners = sorted(self_time.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "latency": latency,
+        "root": root_name or "any",
+        "quantile": q,
+        "threshold_ms": round(threshold, 2),
+        "slow_traces": len(slow),
+        "self_time": [
+            {"span": key, "mean_ms": round(ms / len(slow), 2), "share": round(ms / total, 3) if total else None}
+            for key, ms in owners
+        ]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--root", default="POST /task/start", help="Root span name ('' for any)")
+    parser.add_argument("--quantile", type=float, default=0.99)
+    args = parser.parse_args()
+
+    print(json.dumps(summarize(load(args.files), args.root, args.quantile), indent=2))
+
+if __name__ == "__main__":
+    main()
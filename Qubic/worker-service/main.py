@@ -4,6 +4,7 @@ Task execution workers with mock connectors
 """
 
 import os
+import asyncio
 import logging
 import httpx
 from fastapi import FastAPI, HTTPException
@@ -13,6 +14,15 @@ import redis
 import json
 import hashlib
 from datetime import datetime
+import executor
+from policy_client import PolicyCache
+import serve
+import tracing
+import metrics
+import profiling
+import deadlines
+import resilience
+import wire
 
 # Configure logging
 logging.basicConfig(
@@ -26,10 +36,20 @@ app = FastAPI(title="Worker Service", version="1.0.0")
 # Configuration
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 AUDIT_SERVICE_URL = os.getenv("AUDIT_SERVICE_URL", "http://localhost:8002")
+QUBIC_SERVICE_URL = os.getenv("QUBIC_SERVICE_URL", "http://localhost:8001")
+POLICY_CACHE_TTL = float(os.getenv("POLICY_CACHE_TTL", "30"))
 
 # Redis client
 redis_client = redis.from_url(REDIS_URL, decode_responses=True)
 
+# Qubic policy cache
+policy_cache = PolicyCache(QUBIC_SERVICE_URL, ttl=POLICY_CACHE_TTL)
+
+# Metrics
+STEP_HANDLER_SECONDS = metrics.Histogram(
+    "qubic_worker_step_duration_seconds", "Step handler latency by step type", ("step_type",)
+)
+
 # Request/Response models
 class ExecuteRequest(BaseModel):
     task_id: str
@@ -53,11 +73,6 @@ MOCK_WALLETS = {
 }
 
 # Worker functions
-def hash_data(data: Dict) -> str:
-    """Generate SHA-256 hash of data"""
-    data_str = json.dumps(data, sort_keys=True)
-    return hashlib.sha256(data_str.encode()).hexdigest()
-
 async def check_balance(step: Dict, context: Dict) -> Dict:
     """Check wallet balance"""
     logger.info("Executing check_balance")
@@ -84,11 +99,28 @@ async def policy_check(step: Dict, context: Dict) -> Dict:
     """Policy check (already done in planner, but verify)"""
     logger.info("Executing policy_check")
     
-    policy_id = step.get("parameters", {}).get("policy_id")
+    parameters = step.get("parameters", {})
+    policy_id = parameters.get("policy_id")
+    action_type = parameters.get("action_type")
+    status = "verified"
+    
+    if action_type:
+        try:
+            policy = await policy_cache.get(action_type)
+        except httpx.HTTPError as e:
+            logger.warning(f"Policy verification unavailable: {e}")
+            policy = None
+            status = "unverified"
+        
+        if policy is not None:
+            if not policy.get("allowed", True):
+                raise ValueError(f"Policy {policy.get('policy_id')} does not allow {action_type}")
+            if policy_id and policy.get("policy_id") != policy_id:
+                raise ValueError(f"Policy mismatch: plan used {policy_id}, current is {policy.get('policy_id')}")
     
     return {
         "policy_id": policy_id,
-        "status": "verified",
+        "status": status,
         "timestamp": datetime.utcnow().isoformat()
     }
 
@@ -150,6 +182,21 @@ STEP_HANDLERS = {
     "generic_action": generic_action
 }
 
+@app.on_event("startup")
+async def startup_event():
+    """Warm the policy cache and subscribe to policy changes"""
+    try:
+        await policy_cache.warm()
+    except httpx.HTTPError as e:
+        logger.warning(f"Policy cache warm-up failed: {e}")
+    policy_cache.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release hashing executor pools and the policy cache"""
+    executor.shutdown()
+    await policy_cache.close()
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -176,8 +223,12 @@ async def execute_step(request: ExecuteRequest):
     handler = STEP_HANDLERS[step_type]
     
     try:
+        deadlines.check(f"{step_type} step")
+        
         # Execute step
-        result = await handler(request.step, request.context)
+        with tracing.span(f"step.{step_type}", task_id=request.task_id, step_id=str(request.step.get("step_id"))), \
+                STEP_HANDLER_SECONDS.labels(step_type).time():
+            result = await handler(request.step, request.context)
         
         # Generate hashes
         input_data = {
@@ -188,8 +239,10 @@ async def execute_step(request: ExecuteRequest):
             "result": result
         }
         
-        input_hash = hash_data(input_data)
-        output_hash = hash_data(output_data)
+        input_hash, output_hash = await asyncio.gather(
+            executor.hash_data_async(input_data),
+            executor.hash_data_async(output_data)
+        )
         
         # Store execution record (for retry logic)
         execution_key = f"execution:{request.task_id}:{request.step.get('step_id')}"
@@ -205,14 +258,16 @@ async def execute_step(request: ExecuteRequest):
         }
         redis_client.hset(execution_key, mapping=execution_data)
         
-        # Send to audit service (with retry)
-        max_retries = 3
-        for attempt in range(max_retries):
+        # Send to audit service (retried within the audit service's retry budget). The runtime's
+        # audit agent records the step too, so this copy is skipped when the budget is nearly spent
+        if deadlines.nearly_exhausted():
+            logger.warning(f"Skipping audit copy for task {request.task_id}, request budget nearly spent")
+        else:
             try:
                 async with httpx.AsyncClient(timeout=10.0) as client:
-                    audit_response = await client.post(
-                        f"{AUDIT_SERVICE_URL}/audit/record",
-                        json={
+                    audit_response = await resilience.request(
+                        client, "POST", f"{AUDIT_SERVICE_URL}/audit/record",
+                        **wire.body({
                             "task_id": request.task_id,
                             "step_index": int(request.step.get("step_id", 0)),
                             "step_type": step_type,
@@ -220,17 +275,11 @@ async def execute_step(request: ExecuteRequest):
                             "output_data": output_data,
                             "input_hash": input_hash,
                             "output_hash": output_hash
-                        }
+                        })
                     )
                     audit_response.raise_for_status()
-                    break
             except Exception as e:
-                if attempt == max_retries - 1:
-                    logger.error(f"Failed to send to audit service after {max_retries} attempts: {e}")
-                else:
-                    logger.warning(f"Audit service retry {attempt + 1}/{max_retries}: {e}")
-                    import asyncio
-                    await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                logger.error(f"Failed to send to audit service: {e}")
         
         return ExecuteResponse(
             status="success",
@@ -254,6 +303,10 @@ async def execute_step(request: ExecuteRequest):
         }
         redis_client.hset(execution_key, mapping=execution_data)
         
+        # The caller has stopped waiting; answer 504 rather than a step failure
+        if isinstance(e, deadlines.DeadlineExceeded):
+            raise
+        
         return ExecuteResponse(
             status="failed",
             error=str(e)
@@ -273,8 +326,15 @@ async def get_execution(task_id: str, step_id: str):
     
     return execution_data
 
+serve.install(app, "worker-service")
+tracing.install(app, "worker-service")
+metrics.install(app, "worker-service")
+profiling.install(app, "worker-service")
+deadlines.install(app, "worker-service")
+resilience.install(app)
+wire.install(app)
+
 if __name__ == "__main__":
-    import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    serve.run(app, port=port)
 
@@ -0,0 +1,166 @@
+"""
+Policy Client
+In-memory Qubic policy cache with conditional revalidation and push invalidation
+"""
+
+import json
+import time
+import asyncio
+import logging
+import httpx
+import resilience
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Called with (action_type, old_policy, new_policy) whenever a cached policy changes
+ChangeListener = Callable[[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]], None]
+
+class PolicyCache:
+    """Serves Qubic policies from memory, revalidating with If-None-Match once stale"""
+
+    def __init__(self, base_url: str, ttl: float = 30.0, timeout: float = 10.0):
+        self.base_url = base_url
+        self.ttl = ttl
+        self.timeout = timeout
+        self._entries: Dict[str, Dict[str, Any]] = {}  # action_type -> {"policy", "etag", "expires_at"}
+        self._listeners: List[ChangeListener] = []
+        self._client: Optional[httpx.AsyncClient] = None
+        self._listener_task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout)
+        return self._client
+
+    def add_listener(self, listener: ChangeListener):
+        """Register a callback fired when a cached policy changes or is invalidated"""
+        self._listeners.append(listener)
+
+    def _notify(self, action_type: str, old: Optional[Dict], new: Optional[Dict]):
+        for listener in self._listeners:
+            try:
+                listener(action_type, old, new)
+            except Exception as e:
+                logger.error(f"Policy change listener failed: {e}")
+
+    def _store(self, action_type: str, policy: Dict[str, Any], etag: Optional[str]):
+        old = self._entries.get(action_type)
+        self._entries[action_type] = {
+            "policy": policy,
+            "etag": etag or policy.get("etag"),
+            "expires_at": time.monotonic() + self.ttl
+        }
+        if old and old["etag"] != self._entries[action_type]["etag"]:
+            self._notify(action_type, old["policy"], policy)
+
+    async def get(self, action_type: str) -> Dict[str, Any]:
+        """Get the policy for an action type"""
+        entry = self._entries.get(action_type)
+        if entry and entry["expires_at"] > time.monotonic():
+            self.hits += 1
+            return entry["policy"]
+
+        headers = {}
+        if entry:
+            headers["If-None-Match"] = entry["etag"]
+            self.revalidations += 1
+        else:
+            self.misses += 1
+
+        try:
+            response = await resilience.request(
+                self._http(), "GET", "/policy", hedge=True, params={"action_type": action_type}, headers=headers
+            )
+            if response.status_code == 304 and entry:
+                entry["expires_at"] = time.monotonic() + self.ttl
+                return entry["policy"]
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            if entry:
+                # Serve stale rather than failing the caller while Qubic is unreachable
+                logger.warning(f"Policy revalidation failed for {action_type}, serving stale: {e}")
+                return entry["policy"]
+            raise
+
+        policy = response.json()
+        self._store(action_type, policy, response.headers.get("etag"))
+        return policy
+
+    async def warm(self, action_types: Optional[Iterable[str]] = None) -> int:
+        """Load many policies with a single bulk request"""
+        params = {}
+        if action_types:
+            params["action_types"] = ",".join(action_types)
+        response = await resilience.request(self._http(), "GET", "/policies", params=params)
+        response.raise_for_status()
+        policies = response.json().get("policies", [])
+        for policy in policies:
+            self._store(policy["action_type"], policy, policy.get("etag"))
+        return len(policies)
+
+    def invalidate(self, action_type: Optional[str] = None):
+        """Drop one cached policy, or all of them"""
+        targets = [action_type] if action_type else list(self._entries.keys())
+        for target in targets:
+            old = self._entries.pop(target, None)
+            if old:
+                self._notify(target, old["policy"], None)
+
+    async def _listen(self):
+        """Consume the Qubic policy change stream, invalidating on every push"""
+        backoff = 1.0
+        while True:
+            try:
+                async with httpx.AsyncClient(base_url=self.base_url, timeout=None) as client:
+                    async with client.stream("GET", "/policy/changes") as response:
+                        response.raise_for_status()
+                        backoff = 1.0
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            event = json.loads(line[5:].strip())
+                            action_type = event.get("action_type")
+                            if action_type:
+                                cached = self._entries.get(action_type)
+                                if cached is None or cached["etag"] != event.get("etag"):
+                                    logger.info(f"Policy {action_type} changed (version {event.get('version')})")
+                                    self.invalidate(action_type)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Policy change stream disconnected: {e}")
+            # Anything pushed while disconnected was missed; fall back to revalidation
+            for entry in self._entries.values():
+                entry["expires_at"] = 0.0
+            await asyncio.sleep(resilience.jitter(backoff))
+            backoff = min(backoff * 2, 30.0)
+
+    def start(self):
+        """Start listening for policy change notifications"""
+        if self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "misses": self.misses,
+            "listening": self._listener_task is not None and not self._listener_task.done()
+        }
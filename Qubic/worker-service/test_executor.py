@@ -0,0 +1,50 @@
+"""
+Executor tests
+Offloaded hashing and encoding give the inline results, and only large payloads leave the loop
+"""
+
+import asyncio
+import json
+import pytest
+import executor
+
+SMALL = {"b": 1, "a": [1, 2, {"c": "x"}]}
+LARGE = {"rows": [{"id": i, "value": "x" * 64} for i in range(2000)], "name": "large"}
+
+@pytest.fixture(autouse=True)
+def pools():
+    yield
+    executor.shutdown()
+
+@pytest.mark.parametrize("mode", ["inline", "thread", "process"])
+def test_every_mode_matches_the_inline_result(mode, monkeypatch):
+    monkeypatch.setattr(executor, "HASH_EXECUTOR_MODE", mode)
+
+    async def run(data):
+        return (await executor.hash_data_async(data), await executor.dumps_async(data, sort_keys=True),
+                await executor.sha256_hex_async(json.dumps(data).encode()))
+
+    for data in (SMALL, LARGE):
+        assert asyncio.run(run(data)) == (
+            executor.hash_data(data), json.dumps(data, sort_keys=True), executor.sha256_hex(json.dumps(data).encode())
+        )
+
+def test_hash_is_independent_of_key_order():
+    assert executor.hash_data({"a": 1, "b": 2}) == executor.hash_data({"b": 2, "a": 1})
+    assert executor.hash_data({"a": 1}) != executor.hash_data({"a": 2})
+
+def test_only_payloads_over_the_threshold_are_offloaded(monkeypatch):
+    monkeypatch.setattr(executor, "HASH_EXECUTOR_MODE", "thread")
+    asyncio.run(executor.hash_data_async(SMALL))
+    assert executor._thread_pool is None
+
+    asyncio.run(executor.hash_data_async(LARGE))
+    assert executor._thread_pool is not None
+    # Thread mode leaves encoding on the loop, since json.dumps holds the GIL
+    asyncio.run(executor.dumps_async(LARGE))
+    assert executor._process_pool is None
+
+def test_size_estimate_stops_at_the_limit():
+    assert executor.estimate_size(SMALL, 1 << 20) < 100
+    limit = 1024
+    assert limit <= executor.estimate_size(LARGE, limit) < limit + 200
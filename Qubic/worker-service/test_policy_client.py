@@ -0,0 +1,130 @@
+"""
+Policy client tests
+ETag revalidation, serving stale while Qubic is down, bulk warm-up and invalidation pushed over SSE
+"""
+
+import asyncio
+import functools
+import json
+import httpx
+import pytest
+import resilience
+from policy_client import PolicyCache
+
+def policy(action_type, etag, max_amount=1000):
+    return {"policy_id": f"policy_{action_type}", "action_type": action_type, "allowed": True,
+            "requires_approval": True, "rules": {"max_amount": max_amount}, "etag": etag}
+
+class FakeQubic:
+    """Serves GET /policy with conditional requests, GET /policies and a canned change stream"""
+
+    def __init__(self):
+        self.policies = {"transaction": policy("transaction", '"v1"')}
+        self.requests = []
+        self.down = False
+        self.stream = b""
+
+    def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        if self.down:
+            raise httpx.ConnectError("connection refused", request=request)
+        if request.url.path == "/policy":
+            current = self.policies[request.url.params["action_type"]]
+            if request.headers.get("if-none-match") == current["etag"]:
+                return httpx.Response(304, headers={"ETag": current["etag"]})
+            return httpx.Response(200, json=current, headers={"ETag": current["etag"]})
+        if request.url.path == "/policies":
+            return httpx.Response(200, json={"policies": list(self.policies.values())})
+        if request.url.path == "/policy/changes":
+            return httpx.Response(200, content=self.stream, headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(404)
+
+@pytest.fixture
+def qubic(request, monkeypatch):
+    server = FakeQubic()
+    transport = httpx.MockTransport(server.handle)
+    monkeypatch.setattr(httpx, "AsyncClient", functools.partial(httpx.AsyncClient, transport=transport))
+    monkeypatch.setattr(resilience, "RETRY_BACKOFF_MS", 1)
+    # A host per test, so breakers and retry budgets do not carry over
+    server.url = f"http://qubic-{request.node.name.replace('_', '-')}"
+    return server
+
+def test_fresh_hits_then_conditional_revalidation(qubic):
+    cache = PolicyCache(qubic.url, ttl=30)
+    changes = []
+    cache.add_listener(lambda action_type, old, new: changes.append((action_type, old["etag"], new["etag"])))
+
+    async def run():
+        first = await cache.get("transaction")
+        assert await cache.get("transaction") is first
+        assert len(qubic.requests) == 1 and "if-none-match" not in qubic.requests[0].headers
+
+        cache._entries["transaction"]["expires_at"] = 0.0
+        assert await cache.get("transaction") is first
+        assert qubic.requests[-1].headers["if-none-match"] == '"v1"'
+
+        qubic.policies["transaction"] = policy("transaction", '"v2"', max_amount=100)
+        cache._entries["transaction"]["expires_at"] = 0.0
+        updated = await cache.get("transaction")
+        await cache.close()
+        return updated
+
+    updated = asyncio.run(run())
+    assert updated["rules"]["max_amount"] == 100
+    assert changes == [("transaction", '"v1"', '"v2"')]
+    assert (cache.hits, cache.misses, cache.revalidations) == (1, 1, 2)
+
+def test_stale_policy_is_served_while_qubic_is_down(qubic):
+    cache = PolicyCache(qubic.url, ttl=30)
+
+    async def run():
+        await cache.get("transaction")
+        cache._entries["transaction"]["expires_at"] = 0.0
+        qubic.down = True
+        stale = await cache.get("transaction")
+        # Nothing cached to fall back on; a connect error, or CircuitOpen once the retries open the breaker
+        with pytest.raises(httpx.TransportError):
+            await cache.get("monitoring")
+        await cache.close()
+        return stale
+
+    assert asyncio.run(run())["etag"] == '"v1"'
+
+def test_warm_loads_every_policy_in_one_request(qubic):
+    qubic.policies["monitoring"] = policy("monitoring", '"m1"')
+    cache = PolicyCache(qubic.url)
+
+    async def run():
+        assert await cache.warm() == 2
+        await cache.get("monitoring")
+        await cache.close()
+
+    asyncio.run(run())
+    assert [request.url.path for request in qubic.requests] == ["/policies"]
+    assert cache.hits == 1
+
+def test_pushed_change_invalidates_only_a_different_etag(qubic):
+    qubic.policies["monitoring"] = policy("monitoring", '"m1"')
+    events = [{"version": 2, "action_type": "transaction", "etag": '"v2"'},
+              {"version": 2, "action_type": "monitoring", "etag": '"m1"'}]
+    qubic.stream = b"event: hello\ndata: {\"version\": 1}\n\n" + b"".join(
+        f"event: policy\ndata: {json.dumps(event)}\n\n".encode() for event in events
+    )
+    cache = PolicyCache(qubic.url)
+    invalidated = []
+    cache.add_listener(lambda action_type, old, new: invalidated.append(action_type) if new is None else None)
+
+    async def run():
+        await cache.warm()
+        cache.start()
+        for _ in range(100):
+            if invalidated:
+                break
+            await asyncio.sleep(0.01)
+        listening = cache.stats()["listening"]
+        await cache.close()
+        return listening
+
+    assert asyncio.run(run())
+    assert invalidated == ["transaction"]
+    assert "monitoring" in cache._entries